@@ -152,3 +152,48 @@ test('fetchActivePromptConfig returns null when none active', async () => {
   const config = await fetchActivePromptConfig(supabase);
   assertEquals(config, null);
 });
+
+test('runModel posts to openAiBaseUrl when provided', async () => {
+  const config: AIPromptConfig = {
+    id: 1,
+    is_active: true,
+    model: 'gpt-4',
+    prompt: 'You are helpful',
+    temperature: null,
+    top_p: null,
+    seed: null,
+    input_cost_nano_per_token: 1,
+    output_cost_nano_per_token: 1,
+    cost_currency: 'USD',
+  };
+  const urls: string[] = [];
+  const fakeFetch = async (url: string) => {
+    urls.push(url);
+    return {
+      ok: true,
+      json: async () => ({
+        choices: [{ message: { content: 'hi' } }],
+        usage: { prompt_tokens: 1, completion_tokens: 1 },
+      }),
+    };
+  };
+
+  await runModel({
+    supabase: createSupabaseStub(config),
+    fetch: fakeFetch as any,
+    openAiApiKey: 'k',
+    userId: 'user-1',
+    userContent: 'hello',
+  });
+  await runModel({
+    supabase: createSupabaseStub(config),
+    fetch: fakeFetch as any,
+    openAiApiKey: 'k',
+    openAiBaseUrl: 'http://127.0.0.1:8089/v1/',
+    userId: 'user-1',
+    userContent: 'hello',
+  });
+
+  assertEquals(urls[0], 'https://api.openai.com/v1/chat/completions');
+  assertEquals(urls[1], 'http://127.0.0.1:8089/v1/chat/completions');
+});
@@ -1,3 +1,5 @@
+import { TtlCache } from './cache.ts';
+
 export interface AIPromptConfig {
   id: number;
   is_active: boolean;
@@ -22,10 +24,31 @@ export interface AIInvocation {
   output_cost_nano: number;
   total_cost_nano: number;
   latency_ms: number | null;
+  cache_status?: ExtractionCacheStatus | null;
+  saved_request_tokens?: number;
+  saved_response_tokens?: number;
   created_at: string;
 }
 
-export async function fetchActivePromptConfig(
+// How an extraction used the extraction cache, recorded on ai_invocations
+export type ExtractionCacheStatus = 'miss' | 'hit' | 'delta';
+
+export interface CacheUsage {
+  cache_status: ExtractionCacheStatus;
+  saved_request_tokens?: number;
+  saved_response_tokens?: number;
+}
+
+export type PromptConfigCache = TtlCache<string, AIPromptConfig | null>;
+
+// The active config changes rarely, so isolates may reuse it for this long
+export const PROMPT_CONFIG_TTL_MS = 60_000;
+
+export function createPromptConfigCache(): PromptConfigCache {
+  return new TtlCache({ maxEntries: 1, ttlMs: PROMPT_CONFIG_TTL_MS });
+}
+
+async function loadActivePromptConfig(
   supabase: any
 ): Promise<AIPromptConfig | null> {
   const { data, error } = await supabase
@@ -35,33 +58,61 @@ export async function fetchActivePromptConfig(
     .order('created_at', { ascending: true })
     .limit(1)
     .maybeSingle();
-  if (error || !data) return null;
-  return data as AIPromptConfig;
+  if (error) throw new Error(error.message);
+  return (data as AIPromptConfig) ?? null;
 }
 
+export async function fetchActivePromptConfig(
+  supabase: any,
+  cache?: PromptConfigCache
+): Promise<AIPromptConfig | null> {
+  try {
+    if (!cache) return await loadActivePromptConfig(supabase);
+    return await cache.getOrLoad('active', () =>
+      loadActivePromptConfig(supabase)
+    );
+  } catch {
+    return null;
+  }
+}
+
+export const DEFAULT_OPENAI_BASE_URL = 'https://api.openai.com/v1';
+
 export interface RunModelDeps {
   supabase: any;
   fetch: typeof fetch;
   openAiApiKey: string;
+  // Override to point at a compatible server, e.g. tools/fake_openai.py
+  openAiBaseUrl?: string;
+  // Reuses the active prompt config across calls when provided
+  promptConfigCache?: PromptConfigCache;
+  // Use this config instead of looking up the active one
+  config?: AIPromptConfig;
   userId: string;
   emailId?: string;
   userContent: string;
   responseFormat?: any;
+  cacheUsage?: CacheUsage;
 }
 
 export async function runModel({
   supabase,
   fetch,
   openAiApiKey,
+  openAiBaseUrl,
+  promptConfigCache,
+  config: givenConfig,
   userId,
   emailId,
   userContent,
   responseFormat,
+  cacheUsage,
 }: RunModelDeps): Promise<{
   content: string;
   aiInvocation: AIInvocation;
 }> {
-  const config = await fetchActivePromptConfig(supabase);
+  const config =
+    givenConfig ?? (await fetchActivePromptConfig(supabase, promptConfigCache));
   if (!config) throw new Error('No active prompt config');
 
   const body: any = {
@@ -80,7 +131,11 @@ export async function runModel({
   if (responseFormat) body.response_format = responseFormat;
 
   const start = Date.now();
-  const resp = await fetch('https://api.openai.com/v1/chat/completions', {
+  const baseUrl = (openAiBaseUrl || DEFAULT_OPENAI_BASE_URL).replace(
+    /\/+$/,
+    ''
+  );
+  const resp = await fetch(`${baseUrl}/chat/completions`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
@@ -108,6 +163,7 @@ export async function runModel({
       input_cost_nano: inputCost,
       output_cost_nano: outputCost,
       latency_ms: latency,
+      ...cacheUsage,
     })
     .select()
     .single();
@@ -117,3 +173,44 @@ export async function runModel({
   const content = data.choices?.[0]?.message?.content ?? '';
   return { content, aiInvocation: aiInvocation as AIInvocation };
 }
+
+/**
+ * Log an extraction served from the extraction cache as a zero-cost
+ * invocation, recording the tokens the model call would have used.
+ */
+export async function logCacheHit({
+  supabase,
+  config,
+  userId,
+  emailId,
+  savedRequestTokens,
+  savedResponseTokens,
+}: {
+  supabase: any;
+  config: AIPromptConfig;
+  userId: string;
+  emailId?: string;
+  savedRequestTokens: number;
+  savedResponseTokens: number;
+}): Promise<AIInvocation> {
+  const { data: aiInvocation, error: insertError } = await supabase
+    .from('ai_invocations')
+    .insert({
+      config_id: config.id,
+      user_id: userId,
+      email_id: emailId ?? null,
+      request_tokens: 0,
+      response_tokens: 0,
+      input_cost_nano: 0,
+      output_cost_nano: 0,
+      latency_ms: 0,
+      cache_status: 'hit',
+      saved_request_tokens: savedRequestTokens,
+      saved_response_tokens: savedResponseTokens,
+    })
+    .select()
+    .single();
+  if (insertError || !aiInvocation)
+    throw new Error(insertError?.message || 'Failed to log invocation');
+  return aiInvocation as AIInvocation;
+}
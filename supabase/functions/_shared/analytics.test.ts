@@ -0,0 +1,81 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import { AnalyticsEmitter, emailEvent } from './analytics.ts';
+import { test } from 'node:test';
+
+// Records each batch; the first `failures` calls return an error
+function createRpcStub(failures = 0) {
+  const batches: any[][] = [];
+  let calls = 0;
+  return {
+    batches,
+    rpc(_name: string, params: { p_events: any[] }) {
+      calls++;
+      if (calls <= failures) {
+        return Promise.resolve({ data: null, error: { message: 'timeout' } });
+      }
+      batches.push(params.p_events);
+      return Promise.resolve({ data: params.p_events.length, error: null });
+    },
+  };
+}
+
+test('AnalyticsEmitter writes buffered events as one batch on flush', async () => {
+  const stub = createRpcStub();
+  const analytics = new AnalyticsEmitter(stub);
+  analytics.emit(emailEvent('email_received', 'user-1', 'email-1'));
+  analytics.emit(emailEvent('email_processed_success', 'user-1', 'email-1'));
+  assertEquals(stub.batches.length, 0);
+  assertEquals(analytics.pending, 2);
+
+  await analytics.flush();
+  assertEquals(stub.batches.length, 1);
+  assertEquals(stub.batches[0].length, 2);
+  const [event] = stub.batches[0];
+  assertEquals(event.platform, 'server');
+  assertEquals(event.source, 'edge_function');
+  assertEquals(event.ingest_type, 'email');
+  assert(typeof event.occurred_at === 'string');
+  assertEquals(analytics.pending, 0);
+});
+
+test('AnalyticsEmitter flushes when the batch is full', async () => {
+  const stub = createRpcStub();
+  const analytics = new AnalyticsEmitter(stub, { maxBatchSize: 2 });
+  for (let i = 0; i < 5; i++) {
+    analytics.emit(emailEvent('email_received', 'user-1', `email-${i}`));
+  }
+  assertEquals(analytics.pending, 1);
+  await analytics.flush();
+  assertEquals(stub.batches.map((b) => b.length).join(','), '2,2,1');
+});
+
+test('AnalyticsEmitter flushes after the interval', async () => {
+  const stub = createRpcStub();
+  const analytics = new AnalyticsEmitter(stub, { flushIntervalMs: 5 });
+  analytics.emit(emailEvent('email_received', 'user-1', 'email-1'));
+  await new Promise((resolve) => setTimeout(resolve, 20));
+  assertEquals(stub.batches.length, 1);
+});
+
+test('AnalyticsEmitter retries failed batches and never rejects', async () => {
+  const stub = createRpcStub(1);
+  const analytics = new AnalyticsEmitter(stub);
+  analytics.emit(emailEvent('email_received', 'user-1', 'email-1'));
+  await analytics.flush();
+  assertEquals(stub.batches.length, 1);
+
+  const failing = new AnalyticsEmitter(createRpcStub(2));
+  failing.emit(emailEvent('email_received', 'user-1', 'email-1'));
+  // Dropped after the last attempt without rejecting
+  await failing.flush();
+  assertEquals(failing.pending, 0);
+});
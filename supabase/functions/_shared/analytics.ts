@@ -0,0 +1,184 @@
+// Buffered emitter for analytics.events.
+//
+// Events are queued in memory and written in batches through the
+// log_analytics_events_batch RPC: when the buffer reaches maxBatchSize, when
+// flushIntervalMs has passed since the first queued event, or when a handler
+// flushes at the end of a request. Writes never block or fail a request.
+
+export type AnalyticsEventType =
+  | 'email_received'
+  | 'email_processed_success'
+  | 'email_processed_failed'
+  | 'task_created';
+
+export interface AnalyticsEvent {
+  user_id: string;
+  event_type: AnalyticsEventType;
+  occurred_at?: string;
+  metadata?: Record<string, unknown>;
+  ingest_type?: 'email' | 'share' | 'chat';
+  ingest_id?: string;
+  task_id?: string;
+  success?: boolean;
+  error_code?: string;
+}
+
+// Row sent to the RPC; the idempotency key makes a retried batch a no-op
+export interface AnalyticsEventRow extends AnalyticsEvent {
+  platform: 'server';
+  source: 'edge_function' | 'job';
+  occurred_at: string;
+  idempotency_key: string;
+}
+
+export interface AnalyticsEmitterOptions {
+  source?: 'edge_function' | 'job';
+  maxBatchSize?: number;
+  flushIntervalMs?: number;
+  // Attempts per batch before its events are dropped
+  maxAttempts?: number;
+}
+
+export const DEFAULT_ANALYTICS_BATCH_SIZE = 100;
+export const DEFAULT_ANALYTICS_FLUSH_INTERVAL_MS = 1000;
+
+export class AnalyticsEmitter {
+  private buffer: AnalyticsEventRow[] = [];
+  private timer: ReturnType<typeof setTimeout> | null = null;
+  private inFlight = new Set<Promise<void>>();
+  private readonly source: 'edge_function' | 'job';
+  private readonly maxBatchSize: number;
+  private readonly flushIntervalMs: number;
+  private readonly maxAttempts: number;
+
+  constructor(
+    // deno-lint-ignore no-explicit-any
+    private readonly supabase: any,
+    {
+      source = 'edge_function',
+      maxBatchSize = DEFAULT_ANALYTICS_BATCH_SIZE,
+      flushIntervalMs = DEFAULT_ANALYTICS_FLUSH_INTERVAL_MS,
+      maxAttempts = 2,
+    }: AnalyticsEmitterOptions = {}
+  ) {
+    this.source = source;
+    this.maxBatchSize = maxBatchSize;
+    this.flushIntervalMs = flushIntervalMs;
+    this.maxAttempts = maxAttempts;
+  }
+
+  emit(event: AnalyticsEvent): void {
+    this.buffer.push({
+      ...event,
+      platform: 'server',
+      source: this.source,
+      occurred_at: event.occurred_at ?? new Date().toISOString(),
+      idempotency_key: crypto.randomUUID(),
+    });
+    if (this.buffer.length >= this.maxBatchSize) {
+      this.flush();
+    } else if (this.timer === null) {
+      this.timer = setTimeout(() => this.flush(), this.flushIntervalMs);
+    }
+  }
+
+  get pending(): number {
+    return this.buffer.length;
+  }
+
+  /**
+   * Write out everything buffered so far. Resolves once those events and any
+   * batches already in flight are written (or dropped); never rejects.
+   */
+  flush(): Promise<void> {
+    if (this.timer !== null) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+    while (this.buffer.length > 0) {
+      const batch = this.buffer.splice(0, this.maxBatchSize);
+      const write = this.write(batch).finally(() =>
+        this.inFlight.delete(write)
+      );
+      this.inFlight.add(write);
+    }
+    return Promise.all(this.inFlight).then(() => undefined);
+  }
+
+  private async write(batch: AnalyticsEventRow[]): Promise<void> {
+    let lastError = '';
+    for (let attempt = 1; attempt <= this.maxAttempts; attempt++) {
+      try {
+        const { error } = await this.supabase.rpc(
+          'log_analytics_events_batch',
+          { p_events: batch }
+        );
+        if (!error) return;
+        lastError = error.message;
+      } catch (e) {
+        lastError = String(e);
+      }
+    }
+    console.warn(
+      `[analytics] dropped ${batch.length} events after ${this.maxAttempts} attempts: ${lastError}`
+    );
+  }
+}
+
+// Event about an ingested email, linked to its raw_emails row
+export function emailEvent(
+  eventType: AnalyticsEventType,
+  userId: string,
+  emailId: string,
+  fields: Partial<AnalyticsEvent> = {}
+): AnalyticsEvent {
+  return {
+    user_id: userId,
+    event_type: eventType,
+    ingest_type: 'email',
+    ingest_id: emailId,
+    ...fields,
+  };
+}
+
+/**
+ * Record the outcome of processing an email: email_processed_success and a
+ * task_created event per new task, or email_processed_failed with errorCode.
+ */
+export function emitEmailProcessed(
+  analytics: AnalyticsEmitter,
+  userId: string,
+  emailId: string,
+  outcome: { taskIds: string[] } | { errorCode: string }
+): void {
+  if ('errorCode' in outcome) {
+    analytics.emit(
+      emailEvent('email_processed_failed', userId, emailId, {
+        success: false,
+        error_code: outcome.errorCode,
+      })
+    );
+    return;
+  }
+  analytics.emit(
+    emailEvent('email_processed_success', userId, emailId, {
+      success: true,
+      metadata: { task_count: outcome.taskIds.length },
+    })
+  );
+  for (const taskId of outcome.taskIds) {
+    analytics.emit(
+      emailEvent('task_created', userId, emailId, { task_id: taskId })
+    );
+  }
+}
+
+/**
+ * Keep the runtime alive for promise after the response is sent where
+ * supported (Supabase edge runtime), otherwise let it run unawaited.
+ */
+export function runInBackground(promise: Promise<unknown>): void {
+  // deno-lint-ignore no-explicit-any
+  const runtime = (globalThis as any).EdgeRuntime;
+  if (runtime?.waitUntil) runtime.waitUntil(promise);
+}
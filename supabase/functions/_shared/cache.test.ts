@@ -0,0 +1,99 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import { TtlCache } from './cache.ts';
+import { test } from 'node:test';
+
+function createClock() {
+  const clock = { time: 0, now: () => clock.time };
+  return clock;
+}
+
+test('TtlCache expires values and negative results separately', async () => {
+  const clock = createClock();
+  const cache = new TtlCache<string, string | null>({
+    ttlMs: 1000,
+    negativeTtlMs: 100,
+    now: clock.now,
+  });
+  let loads = 0;
+  const load = (value: string | null) => () => {
+    loads++;
+    return Promise.resolve(value);
+  };
+
+  assertEquals(await cache.getOrLoad('a', load('user-1')), 'user-1');
+  assertEquals(await cache.getOrLoad('b', load(null)), null);
+  clock.time = 500;
+  assertEquals(await cache.getOrLoad('a', load('user-2')), 'user-1');
+  assertEquals(await cache.getOrLoad('b', load('user-3')), 'user-3');
+  clock.time = 1000;
+  assertEquals(await cache.getOrLoad('a', load('user-2')), 'user-2');
+  assertEquals(loads, 4);
+  assertEquals(cache.stats().hits, 1);
+  assertEquals(cache.stats().misses, 4);
+});
+
+test('TtlCache evicts the least recently used entry', () => {
+  const cache = new TtlCache<string, number>({ maxEntries: 2, ttlMs: 1000 });
+  cache.set('a', 1);
+  cache.set('b', 2);
+  cache.get('a');
+  cache.set('c', 3);
+  assertEquals(cache.get('a'), 1);
+  assertEquals(cache.get('b'), undefined);
+  assertEquals(cache.get('c'), 3);
+});
+
+test('TtlCache shares concurrent loads and does not cache failures', async () => {
+  const cache = new TtlCache<string, number>({ ttlMs: 1000 });
+  let loads = 0;
+  const values = await Promise.all(
+    [1, 2, 3].map(() =>
+      cache.getOrLoad('k', async () => {
+        loads++;
+        await new Promise((resolve) => setTimeout(resolve, 1));
+        return 42;
+      })
+    )
+  );
+  assert(values.every((v) => v === 42));
+  assertEquals(loads, 1);
+
+  let failed = false;
+  try {
+    await cache.getOrLoad('x', () => Promise.reject(new Error('db down')));
+  } catch {
+    failed = true;
+  }
+  assert(failed);
+  assertEquals(await cache.getOrLoad('x', () => Promise.resolve(7)), 7);
+});
+
+test('TtlCache invalidate drops an entry', async () => {
+  const cache = new TtlCache<string, number>({ ttlMs: 1000 });
+  await cache.getOrLoad('k', () => Promise.resolve(1));
+  cache.invalidate('k');
+  assertEquals(await cache.getOrLoad('k', () => Promise.resolve(2)), 2);
+  cache.clear();
+  assertEquals(cache.stats().size, 0);
+});
+
+test('TtlCache lookup and load count hits and misses', async () => {
+  const cache = new TtlCache<string, number>({ ttlMs: 1000 });
+  assertEquals(cache.lookup('k'), undefined);
+  assertEquals(await cache.load('k', () => Promise.resolve(1)), 1);
+  assertEquals(cache.lookup('k'), 1);
+  assertEquals(cache.get('k'), 1); // not counted
+  const stats = cache.stats();
+  assertEquals(stats.hits, 1);
+  assertEquals(stats.misses, 1);
+  assertEquals(stats.size, 1);
+});
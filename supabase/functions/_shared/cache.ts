@@ -0,0 +1,127 @@
+// In-isolate LRU cache with per-entry expiry.
+//
+// Edge function isolates serve many requests, so rows that rarely change
+// (aliases, the active prompt config) can be kept in memory between requests
+// instead of being queried for every message. Entries expire after a TTL, so a
+// change in the database is picked up within that time even without explicit
+// invalidation.
+
+export interface TtlCacheOptions {
+  // Maximum number of entries; the least recently used entry is evicted
+  maxEntries?: number;
+  // Lifetime of a cached value
+  ttlMs: number;
+  // Lifetime of a cached null (negative) result, defaults to ttlMs
+  negativeTtlMs?: number;
+  // Clock, for tests
+  now?: () => number;
+}
+
+export interface TtlCacheStats {
+  hits: number;
+  misses: number;
+  size: number;
+}
+
+export class TtlCache<K, V> {
+  private readonly entries = new Map<K, { value: V; expiresAt: number }>();
+  private readonly loading = new Map<K, Promise<V>>();
+  private readonly maxEntries: number;
+  private readonly ttlMs: number;
+  private readonly negativeTtlMs: number;
+  private readonly now: () => number;
+  hits = 0;
+  misses = 0;
+
+  constructor({
+    maxEntries = 1000,
+    ttlMs,
+    negativeTtlMs,
+    now = Date.now,
+  }: TtlCacheOptions) {
+    this.maxEntries = maxEntries;
+    this.ttlMs = ttlMs;
+    this.negativeTtlMs = negativeTtlMs ?? ttlMs;
+    this.now = now;
+  }
+
+  get(key: K): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+    if (entry.expiresAt <= this.now()) {
+      this.entries.delete(key);
+      return undefined;
+    }
+    // Re-insert so Map order tracks recency
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    return entry.value;
+  }
+
+  set(key: K, value: V): void {
+    const ttl = value === null ? this.negativeTtlMs : this.ttlMs;
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: this.now() + ttl });
+    while (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value as K);
+    }
+  }
+
+  /** Like get, but counted as a hit or a miss in stats(). */
+  lookup(key: K): V | undefined {
+    const value = this.get(key);
+    if (value === undefined) this.misses++;
+    else this.hits++;
+    return value;
+  }
+
+  /**
+   * Return the cached value for key, or load and cache it. Concurrent misses
+   * for the same key share one load. A loader that throws caches nothing.
+   */
+  async getOrLoad(key: K, loader: () => Promise<V>): Promise<V> {
+    const cached = this.lookup(key);
+    if (cached !== undefined) return cached;
+    return await this.load(key, loader);
+  }
+
+  /**
+   * Load and cache the value for key, e.g. after a lookup() miss, sharing a
+   * load already in progress.
+   */
+  load(key: K, loader: () => Promise<V>): Promise<V> {
+    const pending = this.loading.get(key);
+    if (pending) return pending;
+
+    const load: Promise<V> = loader().then(
+      (value) => {
+        // Skip results invalidated while loading
+        if (this.loading.get(key) === load) {
+          this.loading.delete(key);
+          this.set(key, value);
+        }
+        return value;
+      },
+      (error) => {
+        if (this.loading.get(key) === load) this.loading.delete(key);
+        throw error;
+      }
+    );
+    this.loading.set(key, load);
+    return load;
+  }
+
+  invalidate(key: K): void {
+    this.entries.delete(key);
+    this.loading.delete(key);
+  }
+
+  clear(): void {
+    this.entries.clear();
+    this.loading.clear();
+  }
+
+  stats(): TtlCacheStats {
+    return { hits: this.hits, misses: this.misses, size: this.entries.size };
+  }
+}
@@ -0,0 +1,139 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import { compactEmailText, htmlToText } from './compaction.ts';
+import { test } from 'node:test';
+
+const TRACKING_URL =
+  'https://school.us1.list-manage.com/track/click?u=abc123&id=def456&e=0123456789';
+
+test('htmlToText keeps structure and drops markup', () => {
+  const text = htmlToText(
+    [
+      '<html><head><style>p { color: red; }</style></head><body>',
+      '<h1>Picture Day</h1>',
+      '<p>Bring a&nbsp;smile &amp; a comb.</p>',
+      '<ul><li>Grade 6: Monday</li><li>Grade 7: Tuesday</li></ul>',
+      '<table><tr><td>Date</td><td>Event</td></tr></table>',
+      '<img src="https://t.example.com/open.gif" width="1" height="1">',
+      '<img src="logo.png" alt="School logo">',
+      '<script>track()</script>',
+      '</body></html>',
+    ].join('')
+  );
+  assert(text.includes('Picture Day\n'));
+  assert(text.includes('Bring a smile & a comb.'));
+  assert(text.includes('\n- Grade 6: Monday'));
+  assert(text.includes('Date | Event'));
+  assert(text.includes('School logo'));
+  assert(!text.includes('color') && !text.includes('track()'));
+  assert(!text.includes('<') && !text.includes('open.gif'));
+});
+
+test('compactEmailText replaces tracking redirects and parameters', () => {
+  const form =
+    'https://docs.google.com/forms/d/e/1FAIpQLSc0123456789abcdef/viewform';
+  const { text } = compactEmailText(
+    [
+      `<p><a href="${TRACKING_URL}">Sign the form</a></p>`,
+      '<p><a href="https://school.org/forms">https://school.org/forms</a></p>',
+      '<p>Read more: https://school.org/news?utm_source=newsletter</p>',
+      `<p>RSVP: ${form}?usp=sf_link&amp;utm_medium=email#start</p>`,
+    ].join('')
+  );
+  assert(text.includes('Sign the form ([link: school.us1.list-manage.com])'));
+  assert(text.includes('https://school.org/forms'));
+  assert(!text.includes('(https://school.org/forms)'));
+  assert(text.includes('Read more: https://school.org/news\n'));
+  assert(text.includes(`RSVP: ${form}?usp=sf_link#start`));
+});
+
+test('compactEmailText strips quoted replies, signatures and footers', () => {
+  const { text } = compactEmailText(
+    [
+      'Hi all,',
+      '',
+      'Permission slips for the zoo trip are due Friday.',
+      '',
+      'Please return the permission slip to the front office.',
+      'Please return the permission slip to the front office.',
+      '',
+      '--',
+      'Ms. Smith',
+      'Grade 3 Teacher',
+      '',
+      'On Mon, Sep 1, 2025 at 9:00 AM Parent <parent@example.com> wrote:',
+      '> When are the slips due?',
+    ].join('\n')
+  );
+  assertEquals(
+    text,
+    [
+      'Hi all,',
+      '',
+      'Permission slips for the zoo trip are due Friday.',
+      '',
+      'Please return the permission slip to the front office.',
+    ].join('\n')
+  );
+
+  const footer = compactEmailText(
+    [
+      'Spirit week starts Monday.',
+      'View this email in your browser',
+      'You are receiving this email because you are a parent.',
+      'Unsubscribe | Update your preferences',
+    ].join('\n')
+  );
+  assertEquals(footer.text, 'Spirit week starts Monday.');
+});
+
+test('compactEmailText keeps forwarded messages', () => {
+  const forwarded = compactEmailText(
+    [
+      'FYI, see below.',
+      '',
+      '-----Original Message-----',
+      'From: Principal <principal@school.org>',
+      'Subject: Field trip',
+      '',
+      'The field trip to the museum is on October 3.',
+    ].join('\n')
+  );
+  assert(
+    forwarded.text.includes('The field trip to the museum is on October 3.')
+  );
+
+  const reply = compactEmailText(
+    [
+      'Thanks, see you then.',
+      '',
+      '-----Original Message-----',
+      '> The field trip to the museum is on October 3.',
+    ].join('\n')
+  );
+  assertEquals(reply.text, 'Thanks, see you then.');
+});
+
+test('compactEmailText keeps text after a section separator', () => {
+  const lines = Array.from({ length: 12 }, (_, i) => `Item ${i}`);
+  const { text } = compactEmailText(['News', '--', ...lines].join('\n'));
+  assert(text.includes('Item 11'));
+});
+
+test('compactEmailText reports token estimates before and after', () => {
+  const link = `<p><a href="${TRACKING_URL}">Details</a></p>`;
+  const html = `<div style="font-family: Arial">${link.repeat(20)}</div>`;
+  const result = compactEmailText(html);
+  assertEquals(result.tokensBefore, Math.ceil(html.length / 4));
+  assertEquals(result.tokensAfter, Math.ceil(result.text.length / 4));
+  assert(result.tokensAfter * 4 < result.tokensBefore);
+  assertEquals(compactEmailText('email').text, 'email');
+});
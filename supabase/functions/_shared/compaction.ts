@@ -0,0 +1,248 @@
+// Compaction of email text before it is sent to the model.
+//
+// chooseEmailText falls back to the raw HTML body when the plain-text part is
+// missing or short, and newsletters carry a lot that is billed as prompt
+// tokens without helping extraction: markup and inline CSS, tracking pixels,
+// long redirect URLs, quoted reply chains, signatures and footers.
+// compactEmailText turns HTML into structured text and removes that noise,
+// keeping the wording of the message itself.
+
+// Rough size of a token in characters, as used for the task context
+const CHARS_PER_TOKEN = 4;
+// Repeated lines shorter than this (e.g. "Date: TBD") are kept
+const MIN_REPEATED_LINE_LENGTH = 30;
+
+// Query parameters that only identify the campaign or recipient
+const TRACKING_PARAM =
+  /^(utm_[a-z]+|mc_[a-z]+|_hsenc|_hsmi|fbclid|gclid|mkt_tok)$/i;
+// Click-tracking and link-rewriting services of mailing tools; their URLs
+// are opaque redirects and are replaced by a placeholder naming the host
+const TRACKING_HOST =
+  /(^|\.)(list-manage\.com|mandrillapp\.com|sendgrid\.net|mailgun\.org|hubspotlinks\.com|rs6\.net|exct\.net|safelinks\.protection\.outlook\.com|urldefense\.com)$/i;
+
+const BOILERPLATE_LINE = new RegExp(
+  [
+    'unsubscribe',
+    'update (your )?(subscription|email )?preferences',
+    'manage (your )?(subscription|email )?preferences',
+    'view (this email|it|this message) in (your|a) (web )?browser',
+    'you are receiving this (email|message)',
+    "you're receiving this (email|message)",
+    'this email was sent to',
+    'all rights reserved',
+    '^sent from my (iphone|ipad|android|mobile)',
+  ].join('|'),
+  'i'
+);
+// Lines longer than this are content even if they mention a footer phrase
+const MAX_BOILERPLATE_LINE_LENGTH = 200;
+
+// Start of quoted history in a reply; everything after it is dropped
+const REPLY_HEADER = /^On .{1,200} wrote:$/;
+// Outlook's separator starts quoted replies but also manual forwards, so it
+// only ends the message when everything after it is quoted
+const ORIGINAL_MESSAGE = /^-{2,}\s*Original Message\s*-{2,}$/i;
+// Conventional signature delimiter ("-- ")
+const SIGNATURE_DELIMITER = /^--\s?$/;
+
+const NAMED_ENTITIES: Record<string, string> = {
+  nbsp: ' ',
+  amp: '&',
+  lt: '<',
+  gt: '>',
+  quot: '"',
+  apos: "'",
+  rsquo: '’',
+  lsquo: '‘',
+  rdquo: '”',
+  ldquo: '“',
+  ndash: '–',
+  mdash: '—',
+  hellip: '…',
+  bull: '•',
+  middot: '·',
+  copy: '©',
+  reg: '®',
+  zwnj: '',
+  zwj: '',
+};
+
+export interface CompactedText {
+  text: string;
+  tokensBefore: number;
+  tokensAfter: number;
+}
+
+export function estimateTextTokens(text: string): number {
+  return Math.ceil(text.length / CHARS_PER_TOKEN);
+}
+
+export function looksLikeHtml(text: string): boolean {
+  return /<(html|body|div|p|table|td|br|span|a|img)\b[^>]*>/i.test(text);
+}
+
+function decodeEntities(text: string): string {
+  return text.replace(
+    /&(#x[0-9a-f]+|#\d+|[a-z]+);/gi,
+    (match, entity: string) => {
+      if (entity[0] === '#') {
+        const code =
+          entity[1] === 'x' || entity[1] === 'X'
+            ? parseInt(entity.slice(2), 16)
+            : parseInt(entity.slice(1), 10);
+        if (code > 0x10ffff) return match;
+        return code === 0x200c || code === 0x200b || code === 0xfeff
+          ? ''
+          : String.fromCodePoint(code);
+      }
+      return NAMED_ENTITIES[entity.toLowerCase()] ?? match;
+    }
+  );
+}
+
+function attribute(tag: string, name: string): string | null {
+  const match = tag.match(
+    new RegExp(`\\b${name}\\s*=\\s*("([^"]*)"|'([^']*)'|([^\\s>]+))`, 'i')
+  );
+  return match ? (match[2] ?? match[3] ?? match[4] ?? '') : null;
+}
+
+/**
+ * Convert an HTML body to text that keeps its structure: paragraphs and
+ * headings become lines, list items become "- " lines and table cells are
+ * separated by " | ". Quoted replies, scripts, styles and images other than
+ * their alt text are dropped; links keep their URL after the link text.
+ */
+export function htmlToText(html: string): string {
+  const text = html
+    .replace(/<!--[\s\S]*?-->/g, '')
+    .replace(/<(head|style|script|title)\b[^>]*>[\s\S]*?<\/\1\s*>/gi, '')
+    .replace(
+      /<blockquote\b[^>]*(type\s*=\s*["']?cite|gmail_quote)[^>]*>[\s\S]*?<\/blockquote\s*>/gi,
+      ''
+    )
+    .replace(/<img\b[^>]*>/gi, (tag) => {
+      const alt = attribute(tag, 'alt')?.trim();
+      return alt ? ` ${alt} ` : '';
+    })
+    .replace(/<a\b([^>]*)>([\s\S]*?)<\/a\s*>/gi, (_, attrs, inner) => {
+      const label = inner.replace(/<[^>]+>/g, '').trim();
+      const href = attribute(attrs, 'href')?.trim() ?? '';
+      if (!/^https?:/i.test(href) || decodeEntities(label) === href) {
+        return inner;
+      }
+      return label ? `${inner} (${href})` : href;
+    })
+    .replace(/<br\s*\/?>/gi, '\n')
+    .replace(/<li\b[^>]*>/gi, '\n- ')
+    .replace(/<\/t[dh]\s*>/gi, ' | ')
+    .replace(
+      /<\/?(p|div|tr|h[1-6]|ul|ol|table|tbody|thead|blockquote|section|article|header|footer|center|hr)\b[^>]*>/gi,
+      '\n'
+    )
+    .replace(/<[^>]+>/g, '');
+  return decodeEntities(text);
+}
+
+/**
+ * Replace a click-tracking redirect by a placeholder naming its host, and
+ * drop tracking parameters from other URLs.
+ */
+function shortenUrl(url: string): string {
+  let host: string;
+  try {
+    host = new URL(url).host;
+  } catch {
+    return url;
+  }
+  if (TRACKING_HOST.test(host)) return `[link: ${host}]`;
+
+  const [address, ...fragment] = url.split('#');
+  const queryStart = address.indexOf('?');
+  if (queryStart < 0) return url;
+  const params = address
+    .slice(queryStart + 1)
+    .split('&')
+    .filter((param) => param && !TRACKING_PARAM.test(param.split('=')[0]));
+  return [
+    address.slice(0, queryStart),
+    params.length > 0 ? `?${params.join('&')}` : '',
+    fragment.length > 0 ? `#${fragment.join('#')}` : '',
+  ].join('');
+}
+
+// A signature is short; a "--" line followed by more is a section separator
+const MAX_SIGNATURE_LINES = 8;
+
+/**
+ * Drop quoted history, the signature and footer boilerplate, and later
+ * copies of long repeated lines, from lines of text.
+ */
+function stripNoise(lines: string[]): string[] {
+  const kept: string[] = [];
+  const seen = new Set<string>();
+  let hasContent = false;
+  for (let i = 0; i < lines.length; i++) {
+    const line = lines[i];
+    if (hasContent && REPLY_HEADER.test(line)) break;
+    if (
+      hasContent &&
+      ORIGINAL_MESSAGE.test(line) &&
+      lines.slice(i + 1).every((rest) => rest === '' || rest.startsWith('>'))
+    ) {
+      break;
+    }
+    if (
+      hasContent &&
+      SIGNATURE_DELIMITER.test(line) &&
+      lines.slice(i + 1).filter(Boolean).length <= MAX_SIGNATURE_LINES
+    ) {
+      break;
+    }
+    if (line.startsWith('>')) continue;
+    if (
+      line.length <= MAX_BOILERPLATE_LINE_LENGTH &&
+      BOILERPLATE_LINE.test(line)
+    ) {
+      continue;
+    }
+    if (line.length >= MIN_REPEATED_LINE_LENGTH) {
+      const key = line.toLowerCase();
+      if (seen.has(key)) continue;
+      seen.add(key);
+    }
+    kept.push(line);
+    if (line !== '') hasContent = true;
+  }
+  return kept;
+}
+
+/**
+ * Compact the text chosen for an email before the model call and report the
+ * estimated prompt tokens before and after.
+ */
+export function compactEmailText(text: string): CompactedText {
+  const tokensBefore = estimateTextTokens(text);
+  const plain = looksLikeHtml(text) ? htmlToText(text) : text;
+  const lines = plain
+    .replace(/\r\n?/g, '\n')
+    .replace(/https?:\/\/[^\s<>()"'|]+/g, shortenUrl)
+    .split('\n')
+    .map((line) => line.replace(/[ \t\u00a0]+/g, ' ').trim())
+    // Separators left by empty table cells
+    .map((line) =>
+      line
+        .replace(/(\|\s*){2,}/g, '| ')
+        .replace(/^(\|\s*)+|(\s*\|)+$/g, '')
+        .trim()
+    );
+  const compacted = stripNoise(lines)
+    .join('\n')
+    .replace(/\n{3,}/g, '\n\n')
+    .trim();
+  return {
+    text: compacted,
+    tokensBefore,
+    tokensAfter: estimateTextTokens(compacted),
+  };
+}
@@ -0,0 +1,113 @@
+// Content-addressed cache of model extractions, shared across users.
+//
+// Entries are keyed by the prompt config id, a hash of the normalized email
+// text and a fingerprint of the dedup context sent with it. The same
+// newsletter forwarded by many parents normalizes to the same text, so its
+// extraction only has to be paid for once per prompt config. Entries expire
+// after EXTRACTION_CACHE_TTL_DAYS; purge_extraction_cache deletes them.
+
+// Mirrors the expires_at default of public.extraction_cache
+export const EXTRACTION_CACHE_TTL_DAYS = 30;
+
+export interface CachedExtraction {
+  content: string;
+  request_tokens: number;
+  response_tokens: number;
+}
+
+// Header lines of a forwarded-message block, which differ per forwarder
+const FORWARD_HEADER = /^(from|date|sent|subject|to|cc):/i;
+const FORWARD_MARKER = /^-{2,}\s*(forwarded message|original message)\s*-*$/i;
+
+/**
+ * Normalize email text for hashing: drop forwarded-message preambles and
+ * collapse whitespace, so copies forwarded by different people match.
+ */
+export function normalizeEmailText(text: string): string {
+  const lines = text.replace(/\r\n?/g, '\n').split('\n');
+  const kept: string[] = [];
+  let inForwardHeader = false;
+  for (const line of lines) {
+    const trimmed = line.trim();
+    if (FORWARD_MARKER.test(trimmed)) {
+      inForwardHeader = true;
+      continue;
+    }
+    if (inForwardHeader) {
+      if (FORWARD_HEADER.test(trimmed)) continue;
+      if (trimmed === '') continue;
+      inForwardHeader = false;
+    }
+    kept.push(trimmed);
+  }
+  return kept.join(' ').split(/\s+/).filter(Boolean).join(' ');
+}
+
+export async function sha256Hex(text: string): Promise<string> {
+  const digest = await crypto.subtle.digest(
+    'SHA-256',
+    new TextEncoder().encode(text)
+  );
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, '0'))
+    .join('');
+}
+
+export function extractionCacheKey(
+  configId: number,
+  textHash: string,
+  contextFingerprint: string
+): Promise<string> {
+  return sha256Hex(`${configId}:${textHash}:${contextFingerprint}`);
+}
+
+/**
+ * Return the cached extractions of an email text under the given dedup
+ * context fingerprints, keyed by fingerprint.
+ */
+export async function findCachedExtractions(
+  // deno-lint-ignore no-explicit-any
+  supabase: any,
+  configId: number,
+  textHash: string,
+  contextFingerprints: string[]
+): Promise<Map<string, CachedExtraction>> {
+  const { data, error } = await supabase
+    .from('extraction_cache')
+    .select('context_fingerprint, content, request_tokens, response_tokens')
+    .eq('config_id', configId)
+    .eq('text_hash', textHash)
+    .in('context_fingerprint', contextFingerprints)
+    .gt('expires_at', new Date().toISOString());
+  if (error) {
+    console.warn(`[extraction-cache] lookup failed: ${error.message}`);
+    return new Map();
+  }
+  // deno-lint-ignore no-explicit-any
+  return new Map((data ?? []).map((r: any) => [r.context_fingerprint, r]));
+}
+
+export async function storeExtraction(
+  // deno-lint-ignore no-explicit-any
+  supabase: any,
+  entry: CachedExtraction & {
+    cache_key: string;
+    config_id: number;
+    text_hash: string;
+    context_fingerprint: string;
+  }
+): Promise<void> {
+  // Overwrites an expired entry that has not been purged yet
+  const expiresAt = new Date(
+    Date.now() + EXTRACTION_CACHE_TTL_DAYS * 86_400_000
+  );
+  const { error } = await supabase
+    .from('extraction_cache')
+    .upsert(
+      { ...entry, expires_at: expiresAt.toISOString() },
+      { onConflict: 'cache_key' }
+    );
+  if (error) {
+    console.warn(`[extraction-cache] store failed: ${error.message}`);
+  }
+}
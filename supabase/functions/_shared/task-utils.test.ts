@@ -0,0 +1,221 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import {
+  extractNewTasks,
+  getIngestPreamble,
+  getOpenTasksForDeduplication,
+  OpenTask,
+  selectTasksForPrompt,
+} from './task-utils.ts';
+import { normalizeEmailText } from './extraction-cache.ts';
+import { test } from 'node:test';
+import { createFetchStub, createSupabaseStub } from './test-utils.ts';
+
+const TODAY = new Date('2025-01-15T12:00:00Z');
+
+function openTask(fields: Partial<OpenTask> & { title: string }): OpenTask {
+  return {
+    description: null,
+    due_date: null,
+    parent_action: null,
+    parent_requirement_level: null,
+    student_action: null,
+    student_requirement_level: null,
+    from_email: null,
+    ...fields,
+  };
+}
+
+test('selectTasksForPrompt ranks tasks mentioned in the email first', () => {
+  const tasks = [
+    openTask({ title: 'Library books' }),
+    openTask({ title: 'Field trip permission' }),
+    openTask({ title: 'Spirit week' }),
+  ];
+  const selected = selectTasksForPrompt(tasks, {
+    emailText: 'Reminder: the field trip permission slip is due Friday.',
+    today: TODAY,
+  });
+  assertEquals(selected.length, 3);
+  assertEquals(selected[0].title, 'Field trip permission');
+});
+
+test('selectTasksForPrompt prefers the same sender and upcoming due dates', () => {
+  const tasks = [
+    openTask({ title: 'Old', due_date: '2024-09-01' }),
+    openTask({ title: 'Other sender', from_email: 'pta@other.org' }),
+    openTask({
+      title: 'Same sender',
+      from_email: 'Office <office@school.org>',
+    }),
+    openTask({ title: 'Upcoming', due_date: '2025-01-20' }),
+  ];
+  const selected = selectTasksForPrompt(tasks, {
+    emailText: 'Nothing in common',
+    fromEmail: 'office@school.org',
+    today: TODAY,
+  });
+  const titles = selected.map((t) => t.title);
+  assertEquals(titles[0], 'Same sender');
+  assertEquals(titles[1], 'Upcoming');
+  assertEquals(titles[titles.length - 1], 'Old');
+});
+
+test('selectTasksForPrompt trims to the token budget', () => {
+  const tasks = Array.from({ length: 50 }, (_, i) =>
+    openTask({ title: `Task ${i}`, description: 'x'.repeat(200) })
+  );
+  const selected = selectTasksForPrompt(tasks, {
+    emailText: 'email',
+    tokenBudget: 300,
+    today: TODAY,
+  });
+  assert(selected.length > 0 && selected.length < 50);
+  assert(JSON.stringify(selected).length / 4 <= 300 + selected.length);
+  assert(selected.every((t) => !('from_email' in t)));
+});
+
+const NEWSLETTER = 'Weekly news. Picture day is on 2025-02-03. Bring a smile.';
+
+function forwarded(by: string, text: string): string {
+  return [
+    `Hi, from ${by}`,
+    '---------- Forwarded message ---------',
+    'From: School Office <office@school.org>',
+    'Date: Mon, Jan 20, 2025 at 9:00 AM',
+    'Subject: Weekly news',
+    `To: <${by}@example.com>`,
+    '',
+    text,
+  ].join('\n');
+}
+
+test('normalizeEmailText ignores forwarding preambles and whitespace', () => {
+  const a = normalizeEmailText(forwarded('ann', NEWSLETTER));
+  const b = normalizeEmailText(forwarded('bob', `  ${NEWSLETTER}\n`));
+  assertEquals(a.replace('ann', 'bob'), b);
+  assert(!a.includes('Forwarded message'));
+  assert(!a.includes('ann@example.com'));
+});
+
+test('extractNewTasks reuses extractions of a popular email', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([{ title: 'Picture day' }]);
+  const extract = (userId: string, existing: Record<string, unknown>[]) =>
+    extractNewTasks(supabase, fetchStub, 'key', NEWSLETTER, existing, userId);
+  const prompt = (index: number) =>
+    JSON.parse(fetchStub.calls[index].init.body).messages[1].content;
+
+  // First sighting: one ordinary call with the user's context
+  let result = await extract('user-1', [{ title: 'Book fair' }]);
+  assertEquals(result.tasks[0].title, 'Picture day');
+  assertEquals(fetchStub.calls.length, 1);
+  assert(prompt(0).includes('Book fair') && prompt(0).includes('smile'));
+
+  // Another context without a context-free extraction: one ordinary call
+  result = await extract('user-2', [{ title: 'Field trip' }]);
+  assertEquals(fetchStub.calls.length, 2);
+  assert(prompt(1).includes('Field trip') && prompt(1).includes('smile'));
+
+  // A user without open tasks stores the context-free extraction
+  result = await extract('user-0', []);
+  assertEquals(fetchStub.calls.length, 3);
+
+  // Later users only pay for the dedup-only call
+  result = await extract('user-3', [{ title: 'Bake sale' }]);
+  assertEquals(fetchStub.calls.length, 4);
+  assert(prompt(3).includes('Bake sale') && !prompt(3).includes('smile'));
+
+  // The same context again is a hit with no model call
+  result = await extract('user-4', [{ title: 'Bake sale' }]);
+  assertEquals(fetchStub.calls.length, 4);
+  assertEquals(result.tasks[0].title, 'Picture day');
+  assertEquals(result.totalCostNano, 0);
+
+  const statuses = supabase.state.ai_invocations.map((i) => i.cache_status);
+  assertEquals(statuses.join(','), 'miss,miss,miss,delta,hit');
+  const hit = supabase.state.ai_invocations[4];
+  assert(hit.saved_request_tokens > 0);
+
+  // Expired entries are not reused
+  for (const entry of supabase.state.extraction_cache) {
+    entry.expires_at = new Date(0).toISOString();
+  }
+  await extract('user-4', [{ title: 'Bake sale' }]);
+  assertEquals(fetchStub.calls.length, 5);
+});
+
+test('getIngestPreamble resolves the alias, duplicate, budget and tasks', async () => {
+  const supabase = createSupabaseStub([
+    { id: 1, user_id: 'user-1', title: 'Open', state: 'OPEN' },
+    { id: 2, user_id: 'user-1', title: 'Done', state: 'COMPLETED' },
+  ]);
+  supabase.state.budget = undefined as unknown as number;
+  const email = {
+    messageId: '<p-1>',
+    fromEmail: 'office@school.org',
+    toEmail: 'u_1@in.emailinator.app',
+    subject: 'Field trip',
+    sentAt: null,
+  };
+
+  const { preamble } = await getIngestPreamble(
+    supabase,
+    'u_1@in.emailinator.app',
+    email
+  );
+  assertEquals(preamble.userId, 'user-1');
+  assertEquals(preamble.duplicate, false);
+  assertEquals(preamble.budget, 0); // no budget row
+  assertEquals(preamble.tasks.map((t) => t.title).join(','), 'Open');
+
+  supabase.state.raw_emails.push({ id: 1, dedup_key: '<p-1>' });
+  const again = await getIngestPreamble(
+    supabase,
+    'u_1@in.emailinator.app',
+    email
+  );
+  assert(again.preamble.duplicate);
+
+  const unknown = await getIngestPreamble(
+    supabase,
+    'x@in.emailinator.app',
+    email
+  );
+  assertEquals(unknown.preamble.userId, null);
+});
+
+test('open tasks exclude completed and dismissed tasks on both paths', async () => {
+  const supabase = createSupabaseStub([
+    { id: 1, user_id: 'user-1', title: 'No state' },
+    { id: 2, user_id: 'user-1', title: 'Open', state: 'OPEN' },
+    { id: 3, user_id: 'user-1', title: 'Done', state: 'COMPLETED' },
+    { id: 4, user_id: 'user-1', title: 'Dismissed', state: 'DISMISSED' },
+    { id: 5, user_id: 'user-2', title: 'Other user', state: 'OPEN' },
+  ]);
+
+  const { tasks } = await getOpenTasksForDeduplication(supabase, 'user-1');
+  const { preamble } = await getIngestPreamble(
+    supabase,
+    'u_1@in.emailinator.app',
+    {
+      messageId: '<o-1>',
+      fromEmail: null,
+      toEmail: null,
+      subject: null,
+      sentAt: null,
+    }
+  );
+
+  const titles = (list: OpenTask[]) => list.map((t) => t.title).join(',');
+  assertEquals(titles(tasks), 'No state,Open');
+  assertEquals(titles(preamble.tasks), titles(tasks));
+});
@@ -1,4 +1,20 @@
-import { runModel } from './ai.ts';
+import {
+  AIInvocation,
+  CacheUsage,
+  fetchActivePromptConfig,
+  logCacheHit,
+  PromptConfigCache,
+  runModel,
+} from './ai.ts';
+import {
+  CachedExtraction,
+  extractionCacheKey,
+  findCachedExtractions,
+  normalizeEmailText,
+  sha256Hex,
+  storeExtraction,
+} from './extraction-cache.ts';
+import { StageTimer } from './timing.ts';
 
 export const TEXT_BODY_MIN_RATIO_OF_HTML = 0.3; // Use text/plain only if it's at least 30% of the HTML length
 
@@ -160,6 +176,35 @@ export function sanitizeTasks(raw: any[]): Record<string, unknown>[] {
     .filter(Boolean) as Record<string, unknown>[];
 }
 
+function buildUserContent(
+  emailText: string,
+  existingTasks: Record<string, unknown>[]
+): string {
+  return `Existing tasks:\n${JSON.stringify({ tasks: existingTasks })}\n\nEmail:\n${emailText}`;
+}
+
+function parseTasks(content: string): Record<string, unknown>[] {
+  // deno-lint-ignore no-explicit-any
+  let parsed: any[] = [];
+  try {
+    parsed = JSON.parse(content).tasks ?? [];
+  } catch (_e) {
+    parsed = [];
+  }
+  return sanitizeTasks(parsed);
+}
+
+/**
+ * Extract the tasks in an email that are not already among existingTasks.
+ *
+ * Extractions are cached across users by email text, prompt config and dedup
+ * context (see extraction-cache.ts):
+ * - an exact match is reused without calling the model;
+ * - a text extracted without context before (the base entry, e.g. for a
+ *   user with no open tasks) only costs a small call that dedups the base
+ *   tasks against the user's own open tasks;
+ * - otherwise the text is extracted as usual, with the context.
+ */
 export async function extractNewTasks(
   // deno-lint-ignore no-explicit-any
   supabase: any,
@@ -168,7 +213,9 @@ export async function extractNewTasks(
   emailText: string,
   existingTasks: Record<string, unknown>[],
   userId: string,
-  emailId?: string | number
+  emailId?: string | number,
+  openAiBaseUrl?: string,
+  promptConfigCache?: PromptConfigCache
 ): Promise<{
   tasks: Record<string, unknown>[];
   promptTokens: number;
@@ -176,37 +223,121 @@ export async function extractNewTasks(
   totalCostNano: number;
   rawContent: string;
 }> {
-  const userContent = `Existing tasks:\n${JSON.stringify({ tasks: existingTasks })}\n\nEmail:\n${emailText}`;
+  const config = await fetchActivePromptConfig(supabase, promptConfigCache);
+  if (!config) throw new Error('No active prompt config');
   const responseFormat = { type: 'json_schema', json_schema: TASK_SCHEMA };
+  // deno-lint-ignore no-explicit-any
+  const invocationEmailId = (emailId as any) ?? undefined;
 
-  const { content, aiInvocation } = await runModel({
-    supabase,
-    fetch: fetchFn,
-    openAiApiKey,
-    userId,
-    // deno-lint-ignore no-explicit-any
-    emailId: (emailId as any) ?? undefined,
-    userContent,
-    responseFormat,
-  });
+  const textHash = await sha256Hex(normalizeEmailText(emailText));
+
+  const invocations: AIInvocation[] = [];
+  const callModel = async (userContent: string, cacheUsage: CacheUsage) => {
+    const { content, aiInvocation } = await runModel({
+      supabase,
+      fetch: fetchFn,
+      openAiApiKey,
+      openAiBaseUrl,
+      config,
+      userId,
+      emailId: invocationEmailId,
+      userContent,
+      responseFormat,
+      cacheUsage,
+    });
+    invocations.push(aiInvocation);
+    return { content, aiInvocation };
+  };
+  const store = async (
+    fingerprint: string,
+    content: string,
+    aiInvocation: AIInvocation
+  ) =>
+    await storeExtraction(supabase, {
+      cache_key: await extractionCacheKey(config.id, textHash, fingerprint),
+      config_id: config.id,
+      text_hash: textHash,
+      context_fingerprint: fingerprint,
+      content,
+      request_tokens: aiInvocation.request_tokens,
+      response_tokens: aiInvocation.response_tokens,
+    });
+
+  const baseFingerprint = await sha256Hex(JSON.stringify([]));
+  const fingerprint =
+    existingTasks.length === 0
+      ? baseFingerprint
+      : await sha256Hex(JSON.stringify(existingTasks));
+  const cached = await findCachedExtractions(supabase, config.id, textHash, [
+    ...new Set([fingerprint, baseFingerprint]),
+  ]);
+  const exact = cached.get(fingerprint);
+  const base = cached.get(baseFingerprint);
+
+  const logHit = async (entry: CachedExtraction) =>
+    invocations.push(
+      await logCacheHit({
+        supabase,
+        config,
+        userId,
+        emailId: invocationEmailId,
+        savedRequestTokens: entry.request_tokens,
+        savedResponseTokens: entry.response_tokens,
+      })
+    );
+
+  let content: string;
+  if (exact) {
+    content = exact.content;
+    await logHit(exact);
+  } else if (!base) {
+    // Without a context-free extraction to deduplicate, one ordinary call
+    // costs less than making one and then a dedup-only call
+    const result = await callModel(buildUserContent(emailText, existingTasks), {
+      cache_status: 'miss',
+    });
+    content = result.content;
+    await store(fingerprint, content, result.aiInvocation);
+  } else {
+    // The email text is replaced by the tasks already extracted from it
+    const candidates = { tasks: parseTasks(base.content) };
+    if (candidates.tasks.length === 0) {
+      content = base.content;
+      await logHit(base);
+    } else {
+      const result = await callModel(
+        buildUserContent(JSON.stringify(candidates), existingTasks),
+        {
+          cache_status: 'delta',
+          saved_request_tokens: Math.max(
+            base.request_tokens -
+              estimateTokens(config.prompt) -
+              estimateTokens(candidates),
+            0
+          ),
+        }
+      );
+      content = result.content;
+      await store(fingerprint, content, result.aiInvocation);
+    }
+  }
 
+  const promptTokens = invocations.reduce((n, i) => n + i.request_tokens, 0);
+  const completionTokens = invocations.reduce(
+    (n, i) => n + i.response_tokens,
+    0
+  );
+  const totalCostNano = invocations.reduce((n, i) => n + i.total_cost_nano, 0);
+  const cacheStatus = invocations.map((i) => i.cache_status).join('+');
   console.info(
-    `[task-utils] user=${userId} API cost (USD): ${(aiInvocation.total_cost_nano / 1e9).toFixed(6)} (prompt=${aiInvocation.request_tokens}, completion=${aiInvocation.response_tokens})`
+    `[task-utils] user=${userId} API cost (USD): ${(totalCostNano / 1e9).toFixed(6)} (prompt=${promptTokens}, completion=${completionTokens}, cache=${cacheStatus})`
   );
 
-  // deno-lint-ignore no-explicit-any
-  let parsed: any[] = [];
-  try {
-    parsed = JSON.parse(content).tasks ?? [];
-  } catch (_e) {
-    parsed = [];
-  }
-  const tasks = sanitizeTasks(parsed);
   return {
-    tasks,
-    promptTokens: aiInvocation.request_tokens,
-    completionTokens: aiInvocation.response_tokens,
-    totalCostNano: aiInvocation.total_cost_nano,
+    tasks: parseTasks(content),
+    promptTokens,
+    completionTokens,
+    totalCostNano,
     rawContent: content,
   };
 }
@@ -229,6 +360,20 @@ export function chooseEmailText(payload: {
     : html || '';
 }
 
+// Default size of the existing-task context sent with each email, in tokens
+export const DEFAULT_TASK_CONTEXT_TOKEN_BUDGET = 2000;
+// Rough size of a token in characters for the JSON task context
+const CHARS_PER_TOKEN = 4;
+
+/**
+ * An open task as fetched for deduplication: the fields sent to the model,
+ * plus the sender of the email it came from, which is only used for ranking.
+ */
+export interface OpenTask extends Record<string, unknown> {
+  title: string;
+  from_email: string | null;
+}
+
 /**
  * Get all open tasks for a user for AI deduplication.
  * Query tasks table directly and join with user_task_states to get state.
@@ -240,27 +385,46 @@ export async function getOpenTasksForDeduplication(
   // deno-lint-ignore no-explicit-any
   supabase: any,
   userId: string
-): Promise<{ tasks: Record<string, unknown>[]; error?: string }> {
+): Promise<{ tasks: OpenTask[]; error?: string }> {
   const { data: existingRaw, error: existingError } = await supabase
     .from('tasks')
     .select(
       `
-      *,
+      title,
+      description,
+      due_date,
+      parent_action,
+      parent_requirement_level,
+      student_action,
+      student_requirement_level,
+      raw_emails (
+        from_email
+      ),
       user_task_states!left (
         state
       )
     `
     )
-    .eq('user_id', userId)
-    .or('state.is.null,state.eq.OPEN', { foreignTable: 'user_task_states' });
+    .eq('user_id', userId);
 
   if (existingError) {
     return { tasks: [], error: existingError.message };
   }
 
-  const existingRows = Array.isArray(existingRaw) ? existingRaw : [];
+  // A filter on the embedded states would only filter the embedded rows, not
+  // the tasks, so tasks are filtered here as in ingest_preamble: a task
+  // without a state row is OPEN
+  // deno-lint-ignore no-explicit-any
+  const isOpen = (t: any) =>
+    [t.user_task_states ?? []]
+      .flat()
+      // deno-lint-ignore no-explicit-any
+      .every((uts: any) => (uts?.state ?? 'OPEN') === 'OPEN');
+  const existingRows = (Array.isArray(existingRaw) ? existingRaw : []).filter(
+    isOpen
+  );
   // deno-lint-ignore no-explicit-any
-  const existingForAi = existingRows.map((t: any) => ({
+  const existingTasks = existingRows.map((t: any) => ({
     title: t.title,
     description: t.description ?? null,
     due_date: t.due_date ?? null,
@@ -268,9 +432,173 @@ export async function getOpenTasksForDeduplication(
     parent_requirement_level: t.parent_requirement_level ?? null,
     student_action: t.student_action ?? null,
     student_requirement_level: t.student_requirement_level ?? null,
+    from_email: t.raw_emails?.from_email ?? null,
   }));
 
-  return { tasks: existingForAi };
+  return { tasks: existingTasks };
+}
+
+export interface IngestPreamble {
+  // null when the alias is unknown or inactive
+  userId: string | null;
+  // An email with the same dedup key is already stored
+  duplicate: boolean;
+  budget: number;
+  tasks: OpenTask[];
+}
+
+/**
+ * Resolve an inbound alias and load what processing the email needs in one
+ * round trip: the user, whether the email is a duplicate, the remaining
+ * budget and the open tasks for deduplication. The dedup key is computed in
+ * the database from the same fields as the raw_emails trigger.
+ */
+export async function getIngestPreamble(
+  // deno-lint-ignore no-explicit-any
+  supabase: any,
+  alias: string,
+  email: {
+    messageId: string | null;
+    fromEmail: string | null;
+    toEmail: string | null;
+    subject: string | null;
+    sentAt: string | null;
+  }
+): Promise<{ preamble: IngestPreamble; error?: string }> {
+  const { data, error } = await supabase.rpc('ingest_preamble', {
+    p_alias: alias,
+    p_message_id: email.messageId,
+    p_from_email: email.fromEmail,
+    p_to_email: email.toEmail,
+    p_subject: email.subject,
+    p_sent_at: email.sentAt,
+  });
+  const preamble: IngestPreamble = {
+    userId: data?.user_id ?? null,
+    duplicate: data?.duplicate ?? false,
+    // A user without a budget row has no budget, as in getUserProcessingBudget
+    budget: data?.remaining_nano_usd ?? 0,
+    tasks: Array.isArray(data?.open_tasks) ? data.open_tasks : [],
+  };
+  if (error) return { preamble, error: error.message };
+  return { preamble };
+}
+
+// Words too common in school emails to say anything about relevance
+const STOP_WORDS = new Set([
+  'and',
+  'for',
+  'the',
+  'with',
+  'from',
+  'your',
+  'this',
+  'that',
+  'are',
+  'you',
+  'all',
+  'day',
+  'due',
+  'form',
+  'please',
+  'school',
+  'student',
+  'students',
+  'parent',
+  'parents',
+]);
+
+function words(text: string): string[] {
+  return (text.toLowerCase().match(/[a-z0-9]+/g) ?? []).filter(
+    (w) => w.length > 2 && !STOP_WORDS.has(w)
+  );
+}
+
+function senderAddress(from: string | null | undefined): string | null {
+  if (!from) return null;
+  const match = from.match(/<([^>]+)>/);
+  return (match ? match[1] : from).trim().toLowerCase() || null;
+}
+
+function estimateTokens(value: unknown): number {
+  return Math.ceil(JSON.stringify(value).length / CHARS_PER_TOKEN);
+}
+
+/**
+ * Score how likely an open task is to be duplicated by the incoming email.
+ * Combines the share of title words that appear in the email, whether the
+ * task came from the same sender (or sender domain), and how close its due
+ * date is to today. Long-overdue tasks are rarely mentioned again.
+ */
+export function scoreTaskRelevance(
+  task: OpenTask,
+  emailWords: Set<string>,
+  sender: string | null,
+  today: Date
+): number {
+  const titleWords = words(task.title);
+  const overlap = titleWords.length
+    ? titleWords.filter((w) => emailWords.has(w)).length / titleWords.length
+    : 0;
+
+  let source = 0;
+  const taskSender = senderAddress(task.from_email);
+  if (sender && taskSender) {
+    if (taskSender === sender) source = 1;
+    else if (taskSender.split('@')[1] === sender.split('@')[1]) source = 0.5;
+  }
+
+  let due = 0.5;
+  if (typeof task.due_date === 'string') {
+    const days =
+      (Date.parse(task.due_date) - today.getTime()) / (24 * 60 * 60 * 1000);
+    if (days < -14) due = 0;
+    else if (days <= 30) due = 1;
+    else due = 30 / days;
+  }
+
+  return 3 * overlap + 1.5 * source + due;
+}
+
+/**
+ * Pick the open tasks to send as deduplication context for an email.
+ * Tasks are ranked by relevance to the email and taken in that order until
+ * the token budget is used; internal fields are dropped.
+ */
+export function selectTasksForPrompt(
+  tasks: OpenTask[],
+  {
+    emailText,
+    fromEmail,
+    tokenBudget = DEFAULT_TASK_CONTEXT_TOKEN_BUDGET,
+    today = new Date(),
+  }: {
+    emailText: string;
+    fromEmail?: string | null;
+    tokenBudget?: number;
+    today?: Date;
+  }
+): Record<string, unknown>[] {
+  const emailWords = new Set(words(emailText));
+  const sender = senderAddress(fromEmail);
+  const ranked = tasks
+    .map((task, index) => ({
+      task,
+      index,
+      score: scoreTaskRelevance(task, emailWords, sender, today),
+    }))
+    .sort((a, b) => b.score - a.score || a.index - b.index);
+
+  const selected: Record<string, unknown>[] = [];
+  let remaining = tokenBudget;
+  for (const { task } of ranked) {
+    const { from_email: _fromEmail, ...forAi } = task;
+    const cost = estimateTokens(forAi);
+    if (cost > remaining) continue;
+    selected.push(forAi);
+    remaining -= cost;
+  }
+  return selected;
 }
 
 /**
@@ -287,6 +615,8 @@ export async function getUserProcessingBudget(
     .eq('user_id', userId)
     .single();
 
+  // PGRST116: no budget row, i.e. no budget rather than a failed read
+  if (budgetError?.code === 'PGRST116') return { budget: 0 };
   if (budgetError) {
     return { budget: 0, error: budgetError.message };
   }
@@ -332,6 +662,7 @@ export async function addNewTasksAndUpdateEmail({
   _completionTokens,
   rawContent,
   logPrefix,
+  timer = new StageTimer(),
 }: {
   // deno-lint-ignore no-explicit-any
   supabase: any;
@@ -343,8 +674,16 @@ export async function addNewTasksAndUpdateEmail({
   _completionTokens: number;
   rawContent: string;
   logPrefix: string;
-}): Promise<{ success: boolean; taskCount: number; error?: string }> {
+  // Records the task_insert and email_update stages
+  timer?: StageTimer;
+}): Promise<{
+  success: boolean;
+  taskCount: number;
+  taskIds: string[];
+  error?: string;
+}> {
   // Only add new tasks - do not delete any existing tasks
+  let taskIds: string[] = [];
   if (newTasks.length > 0) {
     const rows = newTasks.map((t: Record<string, unknown>) => ({
       user_id: userId,
@@ -358,23 +697,34 @@ export async function addNewTasksAndUpdateEmail({
       student_requirement_level: t.student_requirement_level ?? null,
     }));
 
-    const { error: insertError } = await supabase.from('tasks').insert(rows);
+    const { data: inserted, error: insertError } = await timer.time(
+      'task_insert',
+      () => supabase.from('tasks').insert(rows).select('id')
+    );
     if (insertError) {
       console.error(
         `[${logPrefix}] user=${userId} task_insert_failed: ${insertError.message} openai_response=${rawContent}`
       );
-      return { success: false, taskCount: 0, error: insertError.message };
+      return {
+        success: false,
+        taskCount: 0,
+        taskIds: [],
+        error: insertError.message,
+      };
     }
+    taskIds = (inserted ?? []).map((t: { id: string }) => t.id);
   }
 
   const finalTaskCount = existingTasksCount + newTasks.length;
-  const { error: updateError } = await supabase
-    .from('raw_emails')
-    .update({
-      tasks_after: finalTaskCount,
-      status: 'UPDATED_TASKS',
-    })
-    .eq('id', rawEmailId);
+  const { error: updateError } = await timer.time('email_update', () =>
+    supabase
+      .from('raw_emails')
+      .update({
+        tasks_after: finalTaskCount,
+        status: 'UPDATED_TASKS',
+      })
+      .eq('id', rawEmailId)
+  );
 
   if (updateError) {
     console.error(
@@ -386,8 +736,13 @@ export async function addNewTasksAndUpdateEmail({
       .delete()
       .eq('user_id', userId)
       .eq('email_id', rawEmailId);
-    return { success: false, taskCount: 0, error: updateError.message };
+    return {
+      success: false,
+      taskCount: 0,
+      taskIds: [],
+      error: updateError.message,
+    };
   }
 
-  return { success: true, taskCount: newTasks.length };
+  return { success: true, taskCount: newTasks.length, taskIds };
 }
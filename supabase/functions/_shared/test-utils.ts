@@ -8,6 +8,10 @@ export interface SupabaseStubState {
   aliases: any[];
   forwarding_verifications: any[];
   source_observations: any[];
+  ai_invocations: any[];
+  extraction_cache: any[];
+  analytics_events: any[];
+  ingest_queue: any[];
 }
 
 export interface SupabaseStubOptions {
@@ -15,6 +19,79 @@ export interface SupabaseStubOptions {
   budgetNanoUsd?: number;
 }
 
+// Compare a row value with a filter value, which may arrive as a string
+function compareValues(a: any, b: any): number {
+  if (typeof a === 'number') b = Number(b);
+  if (typeof b === 'number') a = Number(a);
+  if (typeof a === 'string' && typeof b === 'string') {
+    const aTime = Date.parse(a);
+    const bTime = Date.parse(b);
+    if (!isNaN(aTime) && !isNaN(bTime)) return Math.sign(aTime - bTime);
+  }
+  return a < b ? -1 : a > b ? 1 : 0;
+}
+
+// Split a PostgREST logic tree on top-level commas
+function splitTopLevel(condition: string): string[] {
+  const parts: string[] = [];
+  let depth = 0;
+  let quoted = false;
+  let current = '';
+  for (const ch of condition) {
+    if (ch === '"') quoted = !quoted;
+    if (!quoted && ch === '(') depth++;
+    if (!quoted && ch === ')') depth--;
+    if (!quoted && depth === 0 && ch === ',') {
+      parts.push(current);
+      current = '';
+    } else {
+      current += ch;
+    }
+  }
+  parts.push(current);
+  return parts;
+}
+
+// Build a row predicate from a PostgREST or()/and() filter string, supporting
+// the eq, gt and is.null operators
+function parseLogicTree(
+  condition: string,
+  operator: 'or' | 'and'
+): (r: any) => boolean {
+  const predicates = splitTopLevel(condition).map((part) => {
+    const nested = part.match(/^(and|or)\((.*)\)$/);
+    if (nested) return parseLogicTree(nested[2], nested[1] as 'or' | 'and');
+    const [field, op, ...rest] = part.split('.');
+    const value = rest.join('.').replace(/^"(.*)"$/, '$1');
+    if (op === 'is' && value === 'null')
+      return (r: any) => r[field] === null || r[field] === undefined;
+    if (op === 'eq')
+      return (r: any) =>
+        r[field] !== null &&
+        r[field] !== undefined &&
+        compareValues(r[field], value) === 0;
+    if (op === 'gt')
+      return (r: any) =>
+        r[field] !== null &&
+        r[field] !== undefined &&
+        compareValues(r[field], value) > 0;
+    throw new Error(`unsupported filter: ${part}`);
+  });
+  return operator === 'or'
+    ? (r: any) => predicates.some((p) => p(r))
+    : (r: any) => predicates.every((p) => p(r));
+}
+
+// Mirrors public.raw_email_dedup_key (without hashing the fallback fields)
+function rawEmailDedupKey(email: any): string {
+  return (
+    email.message_id ??
+    [email.from_email, email.to_email, email.subject, email.sent_at]
+      .map((v) => v ?? '')
+      .join('\u001f')
+  );
+}
+
 // Supabase stub factory
 export function createSupabaseStub(
   initialTasks: any[] = [],
@@ -29,6 +106,10 @@ export function createSupabaseStub(
     ],
     forwarding_verifications: [] as any[],
     source_observations: [] as any[],
+    ai_invocations: [] as any[],
+    extraction_cache: [] as any[],
+    analytics_events: [] as any[],
+    ingest_queue: [] as any[],
   };
   let insertAttempts = 0;
   return {
@@ -52,6 +133,39 @@ export function createSupabaseStub(
               },
             };
           },
+          upsert(row: any, opts: { onConflict?: string } = {}) {
+            // Mirrors the raw_emails dedup_key trigger and unique index
+            const dedupKey = row.dedup_key ?? rawEmailDedupKey(row);
+            const conflict =
+              opts.onConflict === 'dedup_key' &&
+              state.raw_emails.some((r) => r.dedup_key === dedupKey);
+            let data: any = null;
+            if (!conflict) {
+              const id = state.raw_emails.length + 1;
+              state.raw_emails.push({ id, ...row, dedup_key: dedupKey });
+              data = { id };
+              // Mirrors the raw_emails_enqueue trigger
+              if (row.status === 'QUEUED') {
+                state.ingest_queue.push({
+                  raw_email_id: id,
+                  user_id: row.user_id,
+                  attempts: 0,
+                  next_attempt_at: new Date().toISOString(),
+                  locked_until: null,
+                  last_error: null,
+                });
+              }
+            }
+            return {
+              select() {
+                return {
+                  maybeSingle() {
+                    return { data, error: null };
+                  },
+                };
+              },
+            };
+          },
           update(values: any) {
             const builder: any = {
               _updates: values,
@@ -74,11 +188,22 @@ export function createSupabaseStub(
           select() {
             const builder: any = {
               _filters: [] as ((r: any) => boolean)[],
-              _orderBy: null as { field: string; ascending: boolean } | null,
+              _orderBy: [] as {
+                field: string;
+                ascending: boolean;
+                nullsFirst?: boolean;
+              }[],
+              _limit: null as number | null,
               eq(field: string, value: any) {
                 this._filters.push((r: any) => r[field] === value);
                 return builder;
               },
+              gt(field: string, value: any) {
+                this._filters.push(
+                  (r: any) => compareValues(r[field], value) > 0
+                );
+                return builder;
+              },
               is(field: string, value: any) {
                 this._filters.push((r: any) =>
                   value === null
@@ -87,8 +212,19 @@ export function createSupabaseStub(
                 );
                 return builder;
               },
-              order(field: string, opts: { ascending: boolean }) {
-                this._orderBy = { field, ascending: opts.ascending };
+              or(condition: string) {
+                this._filters.push(parseLogicTree(condition, 'or'));
+                return builder;
+              },
+              order(
+                field: string,
+                opts: { ascending: boolean; nullsFirst?: boolean }
+              ) {
+                this._orderBy.push({ field, ...opts });
+                return builder;
+              },
+              limit(count: number) {
+                this._limit = count;
                 return builder;
               },
               then(resolve: any) {
@@ -97,15 +233,24 @@ export function createSupabaseStub(
                 );
 
                 // Apply ordering if specified
-                if (builder._orderBy) {
-                  const { field, ascending } = builder._orderBy;
-                  data = data.sort((a, b) => {
-                    const aVal = a[field];
-                    const bVal = b[field];
-                    if (aVal < bVal) return ascending ? -1 : 1;
-                    if (aVal > bVal) return ascending ? 1 : -1;
-                    return 0;
-                  });
+                data = data.sort((a, b) => {
+                  for (const order of builder._orderBy) {
+                    const { field, ascending, nullsFirst } = order;
+                    const aNull = a[field] === null || a[field] === undefined;
+                    const bNull = b[field] === null || b[field] === undefined;
+                    if (aNull || bNull) {
+                      if (aNull && bNull) continue;
+                      // Postgres puts nulls last in ascending order by default
+                      const nullsLast = !(nullsFirst ?? !ascending);
+                      return aNull === nullsLast ? 1 : -1;
+                    }
+                    const cmp = compareValues(a[field], b[field]);
+                    if (cmp !== 0) return ascending ? cmp : -cmp;
+                  }
+                  return 0;
+                });
+                if (builder._limit !== null) {
+                  data = data.slice(0, builder._limit);
                 }
 
                 return resolve({ data, error: null });
@@ -157,32 +302,17 @@ export function createSupabaseStub(
                 builder._filters.push((r: any) => r[field] === value);
                 return builder;
               },
-              or(condition: string, opts?: { foreignTable?: string }) {
-                // Handle the specific OR condition for open tasks:
-                // 'state.is.null,state.eq.OPEN' with foreignTable: 'user_task_states'
-                if (
-                  opts?.foreignTable === 'user_task_states' &&
-                  condition.includes('state.is.null') &&
-                  condition.includes('state.eq.OPEN')
-                ) {
-                  builder._filters.push((r: any) => {
-                    const taskState =
-                      r.user_task_states?.[0]?.state || r.state || 'OPEN';
-                    return taskState === 'OPEN';
-                  });
-                }
-                return builder;
-              },
               then(resolve: any) {
                 let data = state.tasks.filter((t) =>
                   builder._filters.every((f: any) => f(t))
                 );
 
-                // Simulate the join with user_task_states
+                // Simulate the left join with user_task_states: a task's
+                // state field stands for its state row, if any
                 if (fields && fields.includes('user_task_states')) {
                   data = data.map((task) => ({
                     ...task,
-                    user_task_states: [{ state: task.state || 'OPEN' }],
+                    user_task_states: task.state ? [{ state: task.state }] : [],
                   }));
                 }
 
@@ -214,14 +344,18 @@ export function createSupabaseStub(
           insert(rows: any[]) {
             insertAttempts++;
             if (opts.failTaskInsert && insertAttempts === 1) {
-              return { error: new Error('insert fail') };
-            }
-            if (Array.isArray(rows)) {
-              state.tasks.push(...rows);
-            } else {
-              state.tasks.push(rows);
+              const failed = { data: null, error: new Error('insert fail') };
+              return { ...failed, select: () => failed };
             }
-            return { error: null };
+            const inserted = (Array.isArray(rows) ? rows : [rows]).map(
+              (row) => ({ id: `task-${state.tasks.length + 1}`, ...row })
+            );
+            for (const row of inserted) state.tasks.push(row);
+            const result = {
+              data: inserted.map((row) => ({ id: row.id })),
+              error: null,
+            };
+            return { ...result, select: () => result };
           },
         };
       }
@@ -332,6 +466,7 @@ export function createSupabaseStub(
                   data: {
                     id: 1,
                     system_prompt: 'Test system prompt',
+                    prompt: 'Test system prompt',
                     model: 'gpt-4',
                     temperature: 0.1,
                     max_tokens: 2000,
@@ -358,6 +493,7 @@ export function createSupabaseStub(
               ...row,
               total_cost_nano: totalCostNano,
             };
+            state.ai_invocations.push(fullRow);
             return {
               select() {
                 return {
@@ -370,54 +506,81 @@ export function createSupabaseStub(
           },
         };
       }
-      if (table === 'source_observations') {
+      if (table === 'extraction_cache') {
         return {
           select() {
             const builder: any = {
               _filters: [] as ((r: any) => boolean)[],
+              _limit: null as number | null,
               eq(field: string, value: any) {
                 builder._filters.push((r: any) => r[field] === value);
                 return builder;
               },
-              maybeSingle() {
-                const data = state.source_observations.filter((r) =>
-                  builder._filters.every((f: any) => f(r))
+              in(field: string, values: any[]) {
+                builder._filters.push((r: any) => values.includes(r[field]));
+                return builder;
+              },
+              gt(field: string, value: any) {
+                builder._filters.push(
+                  (r: any) => compareValues(r[field], value) > 0
                 );
-                return { data: data[0] ?? null, error: null };
+                return builder;
               },
-            };
-            return builder;
-          },
-          insert(row: any) {
-            const id = state.source_observations.length + 1;
-            const now = new Date().toISOString();
-            const full = {
-              id,
-              msg_first_seen: now,
-              msg_last_seen: now,
-              msg_count: 1,
-              ...row,
-            };
-            state.source_observations.push(full);
-            return { data: { id }, error: null };
-          },
-          update(values: any) {
-            const builder: any = {
-              _updates: values,
-              _filters: [] as ((r: any) => boolean)[],
-              eq(field: string, value: any) {
-                builder._filters.push((r: any) => r[field] === value);
+              limit(count: number) {
+                builder._limit = count;
                 return builder;
               },
               then(resolve: any) {
-                state.source_observations
-                  .filter((r) => builder._filters.every((f: any) => f(r)))
-                  .forEach((r) => Object.assign(r, builder._updates));
-                return resolve({ data: null, error: null });
+                const data = state.extraction_cache.filter((r) =>
+                  builder._filters.every((f: any) => f(r))
+                );
+                return resolve({
+                  data: data.slice(0, builder._limit ?? data.length),
+                  error: null,
+                });
               },
             };
             return builder;
           },
+          upsert(row: any) {
+            state.extraction_cache = state.extraction_cache.filter(
+              (r) => r.cache_key !== row.cache_key
+            );
+            state.extraction_cache.push(row);
+            return { data: null, error: null };
+          },
+        };
+      }
+      if (table === 'ingest_queue') {
+        const filtered = (apply: (matches: (r: any) => boolean) => void) => {
+          const builder: any = {
+            _filters: [] as ((r: any) => boolean)[],
+            eq(field: string, value: any) {
+              builder._filters.push((r: any) => r[field] === value);
+              return builder;
+            },
+            then(resolve: any) {
+              apply((r) => builder._filters.every((f: any) => f(r)));
+              return resolve({ data: null, error: null });
+            },
+          };
+          return builder;
+        };
+        return {
+          update(values: any) {
+            return filtered((matches) =>
+              state.ingest_queue
+                .filter(matches)
+                .forEach((r) => Object.assign(r, values))
+            );
+          },
+          delete() {
+            return filtered((matches) => {
+              state.ingest_queue = state.ingest_queue.filter(
+                (r) => !matches(r)
+              );
+            });
+          },
         };
       }
       throw new Error(`unknown table: ${table}`);
@@ -436,6 +599,137 @@ export function createSupabaseStub(
         state.budget = newRemaining;
         return { data: newRemaining, error: null };
       }
+      if (functionName === 'upsert_source_observation') {
+        // Mirrors insert ... on conflict (user_id, registrable_domain) do update
+        const p = params as Record<string, any>;
+        const existing = state.source_observations.find(
+          (r) =>
+            r.user_id === p.p_user_id &&
+            r.registrable_domain === p.p_registrable_domain
+        );
+        const now = new Date().toISOString();
+        if (!existing) {
+          state.source_observations.push({
+            id: state.source_observations.length + 1,
+            user_id: p.p_user_id,
+            registrable_domain: p.p_registrable_domain,
+            list_id: p.p_list_id,
+            dkim_d: p.p_dkim_d,
+            sender_domain: p.p_sender_domain ?? p.p_return_path_domain,
+            unsubscribe_domain: p.p_unsubscribe_domain,
+            platform_hint: p.p_platform_hint,
+            msg_first_seen: now,
+            msg_last_seen: now,
+            msg_count: 1,
+          });
+          return { data: 1, error: null };
+        }
+        existing.msg_last_seen = now;
+        existing.msg_count += 1;
+        existing.list_id = p.p_list_id ?? existing.list_id;
+        existing.dkim_d = p.p_dkim_d ?? existing.dkim_d;
+        existing.sender_domain = p.p_sender_domain ?? existing.sender_domain;
+        existing.unsubscribe_domain =
+          p.p_unsubscribe_domain ?? existing.unsubscribe_domain;
+        existing.platform_hint = p.p_platform_hint ?? existing.platform_hint;
+        return { data: existing.msg_count, error: null };
+      }
+      if (functionName === 'log_analytics_events_batch') {
+        // Mirrors insert ... on conflict do nothing over the unique indexes
+        let inserted = 0;
+        for (const event of params.p_events as any[]) {
+          const duplicate = state.analytics_events.some(
+            (e) =>
+              e.idempotency_key === event.idempotency_key ||
+              (event.ingest_id &&
+                event.event_type.startsWith('email_') &&
+                e.user_id === event.user_id &&
+                e.event_type === event.event_type &&
+                e.ingest_id === event.ingest_id)
+          );
+          if (duplicate) continue;
+          state.analytics_events.push(event);
+          inserted++;
+        }
+        return Promise.resolve({ data: inserted, error: null });
+      }
+      if (functionName === 'ingest_preamble') {
+        // Mirrors the alias, duplicate, budget and open task reads of the RPC
+        const p = params as Record<string, any>;
+        const alias = state.aliases.find(
+          (a) => a.alias === p.p_alias && a.active
+        );
+        if (!alias) {
+          return Promise.resolve({ data: { user_id: null }, error: null });
+        }
+        const dedupKey = rawEmailDedupKey({
+          message_id: p.p_message_id,
+          from_email: p.p_from_email,
+          to_email: p.p_to_email,
+          subject: p.p_subject,
+          sent_at: p.p_sent_at,
+        });
+        if (state.raw_emails.some((r) => r.dedup_key === dedupKey)) {
+          return Promise.resolve({
+            data: { user_id: alias.user_id, duplicate: true },
+            error: null,
+          });
+        }
+        const openTasks = state.tasks
+          .filter(
+            (t) => t.user_id === alias.user_id && (t.state || 'OPEN') === 'OPEN'
+          )
+          .map((t) => ({
+            title: t.title,
+            description: t.description ?? null,
+            due_date: t.due_date ?? null,
+            parent_action: t.parent_action ?? null,
+            parent_requirement_level: t.parent_requirement_level ?? null,
+            student_action: t.student_action ?? null,
+            student_requirement_level: t.student_requirement_level ?? null,
+            from_email: t.from_email ?? null,
+          }));
+        return Promise.resolve({
+          data: {
+            user_id: alias.user_id,
+            duplicate: false,
+            remaining_nano_usd: state.budget ?? null,
+            open_tasks: openTasks,
+          },
+          error: null,
+        });
+      }
+      if (functionName === 'claim_ingest_jobs') {
+        // Mirrors select ... for update skip locked plus the lease update
+        const { p_limit, p_lease_seconds } = params as Record<string, number>;
+        const now = Date.now();
+        const isQueued = (q: any) =>
+          state.raw_emails.find((r) => r.id === q.raw_email_id)?.status ===
+          'QUEUED';
+        state.ingest_queue = state.ingest_queue.filter(isQueued);
+        const due = state.ingest_queue
+          .filter(
+            (q) =>
+              Date.parse(q.next_attempt_at) <= now &&
+              (q.locked_until === null || Date.parse(q.locked_until) < now)
+          )
+          .slice(0, p_limit);
+        const data = due.map((q) => {
+          q.attempts += 1;
+          q.locked_until = new Date(now + p_lease_seconds * 1000).toISOString();
+          const raw = state.raw_emails.find((r) => r.id === q.raw_email_id);
+          return {
+            raw_email_id: q.raw_email_id,
+            user_id: q.user_id,
+            attempts: q.attempts,
+            sent_at: raw?.sent_at ?? null,
+            from_email: raw?.from_email ?? null,
+            text_body: raw?.text_body ?? null,
+            html_body: raw?.html_body ?? null,
+          };
+        });
+        return Promise.resolve({ data, error: null });
+      }
       throw new Error(`unknown RPC function: ${functionName}`);
     },
   };
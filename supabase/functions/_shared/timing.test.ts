@@ -0,0 +1,79 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import { StageTimer, withServerTiming } from './timing.ts';
+import { test } from 'node:test';
+
+// Clock that advances by the given steps on each read
+function fakeClock(...steps: number[]) {
+  let time = 0;
+  return () => (time += steps.shift() ?? 0);
+}
+
+test('StageTimer sums repeated stages in Server-Timing', async () => {
+  const timer = new StageTimer(fakeClock(0, 0, 5, 0, 20, 0, 30, 1));
+  await timer.time('auth', () => true);
+  await timer.time('model', () => Promise.resolve('a'));
+  await timer.time('model', async () => 'b');
+  timer.stop();
+  assertEquals(timer.serverTiming(), 'auth;dur=5, model;dur=50, total;dur=56');
+});
+
+test('StageTimer records a span when the stage throws', async () => {
+  const timer = new StageTimer(fakeClock(0, 0, 7));
+  let thrown = false;
+  try {
+    await timer.time('model', () => Promise.reject(new Error('boom')));
+  } catch {
+    thrown = true;
+  }
+  assert(thrown);
+  assert(timer.serverTiming().startsWith('model;dur=7'));
+});
+
+test('StageTimer logs every span once background work settles', async () => {
+  const timer = new StageTimer(fakeClock(0, 0, 1.25, 0, 0, 2, 0));
+  await timer.time('alias_lookup', () => null);
+  let resolve!: () => void;
+  timer.inBackground(
+    'source_observation',
+    () => new Promise<void>((r) => (resolve = r))
+  );
+  await timer.time('model', () => null);
+  timer.stop();
+  assert(!timer.serverTiming().includes('source_observation'));
+
+  resolve();
+  await timer.settled();
+  const line = timer.logLine('inbound-email', { status: 200 });
+  assert(line.startsWith('[inbound-email] stage_timings {'));
+  const logged = JSON.parse(line.slice(line.indexOf('{')));
+  assertEquals(logged.function, 'inbound-email');
+  assertEquals(logged.status, 200);
+  assertEquals(logged.total_ms, 3.3);
+  assertEquals(logged.stages.alias_lookup[0], 1.3);
+  assertEquals(logged.stages.source_observation.length, 1);
+});
+
+test('withServerTiming keeps the response and adds the header', async () => {
+  const timer = new StageTimer(fakeClock(0, 3));
+  timer.stop();
+  const response = withServerTiming(
+    new Response('{"ok":true}', {
+      status: 201,
+      headers: { 'content-type': 'application/json' },
+    }),
+    timer
+  );
+  assertEquals(response.status, 201);
+  assertEquals(response.headers.get('content-type'), 'application/json');
+  assertEquals(response.headers.get('server-timing'), 'total;dur=3');
+  assertEquals((await response.json()).ok, true);
+});
@@ -0,0 +1,101 @@
+// Per-stage timing of edge function requests.
+//
+// A StageTimer collects the duration of each stage of a request (auth, alias
+// lookup, model call, ...). The totals are returned in a Server-Timing
+// header, and every span is written in one structured log line per request,
+// which tools/stage_timings.py turns into per-stage percentiles.
+
+// Marks the structured log line; tools/stage_timings.py looks for it
+export const STAGE_TIMINGS_EVENT = 'stage_timings';
+
+export class StageTimer {
+  private readonly start: number;
+  private end: number | null = null;
+  // Stage name -> duration of each span in milliseconds, in first-seen order
+  private readonly spans = new Map<string, number[]>();
+  private readonly background: Promise<unknown>[] = [];
+
+  constructor(private readonly now: () => number = () => performance.now()) {
+    this.start = now();
+  }
+
+  record(stage: string, durationMs: number): void {
+    const durations = this.spans.get(stage) ?? [];
+    durations.push(durationMs);
+    this.spans.set(stage, durations);
+  }
+
+  /** Run fn and record its duration under stage, also when it throws. */
+  async time<T>(stage: string, fn: () => T | PromiseLike<T>): Promise<T> {
+    const started = this.now();
+    try {
+      return await fn();
+    } finally {
+      this.record(stage, this.now() - started);
+    }
+  }
+
+  /**
+   * Time work that the request does not wait for. Its span is recorded when
+   * it finishes, which may be after the response is sent.
+   */
+  inBackground(stage: string, fn: () => PromiseLike<unknown>): void {
+    this.background.push(this.time(stage, fn).catch(() => {}));
+  }
+
+  /** Wait for the work started with inBackground. */
+  async settled(): Promise<void> {
+    await Promise.all(this.background);
+  }
+
+  /** End the request's total time, e.g. when the response is ready. */
+  stop(): void {
+    this.end ??= this.now();
+  }
+
+  elapsedMs(): number {
+    return (this.end ?? this.now()) - this.start;
+  }
+
+  /** Server-Timing header value with the total time of each stage. */
+  serverTiming(): string {
+    const entries = [...this.spans].map(
+      ([stage, durations]) =>
+        `${stage};dur=${round(durations.reduce((a, b) => a + b, 0))}`
+    );
+    entries.push(`total;dur=${round(this.elapsedMs())}`);
+    return entries.join(', ');
+  }
+
+  /** Structured log line with every span of the request. */
+  logLine(fn: string, fields: Record<string, unknown> = {}): string {
+    const stages: Record<string, number[]> = {};
+    for (const [stage, durations] of this.spans) {
+      stages[stage] = durations.map(round);
+    }
+    return `[${fn}] ${STAGE_TIMINGS_EVENT} ${JSON.stringify({
+      function: fn,
+      ...fields,
+      total_ms: round(this.elapsedMs()),
+      stages,
+    })}`;
+  }
+}
+
+function round(ms: number): number {
+  return Math.round(ms * 10) / 10;
+}
+
+/** Copy of response with the timer's Server-Timing header. */
+export function withServerTiming(
+  response: Response,
+  timer: StageTimer
+): Response {
+  const headers = new Headers(response.headers);
+  headers.set('server-timing', timer.serverTiming());
+  return new Response(response.body, {
+    status: response.status,
+    statusText: response.statusText,
+    headers,
+  });
+}
@@ -8,7 +8,8 @@ function assertEquals(actual: unknown, expected: unknown, msg = '') {
   }
 }
 
-import { createHandler } from './index.ts';
+import { createAliasCache, createHandler } from './index.ts';
+import { AnalyticsEmitter } from '../_shared/analytics.ts';
 import { test } from 'node:test';
 import { createSupabaseStub, createFetchStub } from '../_shared/test-utils.ts';
 
@@ -102,13 +103,26 @@ test('hits OpenAI API to extract tasks', async () => {
 test('skips processing when budget depleted', async () => {
   const supabase = createSupabaseStub([], { budgetNanoUsd: 0 });
   const fetchStub = createFetchStub([{ title: 'New' }]);
-  const handler = makeHandler(supabase, fetchStub);
+  const analytics = new AnalyticsEmitter(supabase);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    basicUser: BASIC_USER,
+    basicPassword: BASIC_PASS,
+    allowedIps: [ALLOWED_IP],
+    inboundDomain: 'in.emailinator.app',
+    analytics,
+  });
 
   const res = await handler(makeReq({ TextBody: 'email' }));
   assertEquals(res.status, 200);
   assertEquals(fetchStub.calls.length, 0);
   assertEquals(supabase.state.raw_emails.length, 1);
   assertEquals(supabase.state.raw_emails[0].status, 'UNPROCESSED');
+  await analytics.flush();
+  const types = supabase.state.analytics_events.map((e) => e.event_type);
+  assertEquals(types.join(','), 'email_received');
 });
 
 test('atomically decrements budget after processing', async () => {
@@ -275,6 +289,36 @@ test('dedupes emails without Message-ID using other fields', async () => {
   assertEquals(supabase.state.raw_emails.length, 1);
 });
 
+test('does not call OpenAI for a duplicate delivery', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = makeHandler(supabase, fetchStub);
+
+  const payload = { TextBody: 'email', MessageID: '<id-2>' };
+  await handler(makeReq(payload));
+  const res = await handler(makeReq(payload));
+  assertEquals(res.status, 200);
+  assertEquals(await res.text(), 'Duplicate Message-ID (already processed)');
+  assertEquals(fetchStub.calls.length, 1);
+  assertEquals(supabase.state.tasks.length, 1);
+});
+
+test('stores concurrent deliveries of the same email once', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([]);
+  const handler = makeHandler(supabase, fetchStub);
+
+  const payload = { TextBody: 'email', MessageID: '<id-3>' };
+  const responses = await Promise.all([
+    handler(makeReq(payload)),
+    handler(makeReq(payload)),
+    handler(makeReq(payload)),
+  ]);
+  for (const res of responses) assertEquals(res.status, 200);
+  assertEquals(supabase.state.raw_emails.length, 1);
+  assertEquals(fetchStub.calls.length, 1);
+});
+
 test('only open tasks are deduped', async () => {
   const existing = [
     { id: 1, user_id: 'user-1', title: 'Open', state: 'OPEN' },
@@ -337,52 +381,18 @@ test('all open tasks are fetched for deduplication', async () => {
   const supabase = createSupabaseStub(existing);
   const fetchStub = createFetchStub([{ title: 'New task' }]);
 
-  // Track which tasks were queried by intercepting the query to tasks table
-  const queriedTasks: Record<string, unknown>[] = [];
-  const originalFrom = supabase.from;
-  supabase.from = function (table: string) {
-    const result = originalFrom.call(this, table);
-    if (table === 'tasks' && result.select) {
-      const originalSelect = result.select;
-      result.select = function (fields?: string) {
-        const selectResult = originalSelect.call(this, fields);
-        // Override the result to capture all tasks, then filter for open ones
-        if (selectResult.then) {
-          const originalThen = selectResult.then;
-          selectResult.then = function (resolve: any) {
-            // Return all tasks with mock user_task_states
-            const tasksWithState = existing.map((task) => ({
-              ...task,
-              user_task_states: [{ state: task.state || 'OPEN' }],
-            }));
-            // The actual code will filter these for OPEN state
-            queriedTasks.push(
-              ...tasksWithState.filter(
-                (t) => (t.user_task_states[0]?.state || 'OPEN') === 'OPEN'
-              )
-            );
-            return resolve({ data: tasksWithState, error: null });
-          };
-        }
-        return selectResult;
-      };
-    }
-    return result;
-  };
-
   const handler = makeHandler(supabase, fetchStub);
   const res = await handler(makeReq({ TextBody: 'email' }));
 
   assertEquals(res.status, 200);
 
-  // Verify ALL open tasks were returned (past, future, and null due date)
-  assertEquals(queriedTasks.length, 3);
-  const titles = queriedTasks.map((t) => t.title);
-  assert(titles.includes('Past task'), 'Should include past task');
-  assert(titles.includes('Future task'), 'Should include future task');
-  assert(titles.includes('No due date'), 'Should include null due date task');
+  // Verify ALL open tasks were sent (past, future, and null due date)
+  const body = fetchStub.calls[0].init.body;
+  assert(body.includes('Past task'), 'Should include past task');
+  assert(body.includes('Future task'), 'Should include future task');
+  assert(body.includes('No due date'), 'Should include null due date task');
   assert(
-    !titles.includes('Completed past'),
+    !body.includes('Completed past'),
     'Should not include completed task'
   );
 
@@ -479,3 +489,197 @@ test('updates existing source observation and increments count', async () => {
   assertEquals(obs.dkim_d, 'notify.castilleja.org');
   assertEquals(obs.list_id, '<announcements.castilleja.org>');
 });
+
+test('loads the alias, budget and open tasks in one round trip', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([]);
+  const queried: string[] = [];
+  const originalFrom = supabase.from;
+  supabase.from = function (table: string) {
+    queried.push(table);
+    return originalFrom.call(this, table);
+  };
+  const rpcCalls: string[] = [];
+  const originalRpc = supabase.rpc;
+  supabase.rpc = function (name: string, params: any) {
+    rpcCalls.push(name);
+    return originalRpc.call(this, name, params);
+  };
+  const handler = makeHandler(supabase, fetchStub);
+
+  for (const id of ['<c-1>', '<c-2>', '<c-3>']) {
+    const res = await handler(makeReq({ TextBody: 'email', MessageID: id }));
+    assertEquals(res.status, 200);
+  }
+  const duplicate = await handler(
+    makeReq({ TextBody: 'email', MessageID: '<c-1>' })
+  );
+  assertEquals(
+    await duplicate.text(),
+    'Duplicate Message-ID (already processed)'
+  );
+  for (let i = 0; i < 2; i++) {
+    const unknown = await handler(makeReq({ To: 'nobody@in.emailinator.app' }));
+    assertEquals(unknown.status, 404);
+  }
+  const count = (names: string[], name: string) =>
+    names.filter((n) => n === name).length;
+  // Three emails, the duplicate and the unknown alias once; the unknown
+  // alias is then answered from the cache
+  assertEquals(count(rpcCalls, 'ingest_preamble'), 5);
+  for (const table of ['email_aliases', 'tasks', 'processing_budgets']) {
+    assert(!queried.includes(table), `unexpected ${table} query`);
+  }
+  assertEquals(count(queried, 'ai_prompt_configs'), 1);
+  assertEquals(supabase.state.raw_emails.length, 3);
+});
+
+test('forgets the user of a deactivated alias', async () => {
+  const supabase = createSupabaseStub();
+  const aliasCache = createAliasCache();
+  const handler = createHandler({
+    supabase,
+    fetch: createFetchStub([]),
+    openAiApiKey: 'test',
+    basicUser: BASIC_USER,
+    basicPassword: BASIC_PASS,
+    allowedIps: [ALLOWED_IP],
+    inboundDomain: 'in.emailinator.app',
+    aliasCache,
+  });
+
+  let res = await handler(makeReq({ TextBody: 'email', MessageID: '<d-1>' }));
+  assertEquals(res.status, 200);
+  assertEquals(aliasCache.get('u_1@in.emailinator.app'), 'user-1');
+
+  supabase.state.aliases[0].active = false;
+  res = await handler(makeReq({ TextBody: 'email', MessageID: '<d-2>' }));
+  assertEquals(res.status, 404);
+  assertEquals(aliasCache.get('u_1@in.emailinator.app'), null);
+  const stats = aliasCache.stats();
+  assertEquals(stats.hits, 1);
+  assertEquals(stats.misses, 1);
+});
+
+test('counts concurrent emails from the same source', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([]);
+  const handler = makeHandler(supabase, fetchStub);
+
+  await Promise.all(
+    ['<s-1>', '<s-2>', '<s-3>'].map((id) =>
+      handler(
+        makeReq({
+          From: 'office@castilleja.org',
+          TextBody: 'email',
+          MessageID: id,
+        })
+      )
+    )
+  );
+  assertEquals(supabase.state.source_observations.length, 1);
+  assertEquals(supabase.state.source_observations[0].msg_count, 3);
+  assertEquals(
+    supabase.state.source_observations[0].sender_domain,
+    'castilleja.org'
+  );
+});
+
+test('emits processing events in one batch after responding', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([{ title: 'A' }, { title: 'B' }]);
+  const rpcCalls: string[] = [];
+  const originalRpc = supabase.rpc;
+  supabase.rpc = function (name: string, params: any) {
+    rpcCalls.push(name);
+    return originalRpc.call(this, name, params);
+  };
+  const analytics = new AnalyticsEmitter(supabase);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    basicUser: BASIC_USER,
+    basicPassword: BASIC_PASS,
+    allowedIps: [ALLOWED_IP],
+    inboundDomain: 'in.emailinator.app',
+    analytics,
+  });
+
+  const res = await handler(makeReq({ TextBody: 'email', MessageID: '<e>' }));
+  assertEquals(res.status, 200);
+  await analytics.flush();
+
+  const events = supabase.state.analytics_events;
+  const types = events.map((e) => e.event_type);
+  assertEquals(
+    types.join(','),
+    'email_received,email_processed_success,task_created,task_created'
+  );
+  const emailId = supabase.state.raw_emails[0].id;
+  assert(events.every((e) => e.ingest_id === emailId));
+  assert(events.every((e) => e.user_id === 'user-1' && e.idempotency_key));
+  assertEquals(events[3].task_id, supabase.state.tasks[1].id);
+  const batches = rpcCalls.filter((n) => n === 'log_analytics_events_batch');
+  assertEquals(batches.length, 1);
+});
+
+test('async ingest stores and enqueues the email without extracting', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    basicUser: BASIC_USER,
+    basicPassword: BASIC_PASS,
+    allowedIps: [ALLOWED_IP],
+    inboundDomain: 'in.emailinator.app',
+    asyncIngest: true,
+  });
+
+  const payload = { TextBody: 'email', MessageID: '<q-1>' };
+  const res = await handler(makeReq(payload));
+  assertEquals(res.status, 200);
+  assertEquals((await res.json()).queued, true);
+  assertEquals(fetchStub.calls.length, 0);
+  assertEquals(supabase.state.tasks.length, 0);
+  assertEquals(supabase.state.raw_emails[0].status, 'QUEUED');
+  assertEquals(supabase.state.ingest_queue.length, 1);
+  assertEquals(
+    supabase.state.ingest_queue[0].raw_email_id,
+    supabase.state.raw_emails[0].id
+  );
+
+  const duplicate = await handler(makeReq(payload));
+  assertEquals(
+    await duplicate.text(),
+    'Duplicate Message-ID (already processed)'
+  );
+  assertEquals(supabase.state.ingest_queue.length, 1);
+});
+
+test('reports stage timings in Server-Timing', async () => {
+  const supabase = createSupabaseStub();
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = makeHandler(supabase, fetchStub);
+
+  const res = await handler(makeReq({ TextBody: 'email', MessageID: '<t>' }));
+  assertEquals(res.status, 200);
+  const stages = (res.headers.get('server-timing') ?? '')
+    .split(', ')
+    .map((entry) => entry.split(';')[0]);
+  for (const stage of [
+    'auth',
+    'parse',
+    'preamble',
+    'dedup',
+    'model',
+    'task_insert',
+    'email_update',
+    'budget_decrement',
+    'total',
+  ]) {
+    assert(stages.includes(stage), `missing ${stage} in ${stages}`);
+  }
+});
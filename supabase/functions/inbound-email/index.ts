@@ -3,10 +3,21 @@ import {
   extractNewTasks,
   addNewTasksAndUpdateEmail,
   chooseEmailText,
-  getOpenTasksForDeduplication,
-  getUserProcessingBudget,
+  selectTasksForPrompt,
+  getIngestPreamble,
+  OpenTask,
   decrementProcessingBudget,
 } from '../_shared/task-utils.ts';
+import { createPromptConfigCache, PromptConfigCache } from '../_shared/ai.ts';
+import { TtlCache } from '../_shared/cache.ts';
+import { compactEmailText } from '../_shared/compaction.ts';
+import {
+  AnalyticsEmitter,
+  emailEvent,
+  emitEmailProcessed,
+  runInBackground,
+} from '../_shared/analytics.ts';
+import { StageTimer, withServerTiming } from '../_shared/timing.ts';
 
 type InboundPayload = {
   From?: string;
@@ -55,20 +66,46 @@ export interface Deps {
   supabase: any;
   fetch: typeof fetch;
   openAiApiKey: string;
+  openAiBaseUrl?: string;
+  taskContextTokenBudget?: number;
   basicUser: string;
   basicPassword: string;
   allowedIps: string[];
   inboundDomain: string;
+  // Active alias -> user_id, or null for unknown aliases
+  aliasCache?: TtlCache<string, string | null>;
+  promptConfigCache?: PromptConfigCache;
+  analytics?: AnalyticsEmitter;
+  // Only store and enqueue the email; ingest-worker extracts its tasks
+  asyncIngest?: boolean;
+}
+
+export const ALIAS_TTL_MS = 60_000;
+// Short, so mail to a newly created alias is accepted soon after
+export const ALIAS_NEGATIVE_TTL_MS = 10_000;
+
+export function createAliasCache(): TtlCache<string, string | null> {
+  return new TtlCache({
+    maxEntries: 10_000,
+    ttlMs: ALIAS_TTL_MS,
+    negativeTtlMs: ALIAS_NEGATIVE_TTL_MS,
+  });
 }
 
 export function createHandler({
   supabase,
   fetch,
   openAiApiKey,
+  openAiBaseUrl,
+  taskContextTokenBudget,
   basicUser,
   basicPassword,
   allowedIps,
   inboundDomain,
+  aliasCache = createAliasCache(),
+  promptConfigCache = createPromptConfigCache(),
+  analytics = new AnalyticsEmitter(supabase),
+  asyncIngest = false,
 }: Deps) {
   // Extract a lowercased email address from a header value like
   // '"Name" <user@example.com>' or 'user@example.com'
@@ -275,60 +312,25 @@ export function createHandler({
 
       const platform_hint = toPlatformHint(regDomain);
 
-      // Merge with existing row if present
-      const { data: existing, error: selErr } = await supabase
-        .from('source_observations')
-        .select('*')
-        .eq('user_id', user_id)
-        .eq('registrable_domain', regDomain)
-        .maybeSingle();
-      if (selErr) return; // Non-fatal
-
-      if (existing) {
-        const updates: Record<string, any> = {
-          msg_last_seen: new Date().toISOString(),
-          msg_count: (existing.msg_count ?? 0) + 1,
-        };
-        if (listId && listId !== existing.list_id) updates.list_id = listId;
-        if (dkim_d && dkim_d !== existing.dkim_d) updates.dkim_d = dkim_d;
-        if (fromDomain && fromDomain !== existing.sender_domain)
-          updates.sender_domain = fromDomain;
-        if (
-          unsubscribeDomain &&
-          unsubscribeDomain !== existing.unsubscribe_domain
-        )
-          updates.unsubscribe_domain = unsubscribeDomain;
-        if (platform_hint && platform_hint !== existing.platform_hint)
-          updates.platform_hint = platform_hint;
-
-        await supabase
-          .from('source_observations')
-          .update(updates)
-          .eq('id', existing.id);
-      } else {
-        await supabase.from('source_observations').insert({
-          user_id,
-          registrable_domain: regDomain,
-          list_id: listId ?? null,
-          dkim_d: dkim_d ?? null,
-          sender_domain: fromDomain ?? returnPathDomain ?? null,
-          unsubscribe_domain: unsubscribeDomain ?? null,
-          platform_hint: platform_hint ?? null,
-          // msg_* fields rely on defaults
-        });
-      }
+      // Insert or merge into the existing row in one atomic statement
+      await supabase.rpc('upsert_source_observation', {
+        p_user_id: user_id,
+        p_registrable_domain: regDomain,
+        p_list_id: listId ?? null,
+        p_dkim_d: dkim_d ?? null,
+        p_sender_domain: fromDomain ?? null,
+        p_return_path_domain: returnPathDomain ?? null,
+        p_unsubscribe_domain: unsubscribeDomain ?? null,
+        p_platform_hint: platform_hint ?? null,
+      });
     } catch (_) {
       // Do not block processing if observation fails
     }
   }
-  return async function handler(req: Request): Promise<Response> {
-    if (req.method !== 'POST')
-      return new Response('Method Not Allowed', { status: 405 });
+  function isAuthorized(req: Request): boolean {
     const ipHeader = req.headers.get('x-forwarded-for') ?? '';
     const ip = ipHeader.split(',')[0].trim();
-    if (allowedIps.length > 0 && !allowedIps.includes(ip)) {
-      return new Response('Unauthorized', { status: 401 });
-    }
+    if (allowedIps.length > 0 && !allowedIps.includes(ip)) return false;
 
     const auth = req.headers.get('authorization') ?? '';
     const [scheme, encoded] = auth.split(' ');
@@ -336,14 +338,20 @@ export function createHandler({
     try {
       decoded = atob(encoded ?? '');
     } catch {
-      return new Response('Unauthorized', { status: 401 });
+      return false;
     }
     const expected = `${basicUser}:${basicPassword}`;
-    if (scheme !== 'Basic' || decoded !== expected) {
+    return scheme === 'Basic' && decoded === expected;
+  }
+
+  async function handle(req: Request, timer: StageTimer): Promise<Response> {
+    if (req.method !== 'POST')
+      return new Response('Method Not Allowed', { status: 405 });
+    if (!(await timer.time('auth', () => isAuthorized(req)))) {
       return new Response('Unauthorized', { status: 401 });
     }
 
-    const rawBody = await req.text();
+    const rawBody = await timer.time('parse', () => req.text());
 
     function extractAlias(data: any): string | null {
       const inboundDomainLower = inboundDomain.toLowerCase();
@@ -377,30 +385,82 @@ export function createHandler({
     }
 
     try {
-      const payload = JSON.parse(rawBody) as InboundPayload;
+      const payload = (await timer.time('parse', () =>
+        JSON.parse(rawBody)
+      )) as InboundPayload;
 
       const alias = extractAlias(payload);
       console.info(`[inbound-email] Alias: ${alias}`);
       if (!alias) return new Response('Unknown alias', { status: 404 });
-      const { data: aliasRow, error: aliasError } = await supabase
-        .from('email_aliases')
-        .select('user_id')
-        .eq('alias', alias)
-        .eq('active', true)
-        .maybeSingle();
-
-      if (aliasError || !aliasRow) {
-        console.warn(
-          `[inbound-email] Alias lookup failed for ${alias}: ${aliasError?.message}`
+
+      const verificationLink = extractForwardVerificationLink(payload);
+      const sentAt = payload.Date ? new Date(payload.Date).toISOString() : null;
+      const messageId = payload.MessageID ?? null;
+
+      // Emails that go on to task extraction resolve the alias in the same
+      // round trip that loads their duplicate flag, budget and open tasks.
+      // Verification emails, async ingest and aliases cached as unknown only
+      // need the (cached) alias lookup.
+      let user_id: string | null;
+      let duplicate = false;
+      let remainingBudget = 0;
+      let existingTasks: OpenTask[] = [];
+      const cachedUserId = aliasCache.lookup(alias);
+      if (!verificationLink && !asyncIngest && cachedUserId !== null) {
+        const { preamble, error: preambleError } = await timer.time(
+          'preamble',
+          () =>
+            getIngestPreamble(supabase, alias, {
+              messageId,
+              fromEmail: payload.From ?? null,
+              toEmail: payload.To ?? null,
+              subject: payload.Subject ?? null,
+              sentAt,
+            })
         );
+        if (preambleError) return new Response(preambleError, { status: 500 });
+        if (!preamble.userId) {
+          // Drop a user id cached before the alias was deactivated, and any
+          // lookup still in flight, before remembering it as unknown
+          aliasCache.invalidate(alias);
+        }
+        aliasCache.set(alias, preamble.userId);
+        user_id = preamble.userId;
+        duplicate = preamble.duplicate;
+        remainingBudget = preamble.budget;
+        existingTasks = preamble.tasks;
+      } else if (cachedUserId !== undefined) {
+        user_id = cachedUserId;
+      } else {
+        try {
+          user_id = await timer.time('alias_lookup', () =>
+            aliasCache.load(alias, async () => {
+              const { data: aliasRow, error: aliasError } = await supabase
+                .from('email_aliases')
+                .select('user_id')
+                .eq('alias', alias)
+                .eq('active', true)
+                .maybeSingle();
+              if (aliasError) throw new Error(aliasError.message);
+              return aliasRow?.user_id ?? null;
+            })
+          );
+        } catch (e) {
+          console.warn(
+            `[inbound-email] Alias lookup failed for ${alias}: ${(e as Error).message}`
+          );
+          return new Response('Unknown alias', { status: 404 });
+        }
+      }
+      if (!user_id) {
+        console.warn(`[inbound-email] Alias lookup failed for ${alias}`);
         return new Response('Unknown alias', { status: 404 });
       }
-
-      const user_id = aliasRow.user_id;
       // Fire-and-forget: observe source info for analytics/attribution
-      observeSourceInfo(supabase, user_id, payload);
+      timer.inBackground('source_observation', () =>
+        observeSourceInfo(supabase, user_id, payload)
+      );
 
-      const verificationLink = extractForwardVerificationLink(payload);
       if (verificationLink) {
         await supabase.from('forwarding_verifications').insert({
           user_id,
@@ -417,112 +477,115 @@ export function createHandler({
         });
       }
 
-      const sentAt = payload.Date ? new Date(payload.Date).toISOString() : null;
-      const messageId = payload.MessageID ?? null;
-
-      if (messageId) {
-        const { data: existingEmail, error: dupError } = await supabase
-          .from('raw_emails')
-          .select('id')
-          .eq('message_id', messageId);
-        if (dupError) return new Response(dupError.message, { status: 500 });
-        if (Array.isArray(existingEmail) && existingEmail.length > 0) {
-          // Duplicate detected by Message-ID. Return 200 OK (not 409) so the inbound
-          // email service (e.g. Postmark) does NOT retry delivering this message.
-          // We have already processed (or intentionally stored) the original email.
-          return new Response('Duplicate Message-ID (already processed)', {
-            status: 200,
-          });
-        }
-      } else {
-        // No Message-ID, fall back to deduplication by From/To/Subject/SentAt.
-        // This is less reliable, but better than nothing.
-        // Also return 200 OK on duplicate so the inbound
-        // email service (e.g. Postmark) will NOT retry later.
+      if (!messageId) {
+        // Without a Message-ID, duplicates are detected by
+        // From/To/Subject/SentAt. This is less reliable, but better than nothing.
         console.warn(
           `[inbound-email] No Message-ID header present in email from ${payload.From} to ${payload.To} with subject "${payload.Subject}"`
         );
-        const query = supabase.from('raw_emails').select('id');
-        const fromEmail = payload.From ?? null;
-        const toEmail = payload.To ?? null;
-        const subject = payload.Subject ?? null;
-        if (fromEmail !== null) query.eq('from_email', fromEmail);
-        else query.is('from_email', null);
-        if (toEmail !== null) query.eq('to_email', toEmail);
-        else query.is('to_email', null);
-        if (subject !== null) query.eq('subject', subject);
-        else query.is('subject', null);
-        if (sentAt !== null) query.eq('sent_at', sentAt);
-        else query.is('sent_at', null);
-        const { data: existingEmail, error: dupError } = await query;
-        if (dupError) return new Response(dupError.message, { status: 500 });
-        if (Array.isArray(existingEmail) && existingEmail.length > 0) {
-          return new Response('Duplicate Message-ID (already processed)', {
-            status: 200,
-          });
-        }
       }
 
-      const emailText = chooseEmailText(payload);
+      const rawEmail = {
+        user_id,
+        from_email: payload.From ?? null,
+        to_email: payload.To ?? null,
+        subject: payload.Subject ?? null,
+        text_body: payload.TextBody ?? null,
+        html_body: payload.HtmlBody ?? null,
+        provider_meta: payload.ProviderMeta ?? {},
+        sent_at: sentAt,
+        message_id: messageId,
+      };
+      // The insert is also the duplicate check: raw_emails has a unique
+      // dedup_key (the Message-ID, or a hash of From/To/Subject/SentAt) filled
+      // in by a trigger, and a conflicting insert returns no row.
+      // Duplicate deliveries get 200 OK (not 409) so the inbound email
+      // service (e.g. Postmark) does NOT retry delivering the message; the
+      // original email has already been processed or queued.
+      const duplicateResponse = () =>
+        new Response('Duplicate Message-ID (already processed)', {
+          status: 200,
+        });
+
+      if (asyncIngest) {
+        // Respond as soon as the email is durably stored. A trigger adds
+        // QUEUED emails to ingest_queue in the same statement.
+        const { data: queued, error: queueError } = await timer.time(
+          'dedup',
+          () =>
+            supabase
+              .from('raw_emails')
+              .upsert(
+                { ...rawEmail, status: 'QUEUED' },
+                { onConflict: 'dedup_key', ignoreDuplicates: true }
+              )
+              .select('id')
+              .maybeSingle()
+        );
+        if (queueError)
+          return new Response(queueError.message, { status: 500 });
+        if (!queued) return duplicateResponse();
+        analytics.emit(emailEvent('email_received', user_id, queued.id));
+        console.info(`[inbound-email] user=${user_id} queued=${queued.id}`);
+        return new Response(JSON.stringify({ queued: true }), {
+          headers: { 'content-type': 'application/json' },
+          status: 200,
+        });
+      }
+
+      // Checked again atomically by the insert below
+      if (duplicate) return duplicateResponse();
+
+      const {
+        text: emailText,
+        tokensBefore,
+        tokensAfter,
+      } = await timer.time('compaction', () =>
+        compactEmailText(chooseEmailText(payload))
+      );
       console.info(
-        `[inbound-email] user=${user_id} email_text_length=${emailText.length}`
+        `[inbound-email] user=${user_id} email_text_length=${emailText.length} email_tokens_before=${tokensBefore} email_tokens_after=${tokensAfter}`
       );
 
-      const { tasks: existingForAi, error: existingError } =
-        await getOpenTasksForDeduplication(supabase, user_id);
-      if (existingError) return new Response(existingError, { status: 500 });
-
-      const existingCount = existingForAi.length;
+      const existingCount = existingTasks.length;
+      const existingForAi = selectTasksForPrompt(existingTasks, {
+        emailText,
+        fromEmail: payload.From,
+        tokenBudget: taskContextTokenBudget,
+      });
       console.info(
-        `[inbound-email] user=${user_id} existing_tasks_for_dedupe=${existingCount}`
+        `[inbound-email] user=${user_id} existing_tasks_for_dedupe=${existingForAi.length}/${existingCount}`
       );
 
-      const { budget: remainingBudget, error: budgetError } =
-        await getUserProcessingBudget(supabase, user_id);
-      const actualRemainingBudget = budgetError ? 0 : remainingBudget;
+      // Store raw email first to get its ID for linking with ai_invocations.
+      const { data: rawData, error: rawError } = await timer.time('dedup', () =>
+        supabase
+          .from('raw_emails')
+          .upsert(
+            {
+              ...rawEmail,
+              tasks_before: existingCount,
+              tasks_after: existingCount,
+              status: 'UNPROCESSED',
+            },
+            { onConflict: 'dedup_key', ignoreDuplicates: true }
+          )
+          .select('id')
+          .maybeSingle()
+      );
 
-      if (actualRemainingBudget <= 0) {
-        const { error: rawError } = await supabase.from('raw_emails').insert({
-          user_id,
-          from_email: payload.From ?? null,
-          to_email: payload.To ?? null,
-          subject: payload.Subject ?? null,
-          text_body: payload.TextBody ?? null,
-          html_body: payload.HtmlBody ?? null,
-          provider_meta: payload.ProviderMeta ?? {},
-          sent_at: sentAt,
-          message_id: messageId,
-          tasks_before: existingCount,
-          tasks_after: existingCount,
-          status: 'UNPROCESSED',
-        });
-        if (rawError) return new Response(rawError.message, { status: 500 });
+      if (rawError) return new Response(rawError.message, { status: 500 });
+      if (!rawData) return duplicateResponse();
+      analytics.emit(emailEvent('email_received', user_id, rawData.id));
+
+      // The email stays UNPROCESSED for reprocess-unprocessed, which
+      // records its outcome, so no email_processed event is emitted here
+      if (remainingBudget <= 0) {
         return new Response(JSON.stringify({ task_count: 0 }), {
           headers: { 'content-type': 'application/json' },
           status: 200,
         });
       }
-      // Store raw email first to get its ID for linking with ai_invocations
-      const { data: rawData, error: rawError } = await supabase
-        .from('raw_emails')
-        .insert({
-          user_id,
-          from_email: payload.From ?? null,
-          to_email: payload.To ?? null,
-          subject: payload.Subject ?? null,
-          text_body: payload.TextBody ?? null,
-          html_body: payload.HtmlBody ?? null,
-          provider_meta: payload.ProviderMeta ?? {},
-          sent_at: sentAt,
-          message_id: messageId,
-          tasks_before: existingCount,
-          tasks_after: existingCount,
-          status: 'UNPROCESSED',
-        })
-        .select('id')
-        .single();
-
-      if (rawError) return new Response(rawError.message, { status: 500 });
 
       const {
         tasks,
@@ -530,14 +593,18 @@ export function createHandler({
         completionTokens,
         totalCostNano,
         rawContent,
-      } = await extractNewTasks(
-        supabase,
-        fetch,
-        openAiApiKey,
-        emailText,
-        existingForAi,
-        user_id,
-        rawData.id
+      } = await timer.time('model', () =>
+        extractNewTasks(
+          supabase,
+          fetch,
+          openAiApiKey,
+          emailText,
+          existingForAi,
+          user_id,
+          rawData.id,
+          openAiBaseUrl,
+          promptConfigCache
+        )
       );
       console.info(`[inbound-email] user=${user_id} new_tasks=${tasks.length}`);
 
@@ -551,16 +618,28 @@ export function createHandler({
         _completionTokens: completionTokens,
         rawContent,
         logPrefix: 'inbound-email',
+        timer,
       });
-      if (!applyResult.success)
+      if (!applyResult.success) {
+        emitEmailProcessed(analytics, user_id, rawData.id, {
+          errorCode: 'task_update_failed',
+        });
         return new Response(applyResult.error, { status: 500 });
+      }
+      emitEmailProcessed(analytics, user_id, rawData.id, {
+        taskIds: applyResult.taskIds,
+      });
 
       // Atomically decrement the remaining budget using database function
-      const { error: budgetUpdateError } = await decrementProcessingBudget(
-        supabase,
-        user_id,
-        totalCostNano,
-        'inbound-email'
+      const { error: budgetUpdateError } = await timer.time(
+        'budget_decrement',
+        () =>
+          decrementProcessingBudget(
+            supabase,
+            user_id,
+            totalCostNano,
+            'inbound-email'
+          )
       );
 
       if (budgetUpdateError) {
@@ -580,6 +659,33 @@ export function createHandler({
     } catch (e) {
       return new Response(`Bad Request: ${e}`, { status: 400 });
     }
+  }
+
+  return async function handler(req: Request): Promise<Response> {
+    const timer = new StageTimer();
+    let status = 500;
+    try {
+      const response = await handle(req, timer);
+      status = response.status;
+      timer.stop();
+      return withServerTiming(response, timer);
+    } finally {
+      // Write this request's analytics events and stage timings after
+      // responding; the timings include the source observation.
+      runInBackground(analytics.flush());
+      runInBackground(
+        timer
+          .settled()
+          .then(() =>
+            console.info(
+              timer.logLine('inbound-email', {
+                status,
+                alias_cache: aliasCache.stats(),
+              })
+            )
+          )
+      );
+    }
   };
 }
 
@@ -589,6 +695,8 @@ if (import.meta.main) {
   const SERVICE_ROLE = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
   const supabase = createClient(SUPABASE_URL, SERVICE_ROLE);
   const OPENAI_API_KEY = Deno.env.get('OPENAI_API_KEY')!;
+  const OPENAI_BASE_URL = Deno.env.get('OPENAI_BASE_URL') || undefined;
+  const TASK_CONTEXT_TOKEN_BUDGET = Deno.env.get('TASK_CONTEXT_TOKEN_BUDGET');
   const POSTMARK_BASIC_USER = Deno.env.get('POSTMARK_BASIC_USER')!;
   const POSTMARK_BASIC_PASSWORD = Deno.env.get('POSTMARK_BASIC_PASSWORD')!;
   const INBOUND_EMAIL_DOMAIN = Deno.env.get('INBOUND_EMAIL_DOMAIN')!;
@@ -600,10 +708,15 @@ if (import.meta.main) {
     supabase,
     fetch,
     openAiApiKey: OPENAI_API_KEY,
+    openAiBaseUrl: OPENAI_BASE_URL,
+    taskContextTokenBudget: TASK_CONTEXT_TOKEN_BUDGET
+      ? Number(TASK_CONTEXT_TOKEN_BUDGET)
+      : undefined,
     basicUser: POSTMARK_BASIC_USER,
     basicPassword: POSTMARK_BASIC_PASSWORD,
     allowedIps: POSTMARK_ALLOWED_IPS,
     inboundDomain: INBOUND_EMAIL_DOMAIN,
+    asyncIngest: Deno.env.get('INBOUND_ASYNC_INGEST') === 'true',
   });
   Deno.serve(handler);
 }
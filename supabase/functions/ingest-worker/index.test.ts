@@ -0,0 +1,235 @@
+// Minimal assertion helpers
+function assert(cond: boolean, msg = 'Assertion failed') {
+  if (!cond) throw new Error(msg);
+}
+function assertEquals(actual: unknown, expected: unknown, msg = '') {
+  if (actual !== expected) {
+    throw new Error(msg || `Expected ${expected}, got ${actual}`);
+  }
+}
+
+import { createHandler, retryDelayMs } from './index.ts';
+import { AnalyticsEmitter } from '../_shared/analytics.ts';
+import { test } from 'node:test';
+import { createSupabaseStub, createFetchStub } from '../_shared/test-utils.ts';
+
+function queueEmail(supabase: any, id: number, userId = 'user-1') {
+  supabase.state.raw_emails.push({
+    id,
+    user_id: userId,
+    text_body: `email ${id}`,
+    html_body: null,
+    status: 'QUEUED',
+  });
+  supabase.state.ingest_queue.push({
+    raw_email_id: id,
+    user_id: userId,
+    attempts: 0,
+    next_attempt_at: new Date(0).toISOString(),
+    locked_until: null,
+    last_error: null,
+  });
+}
+
+function makeReq() {
+  return new Request('http://localhost', {
+    method: 'POST',
+    headers: { authorization: 'Bearer svc' },
+  });
+}
+
+test('processes queued emails and removes their jobs', async () => {
+  const supabase = createSupabaseStub([
+    { id: 1, user_id: 'user-1', title: 'Old', state: 'OPEN' },
+  ]);
+  queueEmail(supabase, 1);
+  queueEmail(supabase, 2);
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+
+  const res = await handler(makeReq());
+  assertEquals(res.status, 200);
+  const body = await res.json();
+  assertEquals(body.processed, 2);
+  assertEquals(body.done, true);
+  assertEquals(fetchStub.calls.length, 2);
+  assert(supabase.state.raw_emails.every((r) => r.status === 'UPDATED_TASKS'));
+  assertEquals(supabase.state.ingest_queue.length, 0);
+});
+
+test('requires service role key', async () => {
+  const supabase = createSupabaseStub();
+  const handler = createHandler({
+    supabase,
+    fetch: createFetchStub([]),
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+  const res = await handler(
+    new Request('http://localhost', { method: 'POST' })
+  );
+  assertEquals(res.status, 401);
+});
+
+test('retries failed jobs with backoff, then hands them to reprocess', async () => {
+  const supabase = createSupabaseStub();
+  queueEmail(supabase, 1);
+  const now = 1_000_000;
+  const handler = createHandler({
+    supabase,
+    fetch: createFetchStub([], { fail: true }),
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    maxAttempts: 2,
+    now: () => now,
+  });
+
+  let body = await (await handler(makeReq())).json();
+  assertEquals(body.retried, 1);
+  const job = supabase.state.ingest_queue[0];
+  assertEquals(job.attempts, 1);
+  assertEquals(job.locked_until, null);
+  assertEquals(Date.parse(job.next_attempt_at), now + retryDelayMs(1));
+  assert(job.last_error.includes('failure'));
+  assertEquals(supabase.state.raw_emails[0].status, 'QUEUED');
+
+  job.next_attempt_at = new Date(0).toISOString();
+  body = await (await handler(makeReq())).json();
+  assertEquals(body.failed, 1);
+  assertEquals(supabase.state.ingest_queue.length, 0);
+  assertEquals(supabase.state.raw_emails[0].status, 'UNPROCESSED');
+});
+
+test('leaves emails to reprocess when the budget is exhausted', async () => {
+  const supabase = createSupabaseStub([], { budgetNanoUsd: 0 });
+  queueEmail(supabase, 1);
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const analytics = new AnalyticsEmitter(supabase);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    analytics,
+  });
+
+  const body = await (await handler(makeReq())).json();
+  assertEquals(body.released, 1);
+  assertEquals(body.failed, 0);
+  assertEquals(fetchStub.calls.length, 0);
+  assertEquals(supabase.state.ingest_queue.length, 0);
+  assertEquals(supabase.state.raw_emails[0].status, 'UNPROCESSED');
+  await analytics.flush();
+  assertEquals(supabase.state.analytics_events.length, 0);
+});
+
+test('retries jobs when the budget read fails', async () => {
+  const supabase = createSupabaseStub();
+  queueEmail(supabase, 1);
+  const originalFrom = supabase.from;
+  supabase.from = function (table: string) {
+    if (table !== 'processing_budgets') return originalFrom.call(this, table);
+    const builder: any = {
+      select: () => builder,
+      eq: () => builder,
+      single: () => ({ data: null, error: { message: 'timeout' } }),
+    };
+    return builder;
+  };
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+
+  const body = await (await handler(makeReq())).json();
+  assertEquals(body.retried, 1);
+  assertEquals(body.released, 0);
+  assertEquals(fetchStub.calls.length, 0);
+  const job = supabase.state.ingest_queue[0];
+  assertEquals(job.last_error, 'timeout');
+  assert(Date.parse(job.next_attempt_at) > Date.now());
+  assertEquals(supabase.state.raw_emails[0].status, 'QUEUED');
+});
+
+test('claims jobs in batches until the queue is drained', async () => {
+  const supabase = createSupabaseStub();
+  for (let id = 1; id <= 5; id++) queueEmail(supabase, id, `user-${id % 2}`);
+  const handler = createHandler({
+    supabase,
+    fetch: createFetchStub([]),
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    batchSize: 2,
+    concurrency: 2,
+  });
+
+  const body = await (await handler(makeReq())).json();
+  assertEquals(body.processed, 5);
+  assertEquals(body.done, true);
+  assertEquals(supabase.state.ingest_queue.length, 0);
+});
+
+test('hands back jobs not started by the deadline', async () => {
+  const supabase = createSupabaseStub();
+  queueEmail(supabase, 1);
+  queueEmail(supabase, 2);
+  let now = 0;
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = createHandler({
+    supabase,
+    // The model call of the first email runs past the time budget
+    fetch: (url: any, init: any) => {
+      now += 200_000;
+      return fetchStub(url, init);
+    },
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    now: () => now,
+  });
+
+  const body = await (await handler(makeReq())).json();
+  assertEquals(body.processed, 1);
+  assertEquals(body.deferred, 1);
+  assertEquals(body.done, false);
+  assertEquals(fetchStub.calls.length, 1);
+  const job = supabase.state.ingest_queue[0];
+  assertEquals(job.raw_email_id, 2);
+  assertEquals(job.attempts, 0);
+  assertEquals(job.locked_until, null);
+  assertEquals(supabase.state.raw_emails[1].status, 'QUEUED');
+});
+
+test('drops jobs whose email is no longer queued', async () => {
+  const supabase = createSupabaseStub();
+  queueEmail(supabase, 1);
+  queueEmail(supabase, 2);
+  supabase.state.raw_emails[0].status = 'UPDATED_TASKS';
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+
+  const body = await (await handler(makeReq())).json();
+  assertEquals(body.processed, 1);
+  assertEquals(fetchStub.calls.length, 1);
+  assertEquals(supabase.state.ingest_queue.length, 0);
+  assertEquals(supabase.state.tasks.length, 1);
+});
+
+test('retryDelayMs doubles up to the maximum', () => {
+  assertEquals(retryDelayMs(1, 1000, 5000), 1000);
+  assertEquals(retryDelayMs(2, 1000, 5000), 2000);
+  assertEquals(retryDelayMs(3, 1000, 5000), 4000);
+  assertEquals(retryDelayMs(4, 1000, 5000), 5000);
+});
@@ -0,0 +1,417 @@
+import {
+  extractNewTasks,
+  addNewTasksAndUpdateEmail,
+  chooseEmailText,
+  getOpenTasksForDeduplication,
+  selectTasksForPrompt,
+  OpenTask,
+  getUserProcessingBudget,
+  decrementProcessingBudget,
+} from '../_shared/task-utils.ts';
+import { createPromptConfigCache, PromptConfigCache } from '../_shared/ai.ts';
+import { compactEmailText } from '../_shared/compaction.ts';
+import {
+  AnalyticsEmitter,
+  emitEmailProcessed,
+  runInBackground,
+} from '../_shared/analytics.ts';
+import { StageTimer, withServerTiming } from '../_shared/timing.ts';
+
+// A job returned by claim_ingest_jobs, with the columns of its raw email
+export interface IngestJob {
+  raw_email_id: string;
+  user_id: string;
+  attempts: number;
+  sent_at: string | null;
+  from_email: string | null;
+  text_body: string | null;
+  html_body: string | null;
+}
+
+export const DEFAULT_BATCH_SIZE = 20;
+export const DEFAULT_CONCURRENCY = 4;
+// Longer than processing one email takes, so a live job is not claimed twice
+export const DEFAULT_LEASE_SECONDS = 300;
+export const DEFAULT_MAX_ATTEMPTS = 5;
+export const DEFAULT_RETRY_BASE_MS = 30_000;
+export const DEFAULT_RETRY_MAX_MS = 3_600_000;
+// Stop claiming new jobs after this long, well inside the function timeout
+export const DEFAULT_TIME_BUDGET_MS = 100_000;
+
+export interface Deps {
+  // deno-lint-ignore no-explicit-any
+  supabase: any;
+  fetch: typeof fetch;
+  openAiApiKey: string;
+  openAiBaseUrl?: string;
+  taskContextTokenBudget?: number;
+  serviceRoleKey: string;
+  promptConfigCache?: PromptConfigCache;
+  analytics?: AnalyticsEmitter;
+  batchSize?: number;
+  // Number of users processed in parallel
+  concurrency?: number;
+  leaseSeconds?: number;
+  // Claims of a job before its email is handed to reprocess-unprocessed
+  maxAttempts?: number;
+  retryBaseMs?: number;
+  retryMaxMs?: number;
+  timeBudgetMs?: number;
+  now?: () => number;
+}
+
+// released: left to reprocess-unprocessed for lack of budget
+// deferred: handed back to the queue at the deadline
+type Outcome = 'processed' | 'retry' | 'failed' | 'released' | 'deferred';
+
+/** Delay before retrying a job that failed on its given attempt. */
+export function retryDelayMs(
+  attempts: number,
+  baseMs = DEFAULT_RETRY_BASE_MS,
+  maxMs = DEFAULT_RETRY_MAX_MS
+): number {
+  return Math.min(maxMs, baseMs * 2 ** Math.max(0, attempts - 1));
+}
+
+export function createHandler({
+  supabase,
+  fetch,
+  openAiApiKey,
+  openAiBaseUrl,
+  taskContextTokenBudget,
+  serviceRoleKey,
+  promptConfigCache = createPromptConfigCache(),
+  analytics = new AnalyticsEmitter(supabase),
+  batchSize = DEFAULT_BATCH_SIZE,
+  concurrency = DEFAULT_CONCURRENCY,
+  leaseSeconds = DEFAULT_LEASE_SECONDS,
+  maxAttempts = DEFAULT_MAX_ATTEMPTS,
+  retryBaseMs = DEFAULT_RETRY_BASE_MS,
+  retryMaxMs = DEFAULT_RETRY_MAX_MS,
+  timeBudgetMs = DEFAULT_TIME_BUDGET_MS,
+  now = Date.now,
+}: Deps) {
+  // Leave the queue with the email back in the UNPROCESSED backlog, where
+  // reprocess-unprocessed picks it up (e.g. once the budget is topped up).
+  // A failure is recorded with errorCode; an email deferred for budget is
+  // not failed, and reprocess-unprocessed records its outcome later.
+  async function release(job: IngestJob, errorCode?: string): Promise<void> {
+    await supabase
+      .from('raw_emails')
+      .update({ status: 'UNPROCESSED' })
+      .eq('id', job.raw_email_id);
+    await supabase
+      .from('ingest_queue')
+      .delete()
+      .eq('raw_email_id', job.raw_email_id);
+    if (errorCode) {
+      emitEmailProcessed(analytics, job.user_id, job.raw_email_id, {
+        errorCode,
+      });
+    }
+  }
+
+  async function fail(
+    job: IngestJob,
+    errorCode: string,
+    error: string
+  ): Promise<Outcome> {
+    console.error(
+      `[ingest-worker] email_id=${job.raw_email_id} attempt=${job.attempts} error=${error}`
+    );
+    if (job.attempts >= maxAttempts) {
+      await release(job, errorCode);
+      return 'failed';
+    }
+    const delay = retryDelayMs(job.attempts, retryBaseMs, retryMaxMs);
+    await supabase
+      .from('ingest_queue')
+      .update({
+        locked_until: null,
+        next_attempt_at: new Date(now() + delay).toISOString(),
+        last_error: error,
+      })
+      .eq('raw_email_id', job.raw_email_id);
+    return 'retry';
+  }
+
+  // Give back a claimed job that was not started: it is due again right away
+  // and the claim does not count as an attempt.
+  async function handBack(job: IngestJob): Promise<Outcome> {
+    await supabase
+      .from('ingest_queue')
+      .update({ locked_until: null, attempts: job.attempts - 1 })
+      .eq('raw_email_id', job.raw_email_id);
+    return 'deferred';
+  }
+
+  // Process one user's claimed jobs in order, loading their budget and open
+  // tasks once and keeping both up to date locally. Jobs not started by the
+  // deadline are handed back to the queue.
+  async function processUserJobs(
+    userId: string,
+    jobs: IngestJob[],
+    timer: StageTimer,
+    deadline: number
+  ): Promise<Outcome[]> {
+    const outcomes: Outcome[] = [];
+    const { budget: initialBudget, error: budgetError } = await timer.time(
+      'budget_read',
+      () => getUserProcessingBudget(supabase, userId)
+    );
+    let remainingBudget = initialBudget;
+    let existingTasks: OpenTask[] | null = null;
+
+    for (const job of jobs) {
+      if (now() >= deadline) {
+        outcomes.push(await handBack(job));
+        continue;
+      }
+      // Unlike an exhausted budget, a failed read is retried with backoff
+      if (budgetError) {
+        outcomes.push(await fail(job, 'processing_error', budgetError));
+        continue;
+      }
+      if (remainingBudget <= 0) {
+        await release(job);
+        outcomes.push('released');
+        continue;
+      }
+      try {
+        if (existingTasks === null) {
+          const { tasks, error: existingError } = await timer.time(
+            'open_tasks',
+            () => getOpenTasksForDeduplication(supabase, userId)
+          );
+          if (existingError) {
+            outcomes.push(await fail(job, 'processing_error', existingError));
+            continue;
+          }
+          existingTasks = tasks;
+        }
+        const {
+          text: emailText,
+          tokensBefore,
+          tokensAfter,
+        } = await timer.time('compaction', () =>
+          compactEmailText(
+            chooseEmailText({
+              text_body: job.text_body ?? undefined,
+              html_body: job.html_body ?? undefined,
+            })
+          )
+        );
+        console.info(
+          `[ingest-worker] email_id=${job.raw_email_id} email_tokens_before=${tokensBefore} email_tokens_after=${tokensAfter}`
+        );
+        const existingForAi = selectTasksForPrompt(existingTasks, {
+          emailText,
+          fromEmail: job.from_email,
+          tokenBudget: taskContextTokenBudget,
+        });
+
+        const {
+          tasks,
+          promptTokens,
+          completionTokens,
+          totalCostNano,
+          rawContent,
+        } = await timer.time('model', () =>
+          extractNewTasks(
+            supabase,
+            fetch,
+            openAiApiKey,
+            emailText,
+            existingForAi,
+            userId,
+            job.raw_email_id,
+            openAiBaseUrl,
+            promptConfigCache
+          )
+        );
+
+        const result = await addNewTasksAndUpdateEmail({
+          supabase,
+          userId,
+          rawEmailId: job.raw_email_id,
+          newTasks: tasks,
+          existingTasksCount: existingTasks.length,
+          _promptTokens: promptTokens,
+          _completionTokens: completionTokens,
+          rawContent,
+          logPrefix: 'ingest-worker',
+          timer,
+        });
+        if (!result.success) {
+          outcomes.push(
+            await fail(job, 'task_update_failed', result.error ?? 'unknown')
+          );
+          continue;
+        }
+
+        // The email is no longer QUEUED, so claim_ingest_jobs drops the job
+        // rather than processing it again if this delete fails
+        const { error: dequeueError } = await timer.time('queue_update', () =>
+          supabase
+            .from('ingest_queue')
+            .delete()
+            .eq('raw_email_id', job.raw_email_id)
+        );
+        if (dequeueError) {
+          console.error(
+            `[ingest-worker] Queue delete error for email_id=${job.raw_email_id}: ${dequeueError.message}`
+          );
+        }
+        emitEmailProcessed(analytics, userId, job.raw_email_id, {
+          taskIds: result.taskIds,
+        });
+        outcomes.push('processed');
+        for (const task of tasks) {
+          existingTasks.push({
+            ...task,
+            title: task.title as string,
+            from_email: job.from_email ?? null,
+          });
+        }
+        remainingBudget -= totalCostNano;
+
+        // Atomically decrement the remaining budget using database function
+        const { error: budgetUpdateError } = await timer.time(
+          'budget_decrement',
+          () =>
+            decrementProcessingBudget(
+              supabase,
+              userId,
+              totalCostNano,
+              'ingest-worker'
+            )
+        );
+        if (budgetUpdateError) {
+          console.error(
+            `[ingest-worker] Budget update error for user ${userId}: ${budgetUpdateError}`
+          );
+        }
+      } catch (e) {
+        outcomes.push(await fail(job, 'processing_error', String(e)));
+      }
+    }
+    return outcomes;
+  }
+
+  async function handle(req: Request, timer: StageTimer): Promise<Response> {
+    if (req.method !== 'POST')
+      return new Response('Method Not Allowed', { status: 405 });
+
+    const auth = req.headers.get('authorization');
+    const authorized = await timer.time(
+      'auth',
+      () => auth === `Bearer ${serviceRoleKey}`
+    );
+    if (!authorized) return new Response('Unauthorized', { status: 401 });
+
+    const deadline = now() + timeBudgetMs;
+    const counts: Record<Outcome, number> = {
+      processed: 0,
+      retry: 0,
+      failed: 0,
+      released: 0,
+      deferred: 0,
+    };
+    let done = false;
+    while (now() < deadline) {
+      const { data, error } = await timer.time('claim', () =>
+        supabase.rpc('claim_ingest_jobs', {
+          p_limit: batchSize,
+          p_lease_seconds: leaseSeconds,
+        })
+      );
+      if (error) return new Response(error.message, { status: 500 });
+      const jobs: IngestJob[] = Array.isArray(data) ? data : [];
+
+      // Group by user, keeping each user's emails in chronological order
+      const byUser = new Map<string, IngestJob[]>();
+      for (const job of jobs) {
+        const userJobs = byUser.get(job.user_id) ?? [];
+        userJobs.push(job);
+        byUser.set(job.user_id, userJobs);
+      }
+
+      const groups = [...byUser.entries()];
+      const workers = Array.from(
+        { length: Math.min(concurrency, groups.length) },
+        async () => {
+          for (let group = groups.shift(); group; group = groups.shift()) {
+            const outcomes = await processUserJobs(
+              group[0],
+              group[1],
+              timer,
+              deadline
+            );
+            for (const outcome of outcomes) {
+              counts[outcome]++;
+            }
+          }
+        }
+      );
+      await Promise.all(workers);
+
+      if (jobs.length < batchSize) {
+        done = counts.deferred === 0;
+        break;
+      }
+    }
+
+    console.info(
+      `[ingest-worker] processed=${counts.processed} retried=${counts.retry} failed=${counts.failed} released=${counts.released} deferred=${counts.deferred} done=${done}`
+    );
+    return new Response(
+      JSON.stringify({
+        processed: counts.processed,
+        retried: counts.retry,
+        failed: counts.failed,
+        released: counts.released,
+        deferred: counts.deferred,
+        done,
+      }),
+      {
+        headers: { 'content-type': 'application/json' },
+        status: 200,
+      }
+    );
+  }
+
+  return async function handler(req: Request): Promise<Response> {
+    const timer = new StageTimer();
+    let status = 500;
+    try {
+      const response = await handle(req, timer);
+      status = response.status;
+      timer.stop();
+      return withServerTiming(response, timer);
+    } finally {
+      runInBackground(analytics.flush());
+      console.info(timer.logLine('ingest-worker', { status }));
+    }
+  };
+}
+
+if (import.meta.main) {
+  const { createClient } = await import('jsr:@supabase/supabase-js@2');
+  const SUPABASE_URL = Deno.env.get('SUPABASE_URL')!;
+  const SERVICE_ROLE = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
+  const supabase = createClient(SUPABASE_URL, SERVICE_ROLE);
+  const OPENAI_API_KEY = Deno.env.get('OPENAI_API_KEY')!;
+  const OPENAI_BASE_URL = Deno.env.get('OPENAI_BASE_URL') || undefined;
+  const TASK_CONTEXT_TOKEN_BUDGET = Deno.env.get('TASK_CONTEXT_TOKEN_BUDGET');
+  const handler = createHandler({
+    supabase,
+    fetch,
+    openAiApiKey: OPENAI_API_KEY,
+    openAiBaseUrl: OPENAI_BASE_URL,
+    taskContextTokenBudget: TASK_CONTEXT_TOKEN_BUDGET
+      ? Number(TASK_CONTEXT_TOKEN_BUDGET)
+      : undefined,
+    serviceRoleKey: SERVICE_ROLE,
+  });
+  Deno.serve(handler);
+}
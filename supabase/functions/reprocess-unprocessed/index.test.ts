@@ -9,6 +9,7 @@ function assertEquals(actual: unknown, expected: unknown, msg = '') {
 }
 
 import { createHandler } from './index.ts';
+import { AnalyticsEmitter } from '../_shared/analytics.ts';
 import { test } from 'node:test';
 import { createSupabaseStub, createFetchStub } from '../_shared/test-utils.ts';
 
@@ -173,3 +174,180 @@ test('processes emails in chronological order by sent_at', async () => {
     'Third email should be processed third'
   );
 });
+
+function rawId(n: number) {
+  return `00000000-0000-4000-8000-${String(n).padStart(12, '0')}`;
+}
+
+function makeRaw(id: number, userId: string, sentAt: string | null) {
+  return {
+    id: rawId(id),
+    user_id: userId,
+    text_body: `email ${id}`,
+    html_body: null,
+    from_email: 'office@school.org',
+    status: 'UNPROCESSED',
+    sent_at: sentAt,
+  };
+}
+
+function reprocessReq(body?: unknown) {
+  return new Request('http://localhost', {
+    method: 'POST',
+    headers: { authorization: 'Bearer svc' },
+    body: body === undefined ? undefined : JSON.stringify(body),
+  });
+}
+
+test('pages through the backlog with null sent_at last', async () => {
+  const supabase = createSupabaseStub([]);
+  supabase.state.raw_emails = [
+    makeRaw(5, 'user-1', null),
+    makeRaw(4, 'user-2', '2025-09-09T13:00:00Z'),
+    makeRaw(3, 'user-1', '2025-09-09T12:00:00Z'),
+    makeRaw(2, 'user-2', '2025-09-09T12:00:00Z'),
+    makeRaw(1, 'user-1', '2025-09-09T10:00:00Z'),
+  ];
+  const fetchStub = createFetchStub([]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    pageSize: 2,
+    concurrency: 1,
+  });
+
+  const res = await handler(reprocessReq());
+  const body = await res.json();
+  assertEquals(body.processed, 5);
+  assertEquals(body.done, true);
+  assertEquals(body.cursor, null);
+  const order = fetchStub.calls.map((c: any) => {
+    const prompt = JSON.parse(c.init.body).messages[1].content;
+    return prompt.match(/email (\d)/)[1];
+  });
+  assertEquals(order.join(','), '1,2,3,4,5');
+});
+
+test('loads budget and open tasks once per user and adds new tasks', async () => {
+  const supabase = createSupabaseStub([]);
+  supabase.state.raw_emails = [
+    makeRaw(1, 'user-1', '2025-09-09T10:00:00Z'),
+    makeRaw(2, 'user-1', '2025-09-09T11:00:00Z'),
+  ];
+  const queried: string[] = [];
+  const originalFrom = supabase.from;
+  supabase.from = function (table: string) {
+    queried.push(table);
+    return originalFrom.call(this, table);
+  };
+  const fetchStub = createFetchStub([{ title: 'Field trip' }]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+
+  const body = await (await handler(reprocessReq())).json();
+  assertEquals(body.processed, 2);
+  assertEquals(queried.filter((t) => t === 'processing_budgets').length, 1);
+  assertEquals(queried.filter((t) => t === 'tasks').length, 3); // 1 select + 2 inserts
+  const secondPrompt = JSON.parse(fetchStub.calls[1].init.body).messages[1]
+    .content;
+  assert(secondPrompt.includes('Field trip')); // First email's task is context
+  assertEquals(supabase.state.raw_emails[1].tasks_after, 2);
+});
+
+test('stops at the time budget and resumes from the cursor', async () => {
+  const supabase = createSupabaseStub([]);
+  supabase.state.raw_emails = [1, 2, 3, 4, 5].map((i) =>
+    makeRaw(i, 'user-1', `2025-09-09T1${i}:00:00Z`)
+  );
+  let clock = 0;
+  const fetchStub = createFetchStub([]);
+  const slowFetch = ((url: string, init: any) => {
+    clock += 10;
+    return fetchStub(url, init);
+  }) as typeof fetch;
+  const options = {
+    supabase,
+    fetch: slowFetch,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    timeBudgetMs: 25,
+    now: () => clock,
+  };
+
+  const first = await (await createHandler(options)(reprocessReq())).json();
+  assertEquals(first.processed, 3);
+  assertEquals(first.done, false);
+  assertEquals(first.cursor.id, rawId(3));
+
+  const second = await (
+    await createHandler(options)(reprocessReq({ cursor: first.cursor }))
+  ).json();
+  assertEquals(second.processed, 2);
+  assertEquals(second.done, true);
+  assertEquals(fetchStub.calls.length, 5);
+});
+
+test('leaves failed emails UNPROCESSED without recording a failure', async () => {
+  const supabase = createSupabaseStub([], { failTaskInsert: true });
+  supabase.state.raw_emails = [1, 2, 3].map((i) =>
+    makeRaw(i, 'user-1', `2025-09-09T1${i}:00:00Z`)
+  );
+  const fetchStub = createFetchStub([{ title: 'New' }]);
+  const analytics = new AnalyticsEmitter(supabase);
+  const handler = createHandler({
+    supabase,
+    // The first email's tasks fail to insert, the third email's model call
+    // throws
+    fetch: ((url: string, init: any) => {
+      if (fetchStub.calls.length === 2) throw new Error('network down');
+      return fetchStub(url, init);
+    }) as typeof fetch,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+    analytics,
+  });
+
+  const body = await (await handler(reprocessReq())).json();
+  assertEquals(body.processed, 1);
+  const statuses = supabase.state.raw_emails.map((r: any) => r.status);
+  assertEquals(statuses.join(','), 'UNPROCESSED,UPDATED_TASKS,UNPROCESSED');
+  await analytics.flush();
+  const types = supabase.state.analytics_events.map((e) => e.event_type);
+  assertEquals(types.join(','), 'email_processed_success,task_created');
+});
+
+test('rejects malformed cursors', async () => {
+  const supabase = createSupabaseStub([]);
+  supabase.state.raw_emails = [makeRaw(1, 'user-1', '2025-09-09T10:00:00Z')];
+  const fetchStub = createFetchStub([]);
+  const handler = createHandler({
+    supabase,
+    fetch: fetchStub,
+    openAiApiKey: 'test',
+    serviceRoleKey: 'svc',
+  });
+
+  for (const cursor of [
+    { id: rawId(1) },
+    { sent_at: '2025-09-09T10:00:00Z', id: 1 },
+    { sent_at: '2025-09-09T10:00:00Z', id: '1),id.gt.(0' },
+    { sent_at: 'yesterday', id: rawId(1) },
+    { sent_at: '2025-09-09T10:00:00Z",id.gt.0,x.eq."', id: rawId(1) },
+    'cursor',
+  ]) {
+    const res = await handler(reprocessReq({ cursor }));
+    assertEquals(res.status, 400, JSON.stringify(cursor));
+  }
+  assertEquals(fetchStub.calls.length, 0);
+
+  const res = await handler(
+    reprocessReq({ cursor: { sent_at: null, id: rawId(0) } })
+  );
+  assertEquals(res.status, 200);
+});
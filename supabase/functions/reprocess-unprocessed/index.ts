@@ -3,53 +3,172 @@ import {
   addNewTasksAndUpdateEmail,
   chooseEmailText,
   getOpenTasksForDeduplication,
+  selectTasksForPrompt,
+  OpenTask,
   getUserProcessingBudget,
   decrementProcessingBudget,
 } from '../_shared/task-utils.ts';
+import { createPromptConfigCache, PromptConfigCache } from '../_shared/ai.ts';
+import { compactEmailText } from '../_shared/compaction.ts';
+import {
+  AnalyticsEmitter,
+  emitEmailProcessed,
+  runInBackground,
+} from '../_shared/analytics.ts';
+import { StageTimer, withServerTiming } from '../_shared/timing.ts';
+
+// Position in the (sent_at, id) order of the backlog; sent_at null sorts last
+export interface ReprocessCursor {
+  sent_at: string | null;
+  id: string;
+}
+
+// The cursor is interpolated into a PostgREST filter, so only accept the
+// shapes the database returns
+const UUID_RE =
+  /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/i;
+const TIMESTAMP_RE =
+  /^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}(:?\d{2})?)?$/i;
+
+// deno-lint-ignore no-explicit-any
+type RawEmail = Record<string, any>;
+
+export const DEFAULT_PAGE_SIZE = 50;
+export const DEFAULT_CONCURRENCY = 4;
+// Stop starting new emails after this long, well inside the function timeout
+export const DEFAULT_TIME_BUDGET_MS = 100_000;
+
+const RAW_EMAIL_COLUMNS =
+  'id, user_id, sent_at, from_email, text_body, html_body';
 
 export interface Deps {
   // deno-lint-ignore no-explicit-any
   supabase: any;
   fetch: typeof fetch;
   openAiApiKey: string;
+  openAiBaseUrl?: string;
+  taskContextTokenBudget?: number;
   serviceRoleKey: string;
+  promptConfigCache?: PromptConfigCache;
+  analytics?: AnalyticsEmitter;
+  pageSize?: number;
+  // Number of users processed in parallel
+  concurrency?: number;
+  timeBudgetMs?: number;
+  now?: () => number;
+}
+
+function cursorOf(raw: RawEmail): ReprocessCursor {
+  return { sent_at: raw.sent_at ?? null, id: raw.id };
+}
+
+/** The cursor of a request body, or undefined when it is malformed. */
+export function parseCursor(
+  value: unknown
+): ReprocessCursor | null | undefined {
+  if (value === undefined || value === null) return null;
+  if (typeof value !== 'object') return undefined;
+  const { sent_at, id } = value as Record<string, unknown>;
+  if (typeof id !== 'string' || !UUID_RE.test(id)) return undefined;
+  if (sent_at === null) return { sent_at, id };
+  if (
+    typeof sent_at !== 'string' ||
+    !TIMESTAMP_RE.test(sent_at) ||
+    isNaN(Date.parse(sent_at))
+  )
+    return undefined;
+  return { sent_at, id };
+}
+
+/**
+ * Fetch the next page of UNPROCESSED emails after cursor, ordered by
+ * (sent_at, id) with null sent_at last.
+ */
+async function fetchPage(
+  // deno-lint-ignore no-explicit-any
+  supabase: any,
+  cursor: ReprocessCursor | null,
+  pageSize: number
+): Promise<{ rows: RawEmail[]; error?: string }> {
+  const query = supabase
+    .from('raw_emails')
+    .select(RAW_EMAIL_COLUMNS)
+    .eq('status', 'UNPROCESSED');
+  if (cursor && cursor.sent_at !== null) {
+    const sentAt = `"${cursor.sent_at}"`;
+    query.or(
+      `sent_at.gt.${sentAt},and(sent_at.eq.${sentAt},id.gt.${cursor.id}),sent_at.is.null`
+    );
+  } else if (cursor) {
+    query.is('sent_at', null).gt('id', cursor.id);
+  }
+  const { data, error } = await query
+    .order('sent_at', { ascending: true, nullsFirst: false })
+    .order('id', { ascending: true })
+    .limit(pageSize);
+  if (error) return { rows: [], error: error.message };
+  return { rows: Array.isArray(data) ? data : [] };
 }
 
 export function createHandler({
   supabase,
   fetch,
   openAiApiKey,
+  openAiBaseUrl,
+  taskContextTokenBudget,
   serviceRoleKey,
+  promptConfigCache = createPromptConfigCache(),
+  analytics = new AnalyticsEmitter(supabase),
+  pageSize = DEFAULT_PAGE_SIZE,
+  concurrency = DEFAULT_CONCURRENCY,
+  timeBudgetMs = DEFAULT_TIME_BUDGET_MS,
+  now = Date.now,
 }: Deps) {
-  return async function handler(req: Request): Promise<Response> {
-    if (req.method !== 'POST')
-      return new Response('Method Not Allowed', { status: 405 });
-
-    const auth = req.headers.get('authorization');
-    if (auth !== `Bearer ${serviceRoleKey}`)
-      return new Response('Unauthorized', { status: 401 });
-
-    const { data: raws, error } = await supabase
-      .from('raw_emails')
-      .select('*')
-      .eq('status', 'UNPROCESSED')
-      .order('sent_at', { ascending: true });
-    if (error) return new Response(error.message, { status: 500 });
-
+  // Process one user's emails in order, loading their budget and open tasks
+  // once and keeping both up to date locally as emails are processed.
+  async function processUserEmails(
+    userId: string,
+    emails: RawEmail[],
+    attempted: Set<RawEmail>,
+    deadline: number,
+    timer: StageTimer
+  ): Promise<number> {
+    const { budget: initialBudget, error: budgetError } = await timer.time(
+      'budget_read',
+      () => getUserProcessingBudget(supabase, userId)
+    );
+    let remainingBudget = budgetError ? 0 : initialBudget;
+    let existingTasks: OpenTask[] | null = null;
     let processed = 0;
-    // deno-lint-ignore no-explicit-any
-    for (const raw of raws as any[]) {
-      try {
-        const user_id = raw.user_id;
-        const emailText = chooseEmailText(raw);
-
-        const { budget: remainingBudget, error: budgetError } =
-          await getUserProcessingBudget(supabase, user_id);
-        if (budgetError || remainingBudget <= 0) continue;
 
-        const { tasks: existingForAi, error: existingError } =
-          await getOpenTasksForDeduplication(supabase, user_id);
-        if (existingError) continue;
+    for (const raw of emails) {
+      if (now() >= deadline) break;
+      attempted.add(raw);
+      if (remainingBudget <= 0) continue;
+      try {
+        if (existingTasks === null) {
+          const { tasks, error: existingError } = await timer.time(
+            'open_tasks',
+            () => getOpenTasksForDeduplication(supabase, userId)
+          );
+          if (existingError) continue;
+          existingTasks = tasks;
+        }
+        const {
+          text: emailText,
+          tokensBefore,
+          tokensAfter,
+        } = await timer.time('compaction', () =>
+          compactEmailText(chooseEmailText(raw))
+        );
+        console.info(
+          `[reprocess-unprocessed] email_id=${raw.id} email_tokens_before=${tokensBefore} email_tokens_after=${tokensAfter}`
+        );
+        const existingForAi = selectTasksForPrompt(existingTasks, {
+          emailText,
+          fromEmail: raw.from_email,
+          tokenBudget: taskContextTokenBudget,
+        });
 
         const {
           tasks,
@@ -57,41 +176,63 @@ export function createHandler({
           completionTokens,
           totalCostNano,
           rawContent,
-        } = await extractNewTasks(
-          supabase,
-          fetch,
-          openAiApiKey,
-          emailText,
-          existingForAi,
-          user_id,
-          raw.id
+        } = await timer.time('model', () =>
+          extractNewTasks(
+            supabase,
+            fetch,
+            openAiApiKey,
+            emailText,
+            existingForAi,
+            userId,
+            raw.id,
+            openAiBaseUrl,
+            promptConfigCache
+          )
         );
 
         const result = await addNewTasksAndUpdateEmail({
           supabase,
-          userId: user_id,
+          userId,
           rawEmailId: raw.id,
           newTasks: tasks,
-          existingTasksCount: existingForAi.length,
+          existingTasksCount: existingTasks.length,
           _promptTokens: promptTokens,
           _completionTokens: completionTokens,
           rawContent,
           logPrefix: 'reprocess-unprocessed',
+          timer,
         });
+        // A failed email stays UNPROCESSED and is retried on the next run, so
+        // only success is final and recorded
         if (result.success) {
+          emitEmailProcessed(analytics, userId, raw.id, {
+            taskIds: result.taskIds,
+          });
           processed++;
+          for (const task of tasks) {
+            existingTasks.push({
+              ...task,
+              title: task.title as string,
+              from_email: raw.from_email ?? null,
+            });
+          }
+          remainingBudget -= totalCostNano;
 
           // Atomically decrement the remaining budget using database function
-          const { error: budgetUpdateError } = await decrementProcessingBudget(
-            supabase,
-            user_id,
-            totalCostNano,
-            'reprocess-unprocessed'
+          const { error: budgetUpdateError } = await timer.time(
+            'budget_decrement',
+            () =>
+              decrementProcessingBudget(
+                supabase,
+                userId,
+                totalCostNano,
+                'reprocess-unprocessed'
+              )
           );
 
           if (budgetUpdateError) {
             console.error(
-              `[reprocess-unprocessed] Budget update error for user ${user_id}: ${budgetUpdateError}`
+              `[reprocess-unprocessed] Budget update error for user ${userId}: ${budgetUpdateError}`
             );
           }
         }
@@ -99,11 +240,107 @@ export function createHandler({
         console.error(`[reprocess-unprocessed] email_id=${raw.id} error=${e}`);
       }
     }
+    return processed;
+  }
+
+  async function handle(req: Request, timer: StageTimer): Promise<Response> {
+    if (req.method !== 'POST')
+      return new Response('Method Not Allowed', { status: 405 });
+
+    const auth = req.headers.get('authorization');
+    const authorized = await timer.time(
+      'auth',
+      () => auth === `Bearer ${serviceRoleKey}`
+    );
+    if (!authorized) return new Response('Unauthorized', { status: 401 });
+
+    const deadline = now() + timeBudgetMs;
+    let requested: ReprocessCursor | null | undefined;
+    try {
+      requested = await timer.time('parse', async () => {
+        const text = await req.text();
+        return parseCursor(text ? JSON.parse(text)?.cursor : null);
+      });
+    } catch {
+      return new Response('Invalid JSON body', { status: 400 });
+    }
+    if (requested === undefined)
+      return new Response('Invalid cursor', { status: 400 });
+    let cursor = requested;
+
+    let processed = 0;
+    let done = false;
+    while (now() < deadline) {
+      const { rows, error } = await timer.time('fetch_page', () =>
+        fetchPage(supabase, cursor, pageSize)
+      );
+      if (error) return new Response(error, { status: 500 });
 
-    return new Response(JSON.stringify({ processed }), {
-      headers: { 'content-type': 'application/json' },
-      status: 200,
-    });
+      // Group by user, keeping each user's emails in chronological order
+      const byUser = new Map<string, RawEmail[]>();
+      for (const raw of rows) {
+        const emails = byUser.get(raw.user_id) ?? [];
+        emails.push(raw);
+        byUser.set(raw.user_id, emails);
+      }
+
+      const attempted = new Set<RawEmail>();
+      const groups = [...byUser.entries()];
+      const workers = Array.from(
+        { length: Math.min(concurrency, groups.length) },
+        async () => {
+          for (let group = groups.shift(); group; group = groups.shift()) {
+            processed += await processUserEmails(
+              group[0],
+              group[1],
+              attempted,
+              deadline,
+              timer
+            );
+          }
+        }
+      );
+      await Promise.all(workers);
+
+      // Resume after the longest run of attempted emails. Processed emails
+      // past that point are no longer UNPROCESSED, so they are not revisited.
+      const firstPending = rows.findIndex((raw) => !attempted.has(raw));
+      if (firstPending === -1) {
+        if (rows.length > 0) cursor = cursorOf(rows[rows.length - 1]);
+        if (rows.length < pageSize) {
+          done = true;
+          break;
+        }
+      } else {
+        if (firstPending > 0) cursor = cursorOf(rows[firstPending - 1]);
+        break;
+      }
+    }
+
+    console.info(
+      `[reprocess-unprocessed] processed=${processed} done=${done} cursor=${JSON.stringify(cursor)}`
+    );
+    return new Response(
+      JSON.stringify({ processed, done, cursor: done ? null : cursor }),
+      {
+        headers: { 'content-type': 'application/json' },
+        status: 200,
+      }
+    );
+  }
+
+  return async function handler(req: Request): Promise<Response> {
+    const timer = new StageTimer();
+    let status = 500;
+    try {
+      const response = await handle(req, timer);
+      status = response.status;
+      timer.stop();
+      return withServerTiming(response, timer);
+    } finally {
+      runInBackground(analytics.flush());
+      console.info(timer.logLine('reprocess-unprocessed', { status }));
+    }
   };
 }
 
@@ -113,10 +350,16 @@ if (import.meta.main) {
   const SERVICE_ROLE = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
   const supabase = createClient(SUPABASE_URL, SERVICE_ROLE);
   const OPENAI_API_KEY = Deno.env.get('OPENAI_API_KEY')!;
+  const OPENAI_BASE_URL = Deno.env.get('OPENAI_BASE_URL') || undefined;
+  const TASK_CONTEXT_TOKEN_BUDGET = Deno.env.get('TASK_CONTEXT_TOKEN_BUDGET');
   const handler = createHandler({
     supabase,
     fetch,
     openAiApiKey: OPENAI_API_KEY,
+    openAiBaseUrl: OPENAI_BASE_URL,
+    taskContextTokenBudget: TASK_CONTEXT_TOKEN_BUDGET
+      ? Number(TASK_CONTEXT_TOKEN_BUDGET)
+      : undefined,
     serviceRoleKey: SERVICE_ROLE,
   });
   Deno.serve(handler);
@@ -0,0 +1,78 @@
+-- Unique deduplication key for inbound emails.
+-- The key is the Message-ID when present, otherwise a SHA-256 of the
+-- From/To/Subject/Date fields. inbound-email inserts with
+-- `on conflict (dedup_key) do nothing`, so concurrent deliveries of the same
+-- email cannot both be stored and no separate lookup is needed.
+
+alter table public.raw_emails
+  add column if not exists dedup_key text;
+
+create or replace function public.raw_email_dedup_key(
+  p_message_id text,
+  p_from_email text,
+  p_to_email text,
+  p_subject text,
+  p_sent_at timestamptz
+) returns text
+language sql
+stable
+as $$
+  select coalesce(
+    p_message_id,
+    encode(
+      sha256(convert_to(
+        coalesce(p_from_email, '') || chr(31) ||
+        coalesce(p_to_email, '') || chr(31) ||
+        coalesce(p_subject, '') || chr(31) ||
+        coalesce(to_char(p_sent_at at time zone 'UTC',
+                         'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'), ''),
+        'UTF8'
+      )),
+      'hex'
+    )
+  );
+$$;
+
+-- Fill the key on insert; the trigger runs before the conflict check
+create or replace function public.set_raw_email_dedup_key()
+returns trigger
+language plpgsql
+as $$
+begin
+  if new.dedup_key is null then
+    new.dedup_key := public.raw_email_dedup_key(
+      new.message_id, new.from_email, new.to_email, new.subject, new.sent_at
+    );
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists trg_set_raw_email_dedup_key on public.raw_emails;
+create trigger trg_set_raw_email_dedup_key
+before insert on public.raw_emails
+for each row execute function public.set_raw_email_dedup_key();
+
+-- Backfill existing rows. Duplicates that slipped past the old
+-- check-then-insert path keep a null key, so only the earliest copy is
+-- reserved.
+update public.raw_emails r
+set dedup_key = k.dedup_key
+from (
+  select id,
+         dedup_key,
+         row_number() over (partition by dedup_key order by processed_at, id) as n
+  from (
+    select id,
+           processed_at,
+           public.raw_email_dedup_key(message_id, from_email, to_email, subject, sent_at)
+             as dedup_key
+    from public.raw_emails
+  ) keys
+) k
+where r.id = k.id
+  and k.n = 1
+  and r.dedup_key is null;
+
+create unique index if not exists idx_raw_emails_dedup_key
+  on public.raw_emails (dedup_key);
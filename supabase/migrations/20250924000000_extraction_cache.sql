@@ -0,0 +1,37 @@
+-- Content-addressed cache of task extractions, shared across users.
+-- The same newsletter is often forwarded by many parents; the extraction for
+-- a given email text, prompt config and dedup context is reused instead of
+-- calling the model again.
+create table if not exists public.extraction_cache (
+  cache_key text primary key,                   -- sha256 of config id, text hash and context fingerprint
+  config_id bigint references public.ai_prompt_configs(id) on delete cascade,
+  text_hash text not null,                      -- sha256 of the normalized email text
+  context_fingerprint text not null,            -- sha256 of the dedup context sent with the text
+  content text not null,                        -- raw model response content
+  request_tokens int not null,
+  response_tokens int not null,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists idx_extraction_cache_text
+  on public.extraction_cache (text_hash, config_id);
+create index if not exists idx_extraction_cache_created_at
+  on public.extraction_cache (created_at);
+
+alter table public.extraction_cache enable row level security;
+create policy "Service role only" on public.extraction_cache for all
+  using (auth.role() = 'service_role');
+
+comment on table public.extraction_cache is 'Model extraction results keyed by normalized email text, prompt config and dedup context.';
+
+-- Record how each extraction used the cache:
+--   miss  - model called on the email text; the result was cached
+--   hit   - cached extraction reused without a model call
+--   delta - tasks from a cached context-free extraction deduplicated by the
+--           model against the user's tasks, without resending the email
+-- null for invocations that did not go through the cache.
+alter table public.ai_invocations
+  add column if not exists cache_status text
+    check (cache_status in ('miss', 'hit', 'delta')),
+  add column if not exists saved_request_tokens int not null default 0,
+  add column if not exists saved_response_tokens int not null default 0;
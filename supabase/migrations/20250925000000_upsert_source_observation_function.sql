@@ -0,0 +1,49 @@
+-- Record one inbound email from a source in a single statement.
+-- Inserts the (user_id, registrable_domain) row or increments its msg_count,
+-- refreshing msg_last_seen and any attribute the email provides. Concurrent
+-- emails from the same source no longer lose increments.
+create or replace function upsert_source_observation(
+  p_user_id uuid,
+  p_registrable_domain text,
+  p_list_id text,
+  p_dkim_d text,
+  p_sender_domain text,
+  p_return_path_domain text,
+  p_unsubscribe_domain text,
+  p_platform_hint text
+) returns bigint
+language sql
+security definer
+set search_path = public
+as $$
+  insert into public.source_observations as so (
+    user_id,
+    registrable_domain,
+    list_id,
+    dkim_d,
+    sender_domain,
+    unsubscribe_domain,
+    platform_hint
+  )
+  values (
+    p_user_id,
+    p_registrable_domain,
+    p_list_id,
+    p_dkim_d,
+    coalesce(p_sender_domain, p_return_path_domain),
+    p_unsubscribe_domain,
+    p_platform_hint
+  )
+  on conflict (user_id, registrable_domain) do update
+  set msg_last_seen = now(),
+      msg_count = so.msg_count + 1,
+      list_id = coalesce(excluded.list_id, so.list_id),
+      dkim_d = coalesce(excluded.dkim_d, so.dkim_d),
+      -- Only a From domain replaces a stored sender domain
+      sender_domain = coalesce(p_sender_domain, so.sender_domain),
+      unsubscribe_domain = coalesce(excluded.unsubscribe_domain, so.unsubscribe_domain),
+      platform_hint = coalesce(excluded.platform_hint, so.platform_hint)
+  returning so.msg_count;
+$$;
+
+grant execute on function upsert_source_observation(uuid, text, text, text, text, text, text, text) to service_role;
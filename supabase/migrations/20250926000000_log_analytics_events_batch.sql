@@ -0,0 +1,54 @@
+-- Server-side batch insert for analytics events emitted by edge functions.
+-- Takes a jsonb array of events and writes them in one multi-row insert.
+-- Rows that hit a unique index (a retried batch with the same
+-- idempotency_key, or a repeated per-email event) are skipped.
+create or replace function public.log_analytics_events_batch(p_events jsonb)
+returns integer
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_inserted integer;
+begin
+  insert into analytics.events (
+    user_id, platform, source,
+    occurred_at, occurred_date, event_type, metadata,
+    idempotency_key,
+    ingest_type, ingest_id,
+    task_id,
+    success, error_code
+  )
+  select
+    e.user_id, e.platform, e.source,
+    coalesce(e.occurred_at, now()),
+    -- Set up front so rows are routed to the right partition
+    (coalesce(e.occurred_at, now()) at time zone 'UTC')::date,
+    e.event_type, coalesce(e.metadata, '{}'::jsonb),
+    e.idempotency_key,
+    e.ingest_type, e.ingest_id,
+    e.task_id,
+    e.success, e.error_code
+  from jsonb_to_recordset(coalesce(p_events, '[]'::jsonb)) as e(
+    user_id uuid,
+    platform text,
+    source text,
+    occurred_at timestamptz,
+    event_type text,
+    metadata jsonb,
+    idempotency_key uuid,
+    ingest_type text,
+    ingest_id uuid,
+    task_id uuid,
+    success boolean,
+    error_code text
+  )
+  on conflict do nothing;
+
+  get diagnostics v_inserted = row_count;
+  return v_inserted;
+end;
+$$;
+
+revoke all on function public.log_analytics_events_batch(jsonb) from public;
+grant execute on function public.log_analytics_events_batch(jsonb) to service_role;
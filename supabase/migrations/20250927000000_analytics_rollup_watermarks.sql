@@ -0,0 +1,13 @@
+-- Progress of the incremental daily rollup (tools/rollup_analytics.py).
+-- One row per analytics.events partition: events with id <= last_event_id
+-- have been folded into analytics.user_daily_metrics.
+create table if not exists analytics.rollup_watermarks (
+  partition_name text primary key,
+  last_event_id bigint not null default 0,
+  updated_at timestamptz not null default now()
+);
+
+alter table analytics.rollup_watermarks enable row level security;
+
+-- Finds the days with events past a watermark by id range
+create index if not exists events_id_idx on analytics.events using btree (id);
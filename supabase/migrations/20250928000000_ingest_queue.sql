@@ -0,0 +1,98 @@
+-- Queue of inbound emails waiting for task extraction.
+-- In async ingest mode inbound-email only stores the raw email with status
+-- QUEUED and responds; a trigger enqueues it in the same statement, and the
+-- ingest-worker function drains the queue with retries and backoff.
+
+alter table public.raw_emails
+  drop constraint if exists raw_emails_status_check;
+alter table public.raw_emails
+  add constraint raw_emails_status_check
+    check (status in ('UNPROCESSED','QUEUED','UPDATED_TASKS'));
+
+create table if not exists public.ingest_queue (
+  raw_email_id uuid primary key references public.raw_emails(id) on delete cascade,
+  user_id uuid not null references auth.users(id) on delete cascade,
+  attempts int not null default 0,              -- incremented when a worker claims the job
+  next_attempt_at timestamptz not null default now(),
+  locked_until timestamptz,                     -- lease held by the worker processing the job
+  last_error text,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists idx_ingest_queue_next_attempt_at
+  on public.ingest_queue (next_attempt_at);
+
+alter table public.ingest_queue enable row level security;
+create policy "Service role only" on public.ingest_queue for all
+  using (auth.role() = 'service_role');
+
+comment on table public.ingest_queue is 'Raw emails waiting for task extraction by the ingest-worker function.';
+
+create or replace function public.enqueue_raw_email()
+returns trigger
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+begin
+  insert into public.ingest_queue (raw_email_id, user_id)
+  values (new.id, new.user_id)
+  on conflict (raw_email_id) do nothing;
+  return new;
+end;
+$$;
+
+drop trigger if exists raw_emails_enqueue on public.raw_emails;
+create trigger raw_emails_enqueue
+  after insert on public.raw_emails
+  for each row
+  when (new.status = 'QUEUED')
+  execute function public.enqueue_raw_email();
+
+-- Claim up to p_limit due jobs for one worker. Jobs locked by another worker
+-- are skipped rather than waited on, and a claimed job is leased for
+-- p_lease_seconds so a crashed worker's jobs become due again.
+create or replace function public.claim_ingest_jobs(
+  p_limit int,
+  p_lease_seconds int
+) returns table (
+  raw_email_id uuid,
+  user_id uuid,
+  attempts int,
+  sent_at timestamptz,
+  from_email text,
+  text_body text,
+  html_body text
+)
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+begin
+  return query
+  with due as (
+    select q.raw_email_id
+    from public.ingest_queue q
+    where q.next_attempt_at <= now()
+      and (q.locked_until is null or q.locked_until < now())
+    order by q.next_attempt_at
+    limit p_limit
+    for update skip locked
+  ), claimed as (
+    update public.ingest_queue q
+    set attempts = q.attempts + 1,
+        locked_until = now() + make_interval(secs => p_lease_seconds)
+    from due
+    where q.raw_email_id = due.raw_email_id
+    returning q.raw_email_id, q.user_id, q.attempts
+  )
+  select c.raw_email_id, c.user_id, c.attempts,
+         r.sent_at, r.from_email, r.text_body, r.html_body
+  from claimed c
+  join public.raw_emails r on r.id = c.raw_email_id
+  order by r.sent_at nulls last, r.id;
+end;
+$$;
+
+revoke all on function public.claim_ingest_jobs(int, int) from public;
+grant execute on function public.claim_ingest_jobs(int, int) to service_role;
@@ -0,0 +1,74 @@
+-- Everything inbound-email needs before the model call, in one round trip.
+-- Resolves the alias and, for a known user, whether an email with the same
+-- dedup key is already stored, the remaining processing budget and the open
+-- tasks sent to the model for deduplication. The dedup key is computed from
+-- the same fields as the raw_emails trigger.
+create or replace function public.ingest_preamble(
+  p_alias text,
+  p_message_id text,
+  p_from_email text,
+  p_to_email text,
+  p_subject text,
+  p_sent_at timestamptz
+) returns jsonb
+language plpgsql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_user_id uuid;
+  v_budget bigint;
+  v_tasks jsonb;
+begin
+  select a.user_id into v_user_id
+  from public.email_aliases a
+  where a.alias = p_alias and a.active;
+
+  if v_user_id is null then
+    return jsonb_build_object('user_id', null);
+  end if;
+
+  if exists (
+    select 1 from public.raw_emails r
+    where r.dedup_key = public.raw_email_dedup_key(
+      p_message_id, p_from_email, p_to_email, p_subject, p_sent_at
+    )
+  ) then
+    return jsonb_build_object('user_id', v_user_id, 'duplicate', true);
+  end if;
+
+  select b.remaining_nano_usd into v_budget
+  from public.processing_budgets b
+  where b.user_id = v_user_id;
+
+  -- Open tasks, including tasks without a state row (OPEN by default)
+  select coalesce(jsonb_agg(jsonb_build_object(
+    'title', t.title,
+    'description', t.description,
+    'due_date', t.due_date,
+    'parent_action', t.parent_action,
+    'parent_requirement_level', t.parent_requirement_level,
+    'student_action', t.student_action,
+    'student_requirement_level', t.student_requirement_level,
+    'from_email', re.from_email
+  ) order by t.created_at), '[]'::jsonb)
+  into v_tasks
+  from public.tasks t
+  left join public.user_task_states uts
+    on uts.task_id = t.id and uts.user_id = t.user_id
+  left join public.raw_emails re on re.id = t.email_id
+  where t.user_id = v_user_id
+    and coalesce(uts.state, 'OPEN') = 'OPEN';
+
+  return jsonb_build_object(
+    'user_id', v_user_id,
+    'duplicate', false,
+    'remaining_nano_usd', v_budget,
+    'open_tasks', v_tasks
+  );
+end;
+$$;
+
+revoke all on function public.ingest_preamble(text, text, text, text, text, timestamptz) from public;
+grant execute on function public.ingest_preamble(text, text, text, text, text, timestamptz) to service_role;
@@ -0,0 +1,57 @@
+-- Only claim jobs whose email is still QUEUED.
+-- The ingest-worker deletes a job after storing its tasks, in a separate
+-- request. If that delete fails, or a job is left behind after its email
+-- was handed to reprocess-unprocessed, claiming it again would extract and
+-- bill the email a second time. Such stale jobs are now dropped instead.
+create or replace function public.claim_ingest_jobs(
+  p_limit int,
+  p_lease_seconds int
+) returns table (
+  raw_email_id uuid,
+  user_id uuid,
+  attempts int,
+  sent_at timestamptz,
+  from_email text,
+  text_body text,
+  html_body text
+)
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+begin
+  delete from public.ingest_queue q
+  using public.raw_emails r
+  where r.id = q.raw_email_id
+    and r.status <> 'QUEUED';
+
+  return query
+  with due as (
+    select q.raw_email_id
+    from public.ingest_queue q
+    join public.raw_emails r on r.id = q.raw_email_id
+    where r.status = 'QUEUED'
+      and q.next_attempt_at <= now()
+      and (q.locked_until is null or q.locked_until < now())
+    order by q.next_attempt_at
+    limit p_limit
+    for update of q skip locked
+  ), claimed as (
+    update public.ingest_queue q
+    set attempts = q.attempts + 1,
+        locked_until = now() + make_interval(secs => p_lease_seconds)
+    from due
+    where q.raw_email_id = due.raw_email_id
+    returning q.raw_email_id, q.user_id, q.attempts
+  )
+  select c.raw_email_id, c.user_id, c.attempts,
+         r.sent_at, r.from_email, r.text_body, r.html_body
+  from claimed c
+  join public.raw_emails r on r.id = c.raw_email_id
+  where r.status = 'QUEUED'
+  order by r.sent_at nulls last, r.id;
+end;
+$$;
+
+revoke all on function public.claim_ingest_jobs(int, int) from public;
+grant execute on function public.claim_ingest_jobs(int, int) to service_role;
@@ -0,0 +1,47 @@
+-- Expire extraction cache entries so the table does not grow without bound.
+-- Lookups ignore entries past expires_at (EXTRACTION_CACHE_TTL_DAYS in
+-- _shared/extraction-cache.ts, refreshed when an entry is stored again) and
+-- purge_extraction_cache deletes them, daily through pg_cron when available.
+alter table public.extraction_cache
+  add column if not exists expires_at timestamptz not null
+    default now() + interval '30 days';
+
+create index if not exists idx_extraction_cache_expires_at
+  on public.extraction_cache (expires_at);
+
+-- Delete up to p_limit expired entries and return how many were deleted
+create or replace function public.purge_extraction_cache(p_limit int default 10000)
+returns int
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_deleted int;
+begin
+  delete from public.extraction_cache c
+  where c.cache_key in (
+    select e.cache_key
+    from public.extraction_cache e
+    where e.expires_at <= now()
+    limit p_limit
+  );
+  get diagnostics v_deleted = row_count;
+  return v_deleted;
+end;
+$$;
+
+revoke all on function public.purge_extraction_cache(int) from public;
+grant execute on function public.purge_extraction_cache(int) to service_role;
+
+do $$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule(
+      'purge-extraction-cache',
+      '17 3 * * *',
+      'select public.purge_extraction_cache()'
+    );
+  end if;
+end;
+$$;
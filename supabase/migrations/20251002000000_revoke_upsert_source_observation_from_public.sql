@@ -0,0 +1,7 @@
+-- Functions are executable by public by default, and Supabase also grants
+-- execute on new public functions to anon and authenticated, so the grant to
+-- service_role alone left upsert_source_observation callable through the
+-- API by any client. Restrict it to service_role.
+revoke all on function public.upsert_source_observation(uuid, text, text, text, text, text, text, text) from public;
+revoke all on function public.upsert_source_observation(uuid, text, text, text, text, text, text, text) from anon, authenticated;
+grant execute on function public.upsert_source_observation(uuid, text, text, text, text, text, text, text) to service_role;
@@ -0,0 +1,282 @@
+"""
+Database fixtures for the integration tests.
+
+A full ``supabase db reset`` replays every migration and takes most of the
+suite's wall time, so it runs at most once. The migrated and seeded data is
+then copied into the ``test_snapshot`` schema, and each test restores from
+that copy with one TRUNCATE + INSERT transaction, which takes well under a
+second. The snapshot is reused across pytest sessions until a migration or
+the test seed changes.
+
+The edge functions and PostgREST are bound to the stack's ``postgres``
+database, so a cloned database would be invisible to them and tests that go
+through them share that database. ``clean_db`` gives such a test exclusive use
+of it through an advisory lock, so modules can still run under pytest-xdist.
+Tests that only talk SQL can use ``db_transaction`` instead; everything they
+do is rolled back, so they run in parallel with each other.
+"""
+
+import hashlib
+import shutil
+import subprocess
+from pathlib import Path
+
+import psycopg2
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent
+MIGRATIONS_DIR = PROJECT_ROOT / "supabase" / "migrations"
+TEST_SEED_PATH = Path(__file__).parent / "seed_prep_for_inbound_email_tests.sql"
+
+DB_PARAMS = {
+    "user": "postgres",
+    "password": "postgres",
+    "host": "127.0.0.1",
+    "port": "54322",
+    "dbname": "postgres",
+}
+
+SNAPSHOT_SCHEMA = "test_snapshot"
+# Schemas whose data is captured and restored
+SNAPSHOT_SOURCE_SCHEMAS = ["public", "auth", "analytics"]
+# Advisory lock key serializing tests that share the stack database
+SHARED_DB_LOCK_KEY = 0x656D61696C
+
+
+def connect():
+    return psycopg2.connect(**DB_PARAMS)
+
+
+def snapshot_fingerprint() -> str:
+    """Hash of the migrations and test seed the snapshot was built from."""
+    digest = hashlib.sha256()
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")) + [TEST_SEED_PATH]:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def reset_database_with_seed(seed_path: Path = TEST_SEED_PATH):
+    """
+    Run ``supabase db reset`` with ``seed_path`` temporarily installed as
+    supabase/seed.sql, restoring the original seed file afterwards.
+    """
+    supabase_seed_path = PROJECT_ROOT / "supabase" / "seed.sql"
+    backup_seed_path = PROJECT_ROOT / "supabase" / "seed.sql.backup"
+
+    if not seed_path.exists():
+        pytest.fail(f"Test seed file not found: {seed_path}")
+
+    original_seed_existed = supabase_seed_path.exists()
+    reset_error_info = None
+
+    try:
+        if original_seed_existed:
+            shutil.copy2(supabase_seed_path, backup_seed_path)
+        shutil.copy2(seed_path, supabase_seed_path)
+
+        result = subprocess.run(
+            ["supabase", "db", "reset"],
+            capture_output=True,
+            text=True,
+            timeout=120,
+            cwd=PROJECT_ROOT,
+        )
+        if result.returncode != 0:
+            reset_error_info = (
+                f"supabase db reset failed with return code {result.returncode}\n"
+                f"stdout: {result.stdout}\n"
+                f"stderr: {result.stderr}"
+            )
+    except subprocess.TimeoutExpired:
+        reset_error_info = "supabase db reset timed out after 120 seconds"
+    except FileNotFoundError:
+        reset_error_info = "supabase CLI not found. Please install Supabase CLI."
+    finally:
+        try:
+            if original_seed_existed and backup_seed_path.exists():
+                shutil.move(backup_seed_path, supabase_seed_path)
+            elif not original_seed_existed and supabase_seed_path.exists():
+                supabase_seed_path.unlink()
+            if backup_seed_path.exists():
+                backup_seed_path.unlink()
+        except Exception as restore_error:
+            print(f"  Warning: Failed to restore original seed.sql: {restore_error}")
+
+    if reset_error_info:
+        pytest.fail(reset_error_info)
+
+
+def _snapshot_tables(cursor) -> list:
+    """
+    Return ``(schema, table, insertable columns)`` for every table whose data
+    is snapshotted. Partitions are covered by their partitioned parent, and
+    generated columns are left for the database to compute.
+    """
+    cursor.execute(
+        """
+        select n.nspname, c.relname,
+               array_agg(quote_ident(a.attname) order by a.attnum)
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        join pg_attribute a on a.attrelid = c.oid
+        where n.nspname = any(%s)
+          and c.relkind in ('r', 'p')
+          and not c.relispartition
+          and a.attnum > 0
+          and not a.attisdropped
+          and a.attgenerated = ''
+        group by n.nspname, c.relname
+        order by n.nspname, c.relname
+        """,
+        (SNAPSHOT_SOURCE_SCHEMAS,),
+    )
+    return cursor.fetchall()
+
+
+def _snapshot_name(schema: str, table: str) -> str:
+    return f'{SNAPSHOT_SCHEMA}."{schema}__{table}"'
+
+
+def snapshot_is_current(fingerprint: str) -> bool:
+    with connect() as conn, conn.cursor() as cursor:
+        cursor.execute("select to_regclass(%s)", (f"{SNAPSHOT_SCHEMA}.meta",))
+        if cursor.fetchone()[0] is None:
+            return False
+        cursor.execute(f"select fingerprint from {SNAPSHOT_SCHEMA}.meta")
+        row = cursor.fetchone()
+    conn.close()
+    return bool(row) and row[0] == fingerprint
+
+
+def create_snapshot(fingerprint: str):
+    """Copy the current data and sequence positions into the snapshot schema."""
+    with connect() as conn, conn.cursor() as cursor:
+        cursor.execute(f"drop schema if exists {SNAPSHOT_SCHEMA} cascade")
+        cursor.execute(f"create schema {SNAPSHOT_SCHEMA}")
+        for schema, table, columns in _snapshot_tables(cursor):
+            cursor.execute(
+                f"create table {_snapshot_name(schema, table)} as "
+                f'select {", ".join(columns)} from "{schema}"."{table}"'
+            )
+        cursor.execute(
+            f"""
+            create table {SNAPSHOT_SCHEMA}.sequences as
+            select schemaname, sequencename, last_value
+            from pg_sequences
+            where schemaname = any(%s)
+            """,
+            (SNAPSHOT_SOURCE_SCHEMAS,),
+        )
+        cursor.execute(
+            f"create table {SNAPSHOT_SCHEMA}.meta as select %s::text as fingerprint",
+            (fingerprint,),
+        )
+    conn.close()
+
+
+def restore_snapshot():
+    """Replace the data in the snapshotted schemas with the snapshot, atomically."""
+    with connect() as conn, conn.cursor() as cursor:
+        # Skip triggers and foreign key checks while reloading
+        cursor.execute("set local session_replication_role = replica")
+        tables = _snapshot_tables(cursor)
+        cursor.execute(
+            "truncate table "
+            + ", ".join(f'"{schema}"."{table}"' for schema, table, _ in tables)
+            + " cascade"
+        )
+        for schema, table, columns in tables:
+            column_list = ", ".join(columns)
+            cursor.execute(
+                f'insert into "{schema}"."{table}" ({column_list}) '
+                f"overriding system value "
+                f"select {column_list} from {_snapshot_name(schema, table)}"
+            )
+        cursor.execute(f"""
+            select setval(format('%I.%I', schemaname, sequencename),
+                          coalesce(last_value, 1), last_value is not null)
+            from {SNAPSHOT_SCHEMA}.sequences
+            """)
+    conn.close()
+
+
+class _SharedDbLock:
+    """Advisory lock on a dedicated connection, held in shared or exclusive mode."""
+
+    def __init__(self, shared: bool):
+        self._suffix = "_shared" if shared else ""
+        self._conn = connect()
+        self._conn.autocommit = True
+
+    def __enter__(self):
+        with self._conn.cursor() as cursor:
+            cursor.execute(
+                f"select pg_advisory_lock{self._suffix}(%s)", (SHARED_DB_LOCK_KEY,)
+            )
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.execute(
+                    f"select pg_advisory_unlock{self._suffix}(%s)",
+                    (SHARED_DB_LOCK_KEY,),
+                )
+        finally:
+            self._conn.close()
+
+
+@pytest.fixture(scope="session")
+def seeded_database():
+    """
+    Ensure the migrated, seeded snapshot exists and the database matches it.
+
+    ``supabase db reset`` only runs when the migrations or test seed changed
+    since the snapshot was taken.
+    """
+    fingerprint = snapshot_fingerprint()
+    try:
+        with _SharedDbLock(shared=False):
+            if snapshot_is_current(fingerprint):
+                restore_snapshot()
+            else:
+                reset_database_with_seed()
+                create_snapshot(fingerprint)
+    except psycopg2.Error as e:
+        pytest.fail(f"Could not prepare the local database: {e}")
+    return DB_PARAMS
+
+
+@pytest.fixture
+def clean_db(seeded_database):
+    """
+    Give the test exclusive use of the stack database in its seeded state.
+
+    For tests that go through the edge functions. The snapshot is restored
+    again afterwards, so the database is always left in the seeded state.
+    """
+    with _SharedDbLock(shared=False):
+        try:
+            yield seeded_database
+        finally:
+            restore_snapshot()
+
+
+@pytest.fixture
+def db_transaction(seeded_database):
+    """
+    Yield a cursor inside a transaction that is rolled back afterwards.
+
+    For tests that exercise SQL directly (functions, policies, triggers).
+    They see the seeded data and run concurrently with each other, but not
+    with ``clean_db`` tests.
+    """
+    with _SharedDbLock(shared=True):
+        conn = connect()
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+        finally:
+            conn.rollback()
+            conn.close()
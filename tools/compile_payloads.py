@@ -0,0 +1,162 @@
+"""
+Compile an email corpus into ready-to-send Postmark-style payloads.
+
+Replaying a corpus with ``send_to_supabase`` re-parses every message, decodes
+its headers and extracts its bodies on every run. This script does that work
+once and writes one JSON object per line:
+
+    {"source": "<name>", "sha256": "<hash of the raw message>", "version": 1,
+     "payload": {...}}
+
+Payloads are compiled without an alias; ``send_to_supabase --payloads`` fills
+it in when sending. Re-running the compile step only rebuilds entries whose
+source changed, copying the rest from the previous output.
+
+Usage:
+    python -m tools.compile_payloads --dir test_integration/email_data --out payloads.ndjson
+    python -m tools.compile_payloads --mbox export.mbox --out payloads.ndjson
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+from tools.mail_sources import iter_eml_dir, iter_maildir, iter_mbox
+from tools.mime_parse import parse_text_parts
+from tools.send_to_supabase import build_payload
+
+# Bump whenever build_payload changes its output, so every entry is rebuilt
+PAYLOAD_VERSION = 1
+
+
+def _index_existing(path: Path) -> dict:
+    """
+    Map source hash to ``(source name, byte offset, length)`` for each current
+    entry of a previous output file. Only offsets are kept, not payloads.
+    """
+    index = {}
+    if not path.exists():
+        return index
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict) and entry.get("version") == PAYLOAD_VERSION:
+                index[entry["sha256"]] = (entry["source"], offset, len(line))
+            offset += len(line)
+    return index
+
+
+def compile_payloads(
+    messages: Iterable[tuple[str, bytes]], output_path: str | Path
+) -> tuple[int, int, int]:
+    """
+    Write an NDJSON payload file for ``messages``, reusing unchanged entries.
+
+    A message that cannot be parsed is reported on stderr and skipped, so one
+    corrupt message does not abort the compile.
+
+    Args:
+        messages: Iterable of ``(name, raw bytes)`` pairs from a mail source
+        output_path: NDJSON file to create or update
+
+    Returns:
+        Tuple of (number of entries compiled, number reused from the
+        previous output, number of messages skipped)
+    """
+    output_path = Path(output_path)
+    index = _index_existing(output_path)
+    compiled = 0
+    reused = 0
+    skipped = 0
+
+    fd, tmp_name = tempfile.mkstemp(
+        dir=output_path.parent, prefix=f".{output_path.name}.", suffix=".tmp"
+    )
+    try:
+        with (
+            os.fdopen(fd, "wb") as out,
+            open(output_path if index else os.devnull, "rb") as previous,
+        ):
+            for name, raw in messages:
+                digest = hashlib.sha256(raw).hexdigest()
+                cached = index.get(digest)
+                if cached is not None:
+                    source, offset, length = cached
+                    previous.seek(offset)
+                    line = previous.read(length)
+                    if source != name:
+                        # Same content under a new name; keep the payload
+                        entry = json.loads(line)
+                        entry["source"] = name
+                        line = _dump(entry)
+                    out.write(line)
+                    reused += 1
+                    continue
+                try:
+                    payload = build_payload(parse_text_parts(raw), alias="")
+                except Exception as e:
+                    print(f"Skipping {name}: {e}", file=sys.stderr)
+                    skipped += 1
+                    continue
+                out.write(
+                    _dump(
+                        {
+                            "source": name,
+                            "sha256": digest,
+                            "version": PAYLOAD_VERSION,
+                            "payload": payload,
+                        }
+                    )
+                )
+                compiled += 1
+        os.replace(tmp_name, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return compiled, reused, skipped
+
+
+def _dump(entry: dict) -> bytes:
+    return json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def main():
+    """Compile a corpus into an NDJSON payload file."""
+    parser = argparse.ArgumentParser(
+        description="Compile emails into Postmark-style payloads for replay"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory containing .eml files")
+    source.add_argument("--mbox", help="Path to an mbox file")
+    source.add_argument("--maildir", help="Path to a Maildir")
+    parser.add_argument("--out", required=True, help="NDJSON file to write")
+    args = parser.parse_args()
+
+    if args.dir:
+        messages = iter_eml_dir(args.dir)
+    elif args.mbox:
+        messages = iter_mbox(args.mbox)
+    else:
+        messages = iter_maildir(args.maildir)
+
+    compiled, reused, skipped = compile_payloads(messages, args.out)
+    print(f"Wrote {compiled + reused} payloads to {args.out}")
+    print(f"Compiled {compiled}, reused {reused} unchanged, skipped {skipped}")
+    if skipped:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Shared fixtures for the tools tests.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def inbound_server():
+    """
+    Serve a stand-in inbound-email function on a free local port.
+
+    Yields ``(url, received)`` where ``received`` collects a ``(payload,
+    Authorization header)`` pair per request. Payloads whose subject contains
+    "Welcome" get a 500 response so failure handling can be tested.
+    """
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            received.append((body, self.headers.get("Authorization")))
+            status = 500 if "Welcome" in (body["Subject"] or "") else 200
+            data = json.dumps({"ok": status == 200}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/functions/v1/inbound-email", received
+    finally:
+        server.shutdown()
+        server.server_close()
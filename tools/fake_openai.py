@@ -0,0 +1,311 @@
+"""
+Local stand-in for the OpenAI chat-completions API.
+
+Point the edge functions at it with ``OPENAI_BASE_URL`` to run the pipeline
+offline and to benchmark our own overhead without a remote model in the way:
+
+    python -m tools.fake_openai --port 8089 --latency lognormal:800,0.4
+    OPENAI_BASE_URL=http://host.docker.internal:8089/v1 supabase functions serve
+
+Responses have the chat-completions JSON shape. When the request asks for the
+``tasks_list`` JSON schema, the content is a schema-valid task list derived
+from sentences in the email, and ``usage`` reports token counts estimated from
+the request and response sizes. Latency follows a configurable distribution,
+and a fraction of requests can fail with 500 or 429 responses.
+
+Every random choice is seeded from ``--seed``, a hash of the request body and
+how many times that body has been seen, so a run is reproducible regardless of
+request interleaving while retries of the same request can still succeed.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tools.html_text import html_to_text
+
+# Rough size of a token in characters for English text
+CHARS_PER_TOKEN = 4
+
+# Keyword -> (parent_action, student_action) used to label generated tasks
+ACTION_KEYWORDS = [
+    ("attend", ("ATTEND", "ATTEND")),
+    ("pay", ("PAY", "NONE")),
+    ("submit", ("SUBMIT", "SUBMIT")),
+    ("sign", ("SIGN", "NONE")),
+    ("form", ("SUBMIT", "NONE")),
+    ("purchase", ("PURCHASE", "NONE")),
+    ("buy", ("PURCHASE", "NONE")),
+    ("volunteer", ("VOLUNTEER", "NONE")),
+    ("bring", ("NONE", "BRING")),
+    ("wear", ("NONE", "WEAR")),
+    ("register", ("SUBMIT", "NONE")),
+]
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]{20,240}[.!?]")
+_DATE_RE = re.compile(r"\b(20\d\d-\d\d-\d\d)\b")
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]+")
+
+
+@dataclass
+class FakeOpenAIOptions:
+    """Behaviour of the stand-in server."""
+
+    latency: str = "constant:0"
+    ms_per_output_token: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    max_tasks: int = 3
+    seed: int = 0
+
+
+def parse_latency(spec: str):
+    """
+    Parse a latency distribution into a function of a Random returning seconds.
+
+    Supported forms (milliseconds): ``constant:MS``, ``uniform:MIN,MAX`` and
+    ``lognormal:MEDIAN,SIGMA``.
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",")] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec}")
+    if kind == "constant" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Invalid latency spec: {spec}")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(math.ceil(len(text) / CHARS_PER_TOKEN), 1)
+
+
+def generate_tasks(email_text: str, rng: random.Random, max_tasks: int) -> list:
+    """Build a schema-valid ``tasks`` list from action sentences in the email."""
+    tasks = []
+    for sentence in _SENTENCE_RE.findall(email_text):
+        lowered = sentence.lower()
+        actions = next(
+            (actions for keyword, actions in ACTION_KEYWORDS if keyword in lowered),
+            None,
+        )
+        if actions is None:
+            continue
+        words = _WORD_RE.findall(sentence)[:3]
+        task = {
+            "title": " ".join(words).capitalize()[:29] or "Task",
+            "description": " ".join(sentence.split()),
+            "parent_action": actions[0],
+            "parent_requirement_level": (
+                "NONE"
+                if actions[0] == "NONE"
+                else rng.choice(["OPTIONAL", "MANDATORY"])
+            ),
+            "student_action": actions[1],
+            "student_requirement_level": (
+                "NONE"
+                if actions[1] == "NONE"
+                else rng.choice(["OPTIONAL", "MANDATORY"])
+            ),
+        }
+        date = _DATE_RE.search(sentence)
+        if date:
+            task["due_date"] = date.group(1)
+        tasks.append(task)
+        if len(tasks) >= max_tasks:
+            break
+    return tasks
+
+
+def _email_text(messages: list) -> str:
+    """Return the email part of the user message built by extractNewTasks."""
+    user = next(
+        (m.get("content", "") for m in reversed(messages) if m.get("role") == "user"),
+        "",
+    )
+    _, marker, email_text = user.partition("\nEmail:\n")
+    email_text = email_text if marker else user
+    # chooseEmailText sends the HTML body when the text body is too short
+    if "<" in email_text and ">" in email_text:
+        email_text = html_to_text(email_text)
+    return email_text
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that answers chat-completions requests."""
+
+    daemon_threads = True
+
+    def __init__(self, address, options: FakeOpenAIOptions):
+        super().__init__(address, _Handler)
+        self.options = options
+        self.latency = parse_latency(options.latency)
+        self._seen = Counter()
+        self._lock = threading.Lock()
+        self.requests_served = 0
+
+    def rng_for(self, body: bytes) -> random.Random:
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            self._seen[digest] += 1
+            attempt = self._seen[digest]
+            self.requests_served += 1
+        return random.Random(f"{self.options.seed}:{digest}:{attempt}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOpenAIServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, data: dict, headers: dict | None = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str, kind: str, headers=None):
+        error = {"message": message, "type": kind, "param": None, "code": None}
+        self._send_json(status, {"error": error}, headers)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._error(404, f"Unknown path {self.path}", "invalid_request_error")
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._error(401, "Missing bearer token", "invalid_request_error")
+            return
+        try:
+            request = json.loads(body)
+            model = request["model"]
+            messages = request["messages"]
+        except (ValueError, KeyError, TypeError):
+            self._error(400, "Expected model and messages", "invalid_request_error")
+            return
+
+        options = self.server.options
+        rng = self.server.rng_for(body)
+        outcome = rng.random()
+        if outcome < options.rate_limit_rate:
+            self._error(
+                429,
+                "Rate limit reached (injected)",
+                "rate_limit_exceeded",
+                {"Retry-After": "1"},
+            )
+            return
+        if outcome < options.rate_limit_rate + options.error_rate:
+            self._error(500, "Server error (injected)", "server_error")
+            return
+
+        schema = (request.get("response_format") or {}).get("json_schema") or {}
+        if schema.get("name") == "tasks_list":
+            tasks = generate_tasks(_email_text(messages), rng, options.max_tasks)
+            content = json.dumps({"tasks": tasks})
+        else:
+            content = "OK"
+
+        prompt_tokens = sum(
+            estimate_tokens(str(m.get("content", ""))) + 4 for m in messages
+        )
+        completion_tokens = estimate_tokens(content)
+        delay = self.server.latency(rng)
+        delay += options.ms_per_output_token * completion_tokens / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-fake-{rng.getrandbits(48):012x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+def main():
+    """Run the stand-in server until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the OpenAI chat-completions API"
+    )
+    parser.add_argument("--host", default="0.0.0.0", help="Bind address")
+    parser.add_argument("--port", type=int, default=8089, help="Port (default: 8089)")
+    parser.add_argument(
+        "--latency",
+        default="constant:0",
+        help="constant:MS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (default: constant:0)",
+    )
+    parser.add_argument(
+        "--ms-per-output-token",
+        type=float,
+        default=0.0,
+        help="Extra latency per completion token, in milliseconds",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fraction of 500 responses"
+    )
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="Fraction of 429 responses"
+    )
+    parser.add_argument(
+        "--max-tasks", type=int, default=3, help="Maximum tasks per response"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for all randomness")
+    args = parser.parse_args()
+
+    options = FakeOpenAIOptions(
+        latency=args.latency,
+        ms_per_output_token=args.ms_per_output_token,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_tasks=args.max_tasks,
+        seed=args.seed,
+    )
+    try:
+        server = FakeOpenAIServer((args.host, args.port), options)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Serving fake chat completions on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
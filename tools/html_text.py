@@ -0,0 +1,243 @@
+"""
+Fast HTML-to-text extraction for email bodies.
+
+``html_to_text`` turns an HTML body into plain text without building a
+document tree: parser events are fed straight into a line builder that drops
+``script``/``style`` content, starts a new line at block elements and collapses
+runs of whitespace. When selectolax is installed its C parser is used to
+produce the same events; otherwise the standard library ``html.parser`` is
+used.
+
+Run as a script to compare the backends against BeautifulSoup on a directory
+of .eml files:
+
+    python -m tools.html_text --benchmark test_integration/email_data
+"""
+
+import argparse
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from tools.mime_parse import parse_text_file
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # pragma: no cover - optional dependency
+    LexborHTMLParser = None
+
+# Elements whose start and end begin a new line of text
+BLOCK_TAGS = frozenset(
+    {
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "br",
+        "caption",
+        "center",
+        "dd",
+        "div",
+        "dl",
+        "dt",
+        "fieldset",
+        "figcaption",
+        "figure",
+        "footer",
+        "form",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "header",
+        "hr",
+        "li",
+        "main",
+        "nav",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "table",
+        "tbody",
+        "td",
+        "tfoot",
+        "th",
+        "thead",
+        "title",
+        "tr",
+        "ul",
+    }
+)
+
+# Elements whose content is never text
+SKIP_TAGS = frozenset({"script", "style"})
+
+DEFAULT_BACKEND = "selectolax" if LexborHTMLParser is not None else "html.parser"
+
+
+class _TextBuilder:
+    """Assemble text lines from a stream of start, end and data events."""
+
+    def __init__(self):
+        self._lines = []
+        self._current = []
+        self._skip_depth = 0
+
+    def start(self, tag: str) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._break_line()
+
+    def end(self, tag: str) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._break_line()
+
+    def data(self, text: str) -> None:
+        if not self._skip_depth:
+            self._current.append(text)
+
+    def _break_line(self) -> None:
+        if self._current:
+            line = " ".join("".join(self._current).split())
+            if line:
+                self._lines.append(line)
+            self._current = []
+
+    def text(self) -> str:
+        self._break_line()
+        return "\n".join(self._lines)
+
+
+class _StreamingParser(HTMLParser):
+    """``html.parser`` front end that forwards events to a _TextBuilder."""
+
+    def __init__(self, builder: _TextBuilder):
+        super().__init__(convert_charrefs=True)
+        self._builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self._builder.start(tag)
+
+    def handle_endtag(self, tag):
+        self._builder.end(tag)
+
+    def handle_data(self, data):
+        self._builder.data(data)
+
+
+def _extract_html_parser(html: str, builder: _TextBuilder) -> None:
+    parser = _StreamingParser(builder)
+    parser.feed(html)
+    parser.close()
+
+
+def _extract_selectolax(html: str, builder: _TextBuilder) -> None:
+    # Walk the lexbor tree with an explicit stack, emitting the same events as
+    # the streaming parser; comments and other node types are ignored
+    stack = [(LexborHTMLParser(html).root, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            builder.end(node.tag)
+            continue
+        if node.next is not None:
+            stack.append((node.next, False))
+        tag = node.tag
+        if tag == "-text":
+            builder.data(node.text_content or "")
+        elif not tag.startswith("-"):
+            builder.start(tag)
+            stack.append((node, True))
+            if node.child is not None:
+                stack.append((node.child, False))
+
+
+_BACKENDS = {
+    "html.parser": _extract_html_parser,
+    "selectolax": _extract_selectolax,
+}
+
+
+def html_to_text(html: str, backend: str | None = None) -> str:
+    """
+    Extract readable text from an HTML document.
+
+    Args:
+        html: HTML source
+        backend: ``"selectolax"`` or ``"html.parser"``; defaults to selectolax
+            when it is installed
+
+    Returns:
+        Text with one line per block of content and whitespace collapsed
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "selectolax" and LexborHTMLParser is None:
+        raise ValueError("selectolax is not installed")
+    builder = _TextBuilder()
+    _BACKENDS[backend](html, builder)
+    return builder.text()
+
+
+def _html_bodies(directory: Path) -> list:
+    """Return the decoded text/html bodies of the .eml files in ``directory``."""
+    bodies = []
+    for eml_file in sorted(directory.glob("*.eml")):
+        for part in parse_text_file(eml_file).walk():
+            if part.get_content_type() == "text/html":
+                payload = part.get_payload(decode=True) or b""
+                charset = part.get_content_charset() or "utf-8"
+                bodies.append(payload.decode(charset, errors="replace"))
+    return bodies
+
+
+def _time(function, bodies: list, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for body in bodies:
+            function(body)
+    return time.perf_counter() - started
+
+
+def main():
+    """Benchmark the extraction backends against BeautifulSoup."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark HTML-to-text extraction on a directory of .eml files"
+    )
+    parser.add_argument(
+        "--benchmark", required=True, help="Directory containing .eml files"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Passes over the corpus (default: 20)"
+    )
+    args = parser.parse_args()
+
+    bodies = _html_bodies(Path(args.benchmark))
+    size = sum(len(body) for body in bodies)
+    print(f"{len(bodies)} HTML bodies, {size / 1024:.0f} KiB, {args.repeat} passes")
+
+    baseline = _time(
+        lambda body: BeautifulSoup(body, "html.parser").get_text(
+            separator="\n", strip=True
+        ),
+        bodies,
+        args.repeat,
+    )
+    print(f"{'BeautifulSoup html.parser':<28}{baseline:8.3f}s")
+    for backend in _BACKENDS:
+        if backend == "selectolax" and LexborHTMLParser is None:
+            print(f"{backend:<28}{'not installed':>9}")
+            continue
+        elapsed = _time(lambda body: html_to_text(body, backend), bodies, args.repeat)
+        print(f"{backend:<28}{elapsed:8.3f}s  {baseline / elapsed:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
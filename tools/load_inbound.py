@@ -0,0 +1,343 @@
+"""
+Open-loop load generator for the inbound-email function.
+
+Requests are started on a fixed schedule (``--rate`` per second) regardless of
+how quickly earlier ones complete, so a slow function shows up as growing
+response times instead of a silently lower send rate. Response time is
+measured from the scheduled start, which includes any time a request spent
+waiting for a free worker; service time is measured from when it was sent.
+
+Each request reuses a payload from the corpus with a fresh Message-ID, sent to
+an alias picked by weight. A configurable fraction are instead exact
+re-deliveries of an earlier request, as Postmark does on retries.
+
+Usage:
+    python -m tools.load_inbound --payloads payloads.ndjson \\
+        --alias a@in.emailinator.app=3 --alias b@in.emailinator.app \\
+        --rate 20 --duration 60 --duplicate-ratio 0.05 --out load.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import requests
+
+from tools.send_to_supabase import (
+    build_payload,
+    iter_compiled,
+    make_session,
+    read_email_file,
+    with_alias,
+)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Duplicates re-send one of this many most recent unique requests, so a long
+# run does not keep every payload it has sent in memory
+DUPLICATE_WINDOW = 1000
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram in the style of HdrHistogram.
+
+    Values are recorded in microseconds into buckets whose width grows with
+    the value, giving a fixed relative precision at any magnitude.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self._log_base = math.log1p(precision)
+        self._counts = Counter()
+        self.count = 0
+        self.min = None
+        self.max = 0
+        self._total = 0
+
+    def record(self, seconds: float) -> None:
+        micros = max(int(seconds * 1_000_000), 1)
+        self._counts[int(math.log(micros) / self._log_base)] += 1
+        self.count += 1
+        self._total += micros
+        self.min = micros if self.min is None else min(self.min, micros)
+        self.max = max(self.max, micros)
+
+    def _upper_bound(self, index: int) -> int:
+        return math.ceil(math.exp((index + 1) * self._log_base))
+
+    def percentile(self, percent: float) -> int:
+        """Return the value at ``percent`` (0-100) in microseconds."""
+        if not self.count:
+            return 0
+        target = max(math.ceil(percent / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "unit": "us",
+            "count": self.count,
+            "min": self.min or 0,
+            "max": self.max,
+            "mean": round(self._total / self.count) if self.count else 0,
+            "percentiles": {
+                f"p{percent:g}": self.percentile(percent) for percent in PERCENTILES
+            },
+            "buckets": [
+                [self._upper_bound(index), self._counts[index]]
+                for index in sorted(self._counts)
+            ],
+        }
+
+
+class LoadRecorder:
+    """Thread-safe collection of per-request results."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.response_time = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.status_codes = Counter()
+        self.kinds = Counter()
+
+    def record(self, status: str, kind: str, response: float, service: float):
+        with self._lock:
+            self.response_time.record(response)
+            self.service_time.record(service)
+            self.status_codes[status] += 1
+            self.kinds[kind] += 1
+
+
+def _parse_alias(value: str) -> tuple[str, float]:
+    """Parse ``ALIAS[=WEIGHT]``."""
+    alias, _, weight = value.partition("=")
+    try:
+        return alias, float(weight) if weight else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid alias weight: {value}")
+
+
+def _with_message_id(payload: dict, message_id: str) -> dict:
+    """Return a copy of ``payload`` with its Message-ID replaced."""
+    headers = [
+        (
+            {"Name": header["Name"], "Value": message_id}
+            if header["Name"].lower() == "message-id"
+            else header
+        )
+        for header in payload.get("Headers", [])
+    ]
+    return {**payload, "MessageID": message_id, "Headers": headers}
+
+
+def plan_requests(
+    payloads: list,
+    count: int,
+    aliases: list,
+    duplicate_ratio: float,
+    rng: random.Random,
+    run_id: str,
+    duplicate_window: int = DUPLICATE_WINDOW,
+) -> Iterator[tuple[str, dict]]:
+    """
+    Yield ``(kind, payload)`` for ``count`` requests.
+
+    Args:
+        payloads: Alias-free payloads to cycle through
+        count: Number of requests to generate
+        aliases: List of ``(alias, weight)`` pairs
+        duplicate_ratio: Fraction of requests that re-send an earlier request
+            unchanged, including its Message-ID
+        rng: Random generator used for alias and duplicate choices
+        run_id: Unique id for this run, used in generated Message-IDs
+        duplicate_window: Number of recent unique requests duplicates are
+            chosen from
+
+    ``kind`` is ``"unique"`` or ``"duplicate"``.
+    """
+    names = [alias for alias, _ in aliases]
+    weights = [weight for _, weight in aliases]
+    sent = deque(maxlen=duplicate_window)
+    for index in range(count):
+        if sent and rng.random() < duplicate_ratio:
+            yield "duplicate", rng.choice(sent)
+            continue
+        payload = payloads[index % len(payloads)]
+        message_id = f"<load-{run_id}-{index}@emailinator.test>"
+        alias = rng.choices(names, weights)[0]
+        request = with_alias(_with_message_id(payload, message_id), alias)
+        sent.append(request)
+        yield "unique", request
+
+
+def run_load(
+    session: requests.Session,
+    url: str,
+    planned: Iterator[tuple[str, dict]],
+    rate: float,
+    max_in_flight: int = 256,
+    timeout: float = 60,
+) -> dict:
+    """
+    Send ``planned`` requests on an open-loop schedule of ``rate`` per second.
+
+    Returns:
+        Report with the status code breakdown, achieved throughput and
+        response/service time histograms
+    """
+    recorder = LoadRecorder()
+
+    def send(scheduled: float, kind: str, payload: dict) -> None:
+        sent = time.perf_counter()
+        try:
+            status = str(session.post(url, json=payload, timeout=timeout).status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        done = time.perf_counter()
+        recorder.record(status, kind, done - scheduled, done - sent)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for index, (kind, payload) in enumerate(planned):
+            # Start times are fixed up front; a request that cannot get a
+            # worker waits in the queue and that wait counts as latency
+            scheduled = started + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled, kind, payload)
+    elapsed = time.perf_counter() - started
+
+    total = recorder.response_time.count
+    return {
+        "target_rate": rate,
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "achieved_throughput": round(total / elapsed, 2) if elapsed else 0.0,
+        "status_codes": dict(sorted(recorder.status_codes.items())),
+        "kinds": dict(sorted(recorder.kinds.items())),
+        "response_time": recorder.response_time.to_dict(),
+        "service_time": recorder.service_time.to_dict(),
+    }
+
+
+def _load_payloads(args: argparse.Namespace) -> list:
+    if args.payloads:
+        return [payload for _, payload in iter_compiled(args.payloads)]
+    paths = sorted(Path(args.dir).glob("*.eml"), key=lambda p: p.name)
+    return [build_payload(read_email_file(str(path)), alias="") for path in paths]
+
+
+def _print_report(report: dict) -> None:
+    print(
+        f"Sent {report['requests']} requests in {report['elapsed_s']}s "
+        f"({report['achieved_throughput']} req/s, target {report['target_rate']})"
+    )
+    print(f"Status codes: {report['status_codes']}")
+    print(f"Request kinds: {report['kinds']}")
+    for name in ("response_time", "service_time"):
+        histogram = report[name]
+        percentiles = "  ".join(
+            f"{key}={value / 1000:.1f}ms"
+            for key, value in histogram["percentiles"].items()
+        )
+        print(f"{name:<14}{percentiles}  max={histogram['max'] / 1000:.1f}ms")
+
+
+def main():
+    """Run a load test against the inbound-email function."""
+    parser = argparse.ArgumentParser(
+        description="Open-loop load generator for the inbound-email function"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--payloads", help="NDJSON payload file from tools.compile_payloads"
+    )
+    source.add_argument("--dir", help="Directory containing .eml files")
+    parser.add_argument("--url", help="Supabase inbound-email function URL")
+    parser.add_argument(
+        "--alias",
+        action="append",
+        required=True,
+        type=_parse_alias,
+        help="Alias to send to, as ALIAS or ALIAS=WEIGHT; repeat to mix aliases",
+    )
+    parser.add_argument(
+        "--rate", type=float, required=True, help="Requests started per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds to run (default: 30)"
+    )
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that re-deliver an earlier email (default: 0)",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=256,
+        help="Maximum concurrent requests (default: 256)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Request timeout in seconds"
+    )
+    parser.add_argument("--seed", type=int, help="Seed for alias and duplicate mix")
+    parser.add_argument("--out", help="Write the JSON report with histograms here")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    if not 0 <= args.duplicate_ratio < 1:
+        parser.error("--duplicate-ratio must be in [0, 1)")
+
+    user = os.getenv("POSTMARK_BASIC_USER")
+    password = os.getenv("POSTMARK_BASIC_PASSWORD")
+    if not user or not password:
+        raise EnvironmentError(
+            "POSTMARK_BASIC_USER and POSTMARK_BASIC_PASSWORD must be set in the environment"
+        )
+    if not args.url:
+        args.url = "http://localhost:54321/functions/v1/inbound-email"
+
+    payloads = _load_payloads(args)
+    if not payloads:
+        parser.error("No payloads found")
+
+    count = math.ceil(args.rate * args.duration)
+    run_id = f"{int(time.time())}-{os.getpid()}"
+    planned = plan_requests(
+        payloads,
+        count,
+        args.alias,
+        args.duplicate_ratio,
+        random.Random(args.seed),
+        run_id,
+    )
+    with make_session(user, password, args.max_in_flight) as session:
+        report = run_load(
+            session, args.url, planned, args.rate, args.max_in_flight, args.timeout
+        )
+
+    _print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
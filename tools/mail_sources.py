@@ -0,0 +1,83 @@
+"""
+Message sources and sinks shared by the email tools.
+
+Sources are generators that yield ``(name, raw_bytes)`` pairs one message at a
+time, so memory stays bounded by the largest single message rather than by the
+size of the archive:
+
+- ``iter_eml_dir`` - a directory of ``.eml`` files
+- ``iter_mbox`` - a single mbox file
+- ``iter_maildir`` - a Maildir tree (``cur``/``new`` subdirectories)
+
+Sinks (``MboxSink`` and ``DirectorySink``) write messages out as they arrive.
+"""
+
+import mailbox
+from pathlib import Path
+from typing import Iterator
+
+
+def iter_eml_dir(directory: str | Path) -> Iterator[tuple[str, bytes]]:
+    """Yield ``(file name, raw bytes)`` for each .eml file, sorted by name."""
+    for eml_file in sorted(Path(directory).glob("*.eml"), key=lambda p: p.name):
+        yield eml_file.name, eml_file.read_bytes()
+
+
+def iter_mbox(path: str | Path) -> Iterator[tuple[str, bytes]]:
+    """
+    Yield ``(name, raw bytes)`` for each message in an mbox file.
+
+    The mailbox module indexes message offsets with a line-by-line scan and
+    then reads one message at a time, so the archive is never loaded whole.
+    Names have the form ``<mbox file name>#<index>``.
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise FileNotFoundError(f"No such mbox file: {path}")
+    mbox = mailbox.mbox(path, create=False)
+    try:
+        for index, key in enumerate(mbox.iterkeys()):
+            yield f"{path.name}#{index}", mbox.get_bytes(key)
+    finally:
+        mbox.close()
+
+
+def iter_maildir(path: str | Path) -> Iterator[tuple[str, bytes]]:
+    """Yield ``(message key, raw bytes)`` for each message in a Maildir, sorted by key."""
+    path = Path(path)
+    if not path.is_dir():
+        raise FileNotFoundError(f"No such Maildir: {path}")
+    maildir = mailbox.Maildir(path, factory=None, create=False)
+    for key in sorted(maildir.iterkeys()):
+        yield key, maildir.get_bytes(key)
+
+
+class MboxSink:
+    """Append messages to an mbox file as they are produced."""
+
+    def __init__(self, path: str | Path):
+        self._mbox = mailbox.mbox(Path(path), create=True)
+
+    def write(self, name: str, content: bytes) -> None:
+        self._mbox.add(content)
+
+    def close(self) -> None:
+        self._mbox.close()
+
+
+class DirectorySink:
+    """Write each message to ``<directory>/<name>.eml``."""
+
+    def __init__(self, directory: str | Path):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, name: str, content: bytes) -> None:
+        # Message names from archives may contain path separators or '#'
+        safe_name = name.replace("/", "_").replace("#", "_")
+        if not safe_name.endswith(".eml"):
+            safe_name += ".eml"
+        (self._directory / safe_name).write_bytes(content)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,134 @@
+"""
+Bounded-memory MIME parsing shared by the email tools.
+
+The tools only ever look at ``text/plain`` and ``text/html`` parts, but the
+standard parsers buffer every body, so a message with a 20 MB PDF flyer costs
+tens of megabytes before the attachment is thrown away. ``parse_text_parts``
+walks the raw message line by line, feeding a ``BytesFeedParser`` with the
+headers of every part but only with the bodies of text parts. Everything else
+keeps its headers and ends up with an empty payload, so peak memory tracks the
+size of the text rather than the size of the attachments.
+"""
+
+from email.message import Message
+from email.parser import BytesFeedParser, BytesHeaderParser
+from typing import BinaryIO, Iterable, Iterator
+
+TEXT_CONTENT_TYPES = ("text/plain", "text/html")
+
+# Parser states for the line scanner
+_HEADERS = "headers"  # collecting the headers of an entity
+_KEEP = "keep"  # body lines that are fed to the parser
+_SKIP = "skip"  # body lines of a non-text leaf, dropped
+
+
+def _lines(source: "bytes | BinaryIO | Iterable[bytes]") -> Iterator[bytes]:
+    """
+    Yield the lines of ``source`` with CRLF line endings normalised to LF, as
+    ``email.message_from_binary_file`` does when it reads in text mode.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = bytes(source).splitlines(keepends=True)
+    for line in source:
+        if line.endswith(b"\r\n"):
+            line = line[:-2] + b"\n"
+        yield line
+
+
+def _match_boundary(line: bytes, boundaries: list) -> tuple[int, bool] | None:
+    """
+    Return ``(index, is_close)`` if ``line`` is a delimiter for one of the open
+    multipart ``boundaries`` (innermost last), or None.
+    """
+    if not line.startswith(b"--"):
+        return None
+    stripped = line.rstrip(b"\r\n \t")
+    for index in range(len(boundaries) - 1, -1, -1):
+        delimiter = b"--" + boundaries[index]
+        if stripped == delimiter:
+            return index, False
+        if stripped == delimiter + b"--":
+            return index, True
+    return None
+
+
+def parse_text_parts(source: "bytes | BinaryIO | Iterable[bytes]") -> Message:
+    """
+    Parse a raw message, keeping only the bodies of text parts.
+
+    Args:
+        source: Raw message bytes, a binary file object, or an iterable of
+            byte lines. File objects are read one line at a time.
+
+    Returns:
+        An ``email.message.Message`` with the full MIME structure and headers.
+        ``text/plain`` and ``text/html`` parts carry their payloads; all other
+        leaf parts have an empty payload.
+    """
+    parser = BytesFeedParser()
+    header_parser = BytesHeaderParser()
+    boundaries: list = []
+    # Default content type for parts of each open multipart (digest parts
+    # default to message/rfc822)
+    part_defaults: list = []
+    default_type = "text/plain"
+    header_lines: list = []
+    state = _HEADERS
+
+    for line in _lines(source):
+        if state == _HEADERS:
+            parser.feed(line)
+            if line != b"\n":
+                header_lines.append(line)
+                continue
+            headers = header_parser.parsebytes(b"".join(header_lines))
+            header_lines = []
+            if "content-type" not in headers:
+                headers.set_default_type(default_type)
+            content_type = headers.get_content_type()
+            boundary = headers.get_boundary()
+            if headers.get_content_maintype() == "multipart" and boundary:
+                boundaries.append(boundary.encode("ascii", "surrogateescape"))
+                part_defaults.append(
+                    "message/rfc822"
+                    if headers.get_content_subtype() == "digest"
+                    else "text/plain"
+                )
+                state = _KEEP  # preamble
+            elif content_type == "message/rfc822" and headers.get(
+                "content-transfer-encoding", "7bit"
+            ).lower() in ("7bit", "8bit", "binary"):
+                # The headers of the enclosed message follow directly
+                default_type = "text/plain"
+            elif content_type in TEXT_CONTENT_TYPES:
+                state = _KEEP
+            else:
+                state = _SKIP
+            continue
+
+        match = _match_boundary(line, boundaries)
+        if match is None:
+            if state == _KEEP:
+                parser.feed(line)
+            continue
+
+        # A delimiter ends the current body and any nested multiparts
+        index, is_close = match
+        del boundaries[index + 1 :]
+        del part_defaults[index + 1 :]
+        parser.feed(line)
+        if is_close:
+            boundaries.pop()
+            part_defaults.pop()
+            state = _KEEP  # epilogue
+        else:
+            default_type = part_defaults[index]
+            state = _HEADERS
+
+    return parser.close()
+
+
+def parse_text_file(path) -> Message:
+    """Parse the message stored at ``path`` with ``parse_text_parts``."""
+    with open(path, "rb") as f:
+        return parse_text_parts(f)
@@ -0,0 +1,555 @@
+"""
+Estimate the prompt tokens, cost and model time of sending an email corpus.
+
+Every message goes through the same body extraction as ``send_to_supabase``
+and the same choice of text as the edge functions' ``chooseEmailText``: the
+text body, unless it is shorter than 30% of the HTML body. The prompt is
+estimated as the edge functions build it: the system prompt, the serialized
+``TASK_SCHEMA`` response format, an assumed number of open tasks sent for
+deduplication and the email text.
+
+Tokens are counted with tiktoken when it is installed (``pip install
+tiktoken``) and with a local table otherwise (see ``TableTokenizer``). Costs
+use the ``input_cost_nano_per_token``/``output_cost_nano_per_token`` columns
+of an ``ai_prompt_configs`` row.
+
+The report gives the token distribution overall and per sender domain, and
+flags outlier emails. Messages are profiled in parallel worker processes.
+
+The edge functions compact the chosen text before the model call
+(``_shared/compaction.ts``). With ``--compact``, HTML is converted with
+``tools.html_text`` and long URLs are shortened to approximate that; without
+it, the estimates are for the uncompacted text.
+
+Usage:
+    python -m tools.profile_corpus --dir test_integration/email_data --jobs 8
+    python -m tools.profile_corpus --mbox export.mbox --config config.json --out profile.json
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parseaddr
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from tools.html_text import html_to_text
+from tools.mail_sources import iter_eml_dir, iter_maildir, iter_mbox
+from tools.mime_parse import parse_text_parts
+from tools.send_to_supabase import build_payload, iter_compiled
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+TASK_UTILS_PATH = (
+    Path(__file__).parent.parent
+    / "supabase"
+    / "functions"
+    / "_shared"
+    / "task-utils.ts"
+)
+
+# Mirrors TEXT_BODY_MIN_RATIO_OF_HTML in task-utils.ts
+TEXT_BODY_MIN_RATIO_OF_HTML = 0.3
+# Mirrors DEFAULT_TASK_CONTEXT_TOKEN_BUDGET and its 4-characters-per-token rule
+DEFAULT_TASK_CONTEXT_TOKEN_BUDGET = 2000
+CHARS_PER_TOKEN = 4
+# Chat format overhead per message, and for priming the reply
+TOKENS_PER_MESSAGE = 4
+REPLY_PRIMING_TOKENS = 3
+
+# The active config from the test seed, used when --config is not given
+DEFAULT_CONFIG = {
+    "model": "gpt-4.1-mini",
+    "prompt": (
+        "You are a careful assistant for a busy parent.\n"
+        "You are given an existing list of tasks and a new email.\n"
+        "Extract ONLY NEW tasks from the email that are NOT duplicates of the "
+        "existing tasks.\n"
+        "Do not include any existing tasks in your response - only return "
+        "genuinely new actionable items.\n"
+        "Only include actionable items (forms, payments, events, purchases, "
+        "transport, volunteering).\n"
+        "If an event requires attire, do not create a separate task for "
+        "clothing; note attire inside `description`.\n"
+        "Return only valid JSON that conforms to the provided JSON Schema. "
+        "No prose."
+    ),
+    "input_cost_nano_per_token": 400,
+    "output_cost_nano_per_token": 1600,
+}
+
+# A typical extracted task, repeated to stand in for the user's open tasks
+SAMPLE_TASK = {
+    "title": "Picture day",
+    "description": (
+        "School picture day for all grades on Friday morning. Students wear "
+        "full uniform; order forms and retake dates are on the parent portal."
+    ),
+    "due_date": "2025-08-22",
+    "parent_action": "PURCHASE",
+    "parent_requirement_level": "OPTIONAL",
+    "student_action": "ATTEND",
+    "student_requirement_level": "MANDATORY",
+}
+
+PERCENTILES = (50, 90, 99)
+
+# Mirrors MAX_URL_LENGTH in compaction.ts
+MAX_URL_LENGTH = 60
+URL = re.compile(r"https?://[^\s<>()\"'|]+")
+
+
+class TableTokenizer:
+    """
+    Approximate BPE token counts without a vocabulary.
+
+    Text is split the way GPT tokenizers pre-split it (words with their
+    leading space, digit groups of up to three, punctuation runs, whitespace)
+    and each piece is counted from a table: common short words are one token,
+    longer words take more, punctuation runs take one token per two
+    characters and non-ASCII letters roughly one token each.
+    """
+
+    PIECE = re.compile(
+        r"'(?:s|t|re|ve|m|ll|d)\b| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+", re.IGNORECASE
+    )
+    # Tokens for an ASCII word of each length; longer words use one per 4 chars
+    WORD_TOKENS = (0, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3)
+
+    @classmethod
+    @lru_cache(maxsize=1 << 16)
+    def piece_tokens(cls, piece: str) -> int:
+        word = piece.lstrip(" ")
+        if not word or word[0].isdigit() or word.isspace():
+            return 1
+        if not word[0].isalpha():
+            return math.ceil(len(word) / 2)
+        if not word.isascii():
+            return len(word)
+        if len(word) < len(cls.WORD_TOKENS):
+            return cls.WORD_TOKENS[len(word)]
+        return math.ceil(len(word) / 4)
+
+    def count(self, text: str) -> int:
+        # Emails repeat most of their words, so price each distinct piece once
+        pieces = Counter(self.PIECE.findall(text))
+        return sum(self.piece_tokens(p) * n for p, n in pieces.items())
+
+
+class TiktokenTokenizer:
+    """Exact counts for the model's encoding."""
+
+    def __init__(self, model: str):
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self._encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def make_tokenizer(model: str):
+    return TiktokenTokenizer(model) if tiktoken else TableTokenizer()
+
+
+def _ts_tokens(source: str) -> Iterator[str]:
+    """Yield the tokens of a TypeScript object literal as JSON fragments."""
+    token = re.compile(
+        r"""\s+|//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'"""
+        r"""|[A-Za-z_$][\w$]*|-?\d+(?:\.\d+)?|[{}\[\],:]""",
+        re.DOTALL,
+    )
+    position = 0
+    while position < len(source):
+        match = token.match(source, position)
+        if not match:
+            raise ValueError(f"Unexpected character at {position}: {source[position]}")
+        text = match.group()
+        position = match.end()
+        if text[0].isspace() or text.startswith(("//", "/*")):
+            continue
+        if text[0] == "'":
+            # Single-quoted string: unescape \' and re-quote as JSON
+            text = json.dumps(json.loads('"' + text[1:-1].replace("\\'", "'") + '"'))
+        elif text[0].isalpha() or text[0] in "_$":
+            if text not in ("true", "false", "null"):
+                text = json.dumps(text)
+        yield text
+
+
+def load_task_schema(path: str | Path = TASK_UTILS_PATH) -> dict:
+    """Read ``TASK_SCHEMA`` from task-utils.ts as the JSON the API receives."""
+    source = Path(path).read_text(encoding="utf-8")
+    start = source.index("{", source.index("export const TASK_SCHEMA"))
+    depth = 0
+    fragments = []
+    for fragment in _ts_tokens(source[start:]):
+        fragments.append(fragment)
+        if fragment in "{[":
+            depth += 1
+        elif fragment in "}]":
+            depth -= 1
+            if depth == 0:
+                break
+    # Drop trailing commas, which JSON does not allow
+    literal = re.sub(r",(\s*[}\]])", r"\1", " ".join(fragments))
+    return json.loads(literal)
+
+
+def choose_email_text(payload: dict) -> tuple[str, str]:
+    """Return ``(kind, text)`` as ``chooseEmailText`` picks it."""
+    plain = payload.get("TextBody") or ""
+    html = payload.get("HtmlBody") or ""
+    if plain and (not html or len(plain) >= TEXT_BODY_MIN_RATIO_OF_HTML * len(html)):
+        return "text", plain
+    return ("html", html) if html else ("empty", "")
+
+
+def compact_text(kind: str, text: str) -> str:
+    """Approximate compactEmailText: HTML to text and long URLs shortened."""
+    if kind == "html":
+        text = html_to_text(text)
+    return URL.sub(
+        lambda m: m.group() if len(m.group()) <= MAX_URL_LENGTH else "[link]", text
+    )
+
+
+def sender_domain(from_header: str | None) -> str:
+    address = parseaddr(from_header or "")[1].lower()
+    return address.rpartition("@")[2] or "(unknown)"
+
+
+def open_tasks_context(open_tasks: int, token_budget: int) -> list:
+    """The open tasks that fit in the context budget, as selectTasksForPrompt."""
+    per_task = math.ceil(len(json.dumps(SAMPLE_TASK)) / CHARS_PER_TOKEN)
+    return [SAMPLE_TASK] * min(open_tasks, token_budget // per_task)
+
+
+def prompt_overhead_tokens(
+    tokenizer, config: dict, schema: dict, open_tasks: list
+) -> int:
+    """Tokens of everything in the request except the email text."""
+    user_prefix = (
+        f"Existing tasks:\n{json.dumps({'tasks': open_tasks}, ensure_ascii=False)}"
+        "\n\nEmail:\n"
+    )
+    return (
+        tokenizer.count(config["prompt"])
+        + tokenizer.count(json.dumps(schema, ensure_ascii=False))
+        + tokenizer.count(user_prefix)
+        + 2 * TOKENS_PER_MESSAGE
+        + REPLY_PRIMING_TOKENS
+    )
+
+
+# Tokenizer and options of the current worker process
+_tokenizer = None
+_compact = False
+
+
+def _init_worker(model: str, compact: bool = False) -> None:
+    global _tokenizer, _compact
+    _tokenizer = make_tokenizer(model)
+    _compact = compact
+
+
+def profile_message(name: str, payload: dict) -> dict:
+    """Profile one email: its sender domain, chosen body and text tokens."""
+    kind, text = choose_email_text(payload)
+    if _compact:
+        text = compact_text(kind, text)
+    return {
+        "name": name,
+        "domain": sender_domain(payload.get("From")),
+        "body": kind,
+        "chars": len(text),
+        "email_tokens": _tokenizer.count(text) if text else 0,
+    }
+
+
+def _profile_batch(batch: list) -> list:
+    results = []
+    for name, item in batch:
+        try:
+            payload = (
+                item
+                if isinstance(item, dict)
+                else build_payload(parse_text_parts(item), alias="")
+            )
+            results.append(profile_message(name, payload))
+        except Exception as e:
+            results.append({"name": name, "error": str(e)})
+    return results
+
+
+def profile_messages(
+    messages: Iterable[tuple[str, "bytes | dict"]],
+    model: str,
+    jobs: int = 1,
+    compact: bool = False,
+    batch_size: int = 64,
+) -> Iterator[dict]:
+    """
+    Yield a profile per message, in input order.
+
+    ``messages`` yields ``(name, raw bytes)`` from a mail source or ``(name,
+    payload)`` from a compiled payload file. With more than one job, batches
+    of messages are profiled in a process pool with a bounded number in
+    flight, so a large corpus is never loaded into memory at once.
+    """
+    iterator = iter(messages)
+    batches = iter(lambda: list(islice(iterator, batch_size)), [])
+    if jobs <= 1:
+        _init_worker(model, compact)
+        for batch in batches:
+            yield from _profile_batch(batch)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(model, compact)
+    ) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(_profile_batch, batch))
+            if len(pending) >= jobs * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def percentile(sorted_values: list, percent: float) -> int:
+    if not sorted_values:
+        return 0
+    index = max(math.ceil(percent / 100 * len(sorted_values)), 1) - 1
+    return sorted_values[index]
+
+
+def _distribution(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values)) if values else 0,
+        **{f"p{p}": percentile(values, p) for p in PERCENTILES},
+        "max": values[-1] if values else 0,
+    }
+
+
+def build_report(
+    profiles: Iterable[dict],
+    overhead_tokens: int,
+    config: dict,
+    output_tokens: int = 150,
+    outlier_factor: float = 3.0,
+    seconds_per_request: float = 1.0,
+    output_tokens_per_second: float = 80.0,
+) -> dict:
+    """
+    Summarize message profiles.
+
+    An email is an outlier when its prompt is more than ``outlier_factor``
+    times the median of its sender domain and above the corpus p90.
+    """
+    input_cost = config["input_cost_nano_per_token"]
+    output_cost = config["output_cost_nano_per_token"]
+
+    by_domain = defaultdict(list)
+    bodies = defaultdict(int)
+    errors = []
+    emails = []
+    for profile in profiles:
+        if "error" in profile:
+            errors.append(profile)
+            continue
+        profile["prompt_tokens"] = overhead_tokens + profile["email_tokens"]
+        by_domain[profile["domain"]].append(profile)
+        bodies[profile["body"]] += 1
+        emails.append(profile)
+
+    def cost_nano(prompt_tokens: int) -> int:
+        return prompt_tokens * input_cost + output_tokens * output_cost
+
+    prompt_tokens = [e["prompt_tokens"] for e in emails]
+    overall = _distribution(prompt_tokens)
+    total_cost = sum(cost_nano(t) for t in prompt_tokens)
+
+    domains = []
+    outliers = []
+    for domain, profiles_ in by_domain.items():
+        tokens = [p["prompt_tokens"] for p in profiles_]
+        stats = _distribution(tokens)
+        domains.append(
+            {
+                "domain": domain,
+                **stats,
+                "html_share": round(
+                    sum(p["body"] == "html" for p in profiles_) / len(profiles_), 3
+                ),
+                "cost_usd": sum(cost_nano(t) for t in tokens) / 1e9,
+            }
+        )
+        threshold = max(stats["p50"] * outlier_factor, overall["p90"])
+        outliers.extend(
+            {**p, "domain_p50": stats["p50"]}
+            for p in profiles_
+            if p["prompt_tokens"] > threshold
+        )
+    domains.sort(key=lambda d: d["cost_usd"], reverse=True)
+    outliers.sort(key=lambda p: p["prompt_tokens"], reverse=True)
+
+    return {
+        "model": config.get("model"),
+        "emails": len(emails),
+        "errors": errors,
+        "bodies": dict(bodies),
+        "overhead_tokens": overhead_tokens,
+        "prompt_tokens": overall,
+        "input_tokens_total": sum(prompt_tokens),
+        "output_tokens_assumed": output_tokens,
+        "cost_usd": total_cost / 1e9,
+        "model_seconds": round(
+            len(emails)
+            * (seconds_per_request + output_tokens / output_tokens_per_second),
+            1,
+        ),
+        "domains": domains,
+        "outliers": outliers,
+    }
+
+
+def print_report(report: dict, top: int = 20) -> None:
+    tokens = report["prompt_tokens"]
+    print(
+        f"Emails: {report['emails']} ({report['bodies']}), errors: {len(report['errors'])}"
+    )
+    print(
+        f"Prompt tokens: mean {tokens['mean']} p50 {tokens['p50']} p90 {tokens['p90']} "
+        f"p99 {tokens['p99']} max {tokens['max']} "
+        f"(of which {report['overhead_tokens']} per email are prompt, schema and open tasks)"
+    )
+    print(
+        f"Estimated cost: ${report['cost_usd']:.4f} for {report['input_tokens_total']} input "
+        f"and {report['output_tokens_assumed']} output tokens per email"
+    )
+    print(f"Estimated model time: {report['model_seconds']}s sequentially")
+
+    print(f"\nTop {top} sender domains by cost:")
+    print(
+        f"  {'domain':40} {'emails':>7} {'p50':>7} {'p90':>7} {'max':>7} {'html':>5} {'cost $':>9}"
+    )
+    for d in report["domains"][:top]:
+        print(
+            f"  {d['domain'][:40]:40} {d['count']:>7} {d['p50']:>7} {d['p90']:>7} "
+            f"{d['max']:>7} {d['html_share']:>5.0%} {d['cost_usd']:>9.4f}"
+        )
+
+    if report["outliers"]:
+        print(f"\nOutliers ({len(report['outliers'])}):")
+        for o in report["outliers"][:top]:
+            print(
+                f"  {o['prompt_tokens']:>7} tokens ({o['body']}, domain p50 "
+                f"{o['domain_p50']}) {o['domain']}: {o['name']}"
+            )
+    for e in report["errors"][:top]:
+        print(f"✗ {e['name']}: {e['error']}")
+
+
+def main():
+    """Profile a corpus and print the report."""
+    parser = argparse.ArgumentParser(
+        description="Estimate prompt tokens and cost of an email corpus"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory containing .eml files")
+    source.add_argument("--mbox", help="Path to an mbox file")
+    source.add_argument("--maildir", help="Path to a Maildir")
+    source.add_argument("--payloads", help="NDJSON file from tools.compile_payloads")
+    parser.add_argument(
+        "--config",
+        help="JSON file with an ai_prompt_configs row (model, prompt and cost "
+        "columns); defaults to the seeded config",
+    )
+    parser.add_argument(
+        "--open-tasks",
+        type=int,
+        default=10,
+        help="Open tasks assumed per user (default: 10)",
+    )
+    parser.add_argument(
+        "--task-context-tokens",
+        type=int,
+        default=DEFAULT_TASK_CONTEXT_TOKEN_BUDGET,
+        help="Token budget for the open-task context, as TASK_CONTEXT_TOKEN_BUDGET "
+        f"(default: {DEFAULT_TASK_CONTEXT_TOKEN_BUDGET})",
+    )
+    parser.add_argument(
+        "--output-tokens",
+        type=int,
+        default=150,
+        help="Completion tokens assumed per email (default: 150)",
+    )
+    parser.add_argument(
+        "--outlier-factor",
+        type=float,
+        default=3.0,
+        help="Flag emails this many times their domain's median (default: 3)",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Approximate the edge functions' compaction of the email text",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: number of CPUs)",
+    )
+    parser.add_argument("--top", type=int, default=20, help="Rows per table")
+    parser.add_argument("--out", help="Also write the full report as JSON")
+    args = parser.parse_args()
+
+    config = DEFAULT_CONFIG
+    if args.config:
+        config = {**DEFAULT_CONFIG, **json.loads(Path(args.config).read_text())}
+
+    if args.dir:
+        messages = iter_eml_dir(args.dir)
+    elif args.mbox:
+        messages = iter_mbox(args.mbox)
+    elif args.maildir:
+        messages = iter_maildir(args.maildir)
+    else:
+        messages = iter_compiled(args.payloads)
+
+    tokenizer = make_tokenizer(config["model"])
+    overhead = prompt_overhead_tokens(
+        tokenizer,
+        config,
+        load_task_schema(),
+        open_tasks_context(args.open_tasks, args.task_context_tokens),
+    )
+    report = build_report(
+        profile_messages(messages, config["model"], args.jobs, args.compact),
+        overhead,
+        config,
+        output_tokens=args.output_tokens,
+        outlier_factor=args.outlier_factor,
+    )
+    report["tokenizer"] = "tiktoken" if tiktoken else "table"
+    print_report(report, args.top)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
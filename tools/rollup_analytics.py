@@ -0,0 +1,178 @@
+"""
+Incremental daily rollup of analytics.events into analytics.user_daily_metrics.
+
+Each run looks only at events added since the last run. For every partition
+of analytics.events it keeps a watermark, the highest event id already rolled
+up, in analytics.rollup_watermarks. The days those new events fall on are
+recomputed with analytics.recompute_user_daily_metrics. This includes
+late-arriving events for past days. Days without new events are not touched.
+A partition's recompute and its watermark move commit together, so a failed
+run is simply redone by the next one.
+
+Event ids come from a sequence and are assigned before commit, so a slow
+transaction can commit an id below one that is already visible. Events
+younger than ``--settle-seconds`` are left for the next run so that such
+stragglers are not skipped.
+
+Usage (e.g. every 15 minutes from cron):
+    DATABASE_URL=postgresql://... python -m tools.rollup_analytics
+"""
+
+import argparse
+import os
+from datetime import date, timedelta
+from typing import Iterable
+
+# Serializes concurrent runs of the job
+ROLLUP_LOCK_KEY = 0x726F6C6C7570
+
+LIST_PARTITIONS_SQL = """
+select c.relname
+from pg_inherits i
+join pg_class c on c.oid = i.inhrelid
+join pg_class p on p.oid = i.inhparent
+join pg_namespace n on n.oid = p.relnamespace
+where n.nspname = 'analytics' and p.relname = 'events'
+order by c.relname
+"""
+
+WATERMARK_SQL = """
+select last_event_id from analytics.rollup_watermarks
+where partition_name = %s
+for update
+"""
+
+# Highest id that can be rolled up: everything below the oldest event that
+# is still settling, or the newest event if none is
+UPPER_BOUND_SQL = """
+select coalesce(
+  (select min(id) - 1 from analytics.{partition}
+   where id > %(after)s and created_at > now() - %(settle)s * interval '1 second'),
+  (select max(id) from analytics.{partition} where id > %(after)s)
+)
+"""
+
+NEW_EVENT_DAYS_SQL = """
+select distinct occurred_date from analytics.{partition}
+where id > %(after)s and id <= %(upto)s
+order by occurred_date
+"""
+
+RECOMPUTE_SQL = "select analytics.recompute_user_daily_metrics(%s, %s)"
+
+SAVE_WATERMARK_SQL = """
+insert into analytics.rollup_watermarks (partition_name, last_event_id)
+values (%s, %s)
+on conflict (partition_name) do update
+set last_event_id = excluded.last_event_id, updated_at = now()
+"""
+
+
+def day_ranges(days: Iterable[date]) -> list[tuple[date, date]]:
+    """Collapse days into inclusive ``(start, end)`` runs of consecutive days."""
+    ranges: list[tuple[date, date]] = []
+    for day in sorted(set(days)):
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def rollup_partition(conn, partition: str, settle_seconds: int) -> list[date]:
+    """
+    Roll up the new events of one partition in a single transaction and return
+    the days that were recomputed.
+    """
+    table = _quote_ident(partition)
+    with conn.cursor() as cursor:
+        cursor.execute(WATERMARK_SQL, (partition,))
+        row = cursor.fetchone()
+        after = row[0] if row else 0
+
+        params = {"after": after, "settle": settle_seconds}
+        cursor.execute(UPPER_BOUND_SQL.format(partition=table), params)
+        upto = cursor.fetchone()[0]
+        if upto is None or upto <= after:
+            conn.commit()
+            return []
+
+        cursor.execute(
+            NEW_EVENT_DAYS_SQL.format(partition=table), {**params, "upto": upto}
+        )
+        days = [r[0] for r in cursor.fetchall()]
+        for start, end in day_ranges(days):
+            cursor.execute(RECOMPUTE_SQL, (start, end))
+        cursor.execute(SAVE_WATERMARK_SQL, (partition, upto))
+    conn.commit()
+    return days
+
+
+def run_rollup(conn, settle_seconds: int = 60) -> dict[str, list[date]] | None:
+    """
+    Roll up every partition. Returns the recomputed days per partition, or
+    None if another run holds the lock.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("select pg_try_advisory_lock(%s)", (ROLLUP_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.commit()
+            return None
+        cursor.execute(LIST_PARTITIONS_SQL)
+        partitions = [r[0] for r in cursor.fetchall()]
+    conn.commit()
+    try:
+        return {p: rollup_partition(conn, p, settle_seconds) for p in partitions}
+    finally:
+        # After a failed statement the transaction is aborted, and the unlock
+        # would fail too and hide the original error
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("select pg_advisory_unlock(%s)", (ROLLUP_LOCK_KEY,))
+        conn.commit()
+
+
+def main():
+    """Run one incremental rollup."""
+    parser = argparse.ArgumentParser(
+        description="Incrementally roll up analytics.events into daily metrics."
+    )
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("DATABASE_URL"),
+        help="Postgres connection string (default: $DATABASE_URL)",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=int,
+        default=60,
+        help="Leave events younger than this for the next run (default: 60)",
+    )
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    import psycopg2
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        result = run_rollup(conn, args.settle_seconds)
+    finally:
+        conn.close()
+
+    if result is None:
+        print("Another rollup is running; nothing to do.")
+        return
+    for partition, days in result.items():
+        if days:
+            print(f"{partition}: recomputed {', '.join(str(d) for d in days)}")
+    total = sum(len(days) for days in result.values())
+    print(f"Recomputed {total} partition-days across {len(result)} partitions.")
+
+
+if __name__ == "__main__":
+    main()
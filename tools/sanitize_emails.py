@@ -10,48 +10,180 @@ This script sanitizes .eml files by:
 5. Replacing blocked words with random animal words from: cat, mouse, dog, cow, pig, chicken
 
 Usage:
-    python sanitize_emails.py --dir path/to/directory --block-words word1,word2,word3
+    python -m tools.sanitize_emails --dir path/to/directory --block-words word1,word2,word3
+    python -m tools.sanitize_emails --dir path/to/directory --jobs 8 --seed 42
+    python -m tools.sanitize_emails --dir path/to/directory --incremental
+    python -m tools.sanitize_emails --mbox export.mbox --out-mbox sanitized.mbox
+    python -m tools.sanitize_emails --maildir ~/Maildir --out-dir path/to/directory
+    python tools/sanitize_emails.py --dir path/to/directory
 """
 
 import argparse
 import email
 import email.utils
+import hashlib
+import json
 import os
 import random
 import re
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
 
+if not __package__:
+    # Run as a script (python tools/sanitize_emails.py): make the tools
+    # package importable from the repository root
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-def replace_blocked_words(text: str, blocked_words: list) -> str:
+from tools.mail_sources import (  # noqa: E402
+    DirectorySink,
+    MboxSink,
+    iter_maildir,
+    iter_mbox,
+)
+from tools.mime_parse import parse_text_parts  # noqa: E402
+
+# Email regex pattern - matches most common email formats
+EMAIL_PATTERN = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
+
+# HTTP/HTTPS URL regex pattern - matches most common URL formats
+URL_PATTERN = r'https?://[^\s<>"{}|\\^`\[\]]*'
+
+EMAIL_REPLACEMENT = "someone@somewhere.com"
+URL_REPLACEMENT = "https://a_link"
+
+# Animal words to replace blocked words with
+ANIMAL_WORDS = ["cat", "mouse", "dog", "cow", "pig", "chicken"]
+
+# Manifest kept in the email directory by --incremental runs. Bump the version
+# whenever a change to the sanitizer alters its output, so every file is redone.
+MANIFEST_NAME = ".sanitize_manifest.json"
+MANIFEST_VERSION = 1
+
+_EMAIL_RE = re.compile(EMAIL_PATTERN)
+_URL_RE = re.compile(URL_PATTERN)
+
+
+def _trie_pattern(words: list) -> str:
+    """
+    Build a regex alternation for ``words`` factored as a character trie.
+
+    A flat ``a|b|c`` alternation retries every word at every position, while
+    the trie only follows the branch matching the next character, so matching
+    cost stays flat as the block list grows.
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end-of-word marker
+
+    def build(node: dict) -> str:
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        if "" in node:
+            # A word ends here but longer words continue; try those first
+            return "(?:" + "|".join(branches) + ")?"
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+def _blocked_words_pattern(blocked_words: list) -> str | None:
+    """Return a case-insensitive whole-word pattern for the blocked words."""
+    words = sorted({word.strip().lower() for word in blocked_words if word.strip()})
+    if not words:
+        return None
+    return rf"\b(?i:{_trie_pattern(words)})\b"
+
+
+def _animal_picker(rng):
+    """Return a function mapping each blocked word to one random animal word."""
+    animals: dict = {}
+
+    def pick(word: str) -> str:
+        word = word.lower()
+        if word not in animals:
+            animals[word] = rng.choice(ANIMAL_WORDS)
+        return animals[word]
+
+    return pick
+
+
+class Scrubber:
+    """
+    Replaces email addresses, HTTP links and blocked words in a single pass.
+
+    Build one per run; the combined pattern is compiled once from the blocked
+    word list and reused for every part of every email.
+    """
+
+    def __init__(self, blocked_words: list | None = None):
+        alternatives = [f"(?P<url>{URL_PATTERN})", f"(?P<email>{EMAIL_PATTERN})"]
+        words_pattern = _blocked_words_pattern(blocked_words or [])
+        if words_pattern:
+            alternatives.append(f"(?P<word>{words_pattern})")
+        self._pattern = re.compile("|".join(alternatives))
+
+    def scrub(self, text: str, rng: random.Random | None = None) -> str:
+        """
+        Return ``text`` with email addresses, links and blocked words replaced.
+
+        Each blocked word is replaced by the same randomly chosen animal word
+        throughout one call.
+
+        Args:
+            text: Input text to scrub
+            rng: Random generator used to pick animal words (defaults to the
+                ``random`` module)
+        """
+        pick = _animal_picker(rng or random)
+
+        def replace(match: re.Match) -> str:
+            if match.lastgroup == "url":
+                return URL_REPLACEMENT
+            if match.lastgroup == "email":
+                return EMAIL_REPLACEMENT
+            return pick(match.group())
+
+        return self._pattern.sub(replace, text)
+
+
+def replace_blocked_words(
+    text: str, blocked_words: list, rng: random.Random | None = None
+) -> str:
     """
     Replace blocked words in the given text with random animal words.
 
     Args:
         text: Input text that may contain blocked words
         blocked_words: List of words to replace
+        rng: Random generator used to pick animal words (defaults to the
+            ``random`` module)
 
     Returns:
         Text with all blocked words replaced with random animal words
     """
-    if not blocked_words:
+    pattern = _blocked_words_pattern(blocked_words or [])
+    if not pattern:
         return text
 
-    # Animal words to replace blocked words with
-    replacement_words = ["cat", "mouse", "dog", "cow", "pig", "chicken"]
-
-    # Replace each blocked word with a random animal word
-    result_text = text
-    for word in blocked_words:
-        if word.strip():  # Skip empty words
-            # Use word boundaries to match whole words only
-            pattern = r"\b" + re.escape(word.strip()) + r"\b"
-            replacement = random.choice(replacement_words)
-            result_text = re.sub(pattern, replacement, result_text, flags=re.IGNORECASE)
-
-    return result_text
+    pick = _animal_picker(rng or random)
+    return re.sub(pattern, lambda match: pick(match.group()), text)
 
 
 def replace_email_addresses(text: str) -> str:
@@ -64,9 +196,7 @@ def replace_email_addresses(text: str) -> str:
     Returns:
         Text with all email addresses replaced
     """
-    # Email regex pattern - matches most common email formats
-    email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-    return re.sub(email_pattern, "someone@somewhere.com", text)
+    return _EMAIL_RE.sub(EMAIL_REPLACEMENT, text)
 
 
 def replace_http_links(text: str) -> str:
@@ -79,19 +209,18 @@ def replace_http_links(text: str) -> str:
     Returns:
         Text with all HTTP/HTTPS links replaced
     """
-    # HTTP/HTTPS URL regex pattern - matches most common URL formats
-    url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]*'
-    return re.sub(url_pattern, "https://a_link", text)
+    return _URL_RE.sub(URL_REPLACEMENT, text)
 
 
-def process_and_sanitize_payload(email_part, blocked_words):
+def process_and_sanitize_payload(email_part, scrubber: Scrubber, rng=None):
     """
     Process and sanitize the payload of an email part by decoding, replacing
     email addresses, HTTP links, and blocked words, and returning the sanitized text.
 
     Args:
         email_part: An email message or part object
-        blocked_words: List of words to replace with animal words
+        scrubber: Scrubber used to replace emails, links and blocked words
+        rng: Optional random generator used for blocked word replacement
 
     Returns:
         str: Sanitized text payload
@@ -105,46 +234,57 @@ def process_and_sanitize_payload(email_part, blocked_words):
             text_payload = decoded_payload.decode(charset, errors="replace")
 
             # Replace email addresses, HTTP links, and blocked words
-            text_payload = replace_email_addresses(text_payload)
-            text_payload = replace_http_links(text_payload)
-            text_payload = replace_blocked_words(text_payload, blocked_words)
-
-            return text_payload
+            return scrubber.scrub(text_payload, rng)
         else:
             # Fallback to string payload if decoding fails
             payload = email_part.get_payload()
             if isinstance(payload, str):
-                payload = replace_email_addresses(payload)
-                payload = replace_http_links(payload)
-                payload = replace_blocked_words(payload, blocked_words)
+                payload = scrubber.scrub(payload, rng)
             return payload
     except (UnicodeDecodeError, LookupError):
         # If decoding fails, fall back to string replacement
         payload = email_part.get_payload()
         if isinstance(payload, str):
-            payload = replace_email_addresses(payload)
-            payload = replace_http_links(payload)
-            payload = replace_blocked_words(payload, blocked_words)
+            payload = scrubber.scrub(payload, rng)
         return payload
 
 
-def sanitize_email(eml_content: str, blocked_words: list) -> str:
+def sanitize_email(
+    eml_content: "str | bytes | BinaryIO",
+    blocked_words: "list | Scrubber",
+    rng: random.Random | None = None,
+) -> str:
     """
     Sanitize an email by keeping only specified headers and content types.
     Preserves original Content-Transfer-Encoding and Content-Type (including charset).
 
     Args:
-        eml_content: Raw .eml file content as string
-        blocked_words: List of words to replace with animal words
+        eml_content: Raw .eml content as a string, as bytes, or as a binary
+            file object. Bytes and files are parsed with
+            ``mime_parse.parse_text_parts``, which never buffers the bodies
+            of attachments
+        blocked_words: List of words to replace with animal words, or a
+            prebuilt Scrubber to reuse across many emails
+        rng: Optional random generator used for blocked word replacement; pass
+            a seeded generator for reproducible output
 
     Returns:
         Sanitized email content as string
     """
+    scrubber = (
+        blocked_words
+        if isinstance(blocked_words, Scrubber)
+        else Scrubber(blocked_words)
+    )
+
     # Parse the email
-    msg = email.message_from_string(eml_content)
+    if isinstance(eml_content, str):
+        msg = email.message_from_string(eml_content)
+    else:
+        msg = parse_text_parts(eml_content)
 
     # Headers to keep
-    headers_to_keep = {"From", "To", "Bcc", "Subject", "Date", "Message-Id"}
+    headers_to_keep = ("From", "To", "Bcc", "Subject", "Date", "Message-Id")
 
     # Create new message structure
     if msg.is_multipart():
@@ -159,13 +299,21 @@ def sanitize_email(eml_content: str, blocked_words: list) -> str:
                     content_type_header.split("multipart/")[1].split(";")[0].strip()
                 )
                 new_msg.set_type(f"multipart/{subtype}")
+        # Reuse the original boundary; a freshly generated one is random and
+        # would make the output differ between otherwise identical runs
+        if msg.get_boundary():
+            new_msg.set_boundary(msg.get_boundary())
     else:
         new_msg = MIMEText("")
 
-    # Copy specified headers
-    for header in headers_to_keep:
-        if header in msg:
-            new_msg[header] = msg[header]
+    # Copy specified headers in their original order (iterating a set gave a
+    # hash-seed dependent order), replacing email addresses, HTTP links, and
+    # blocked words in their values
+    remaining = {header.lower(): header for header in headers_to_keep}
+    for name in msg.keys():
+        header = remaining.pop(name.lower(), None)
+        if header:
+            new_msg[header] = scrubber.scrub(str(msg[header]), rng)
 
     # Process message content
     if msg.is_multipart():
@@ -197,7 +345,7 @@ def sanitize_email(eml_content: str, blocked_words: list) -> str:
                     new_part["MIME-Version"] = part["MIME-Version"]
 
                 # Process and sanitize the payload
-                sanitized_payload = process_and_sanitize_payload(part, blocked_words)
+                sanitized_payload = process_and_sanitize_payload(part, scrubber, rng)
                 new_part.set_payload(sanitized_payload)
 
                 new_msg.attach(new_part)
@@ -219,60 +367,282 @@ def sanitize_email(eml_content: str, blocked_words: list) -> str:
                 new_msg["MIME-Version"] = msg["MIME-Version"]
 
             # Process and sanitize the payload
-            sanitized_payload = process_and_sanitize_payload(msg, blocked_words)
+            sanitized_payload = process_and_sanitize_payload(msg, scrubber, rng)
             new_msg.set_payload(sanitized_payload)
 
-    # Convert to string and do final email address, HTTP link, and blocked word replacement in headers
-    sanitized_content = str(new_msg)
-    sanitized_content = replace_email_addresses(sanitized_content)
-    sanitized_content = replace_http_links(sanitized_content)
-    sanitized_content = replace_blocked_words(sanitized_content, blocked_words)
+    # Headers and payloads were each scrubbed once above
+    return str(new_msg)
+
+
+def _file_rng(seed: int | None, file_name: str) -> random.Random | None:
+    """Return a generator seeded from ``seed`` and the file name, or None.
+
+    Seeding per file (rather than sharing one generator across the run) keeps
+    the output of each file independent of processing order, so serial and
+    parallel runs produce identical results.
+    """
+    if seed is None:
+        return None
+    return random.Random(f"{seed}:{file_name}")
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """
+    Write ``data`` to ``path`` via a temporary file and an atomic rename.
+
+    An interrupted run leaves either the old or the new file, never a partial one.
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _file_digest(path: Path) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def block_list_fingerprint(blocked_words: list, seed: int | None) -> str:
+    """
+    Fingerprint the settings that determine sanitized output.
+
+    Matching is case-insensitive, so the fingerprint ignores case, order and
+    duplicates in the block list. The seed is included because it changes which
+    animal replaces each word.
+    """
+    words = sorted({word.strip().lower() for word in blocked_words if word.strip()})
+    settings = {"version": MANIFEST_VERSION, "blocked_words": words, "seed": seed}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(directory: Path, fingerprint: str) -> dict:
+    """
+    Return the ``{file name: sha256}`` map recorded by the last incremental run.
+
+    An empty map is returned if there is no manifest, it cannot be read, or it
+    was written with a different block list or seed.
+    """
+    try:
+        with open(Path(directory) / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("fingerprint") != fingerprint:
+        return {}
+    files = manifest.get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def save_manifest(directory: Path, fingerprint: str, files: dict) -> None:
+    """Atomically write the manifest for an incremental run."""
+    manifest = {"fingerprint": fingerprint, "files": dict(sorted(files.items()))}
+    data = json.dumps(manifest, indent=2).encode("utf-8") + b"\n"
+    _atomic_write_bytes(Path(directory) / MANIFEST_NAME, data)
+
+
+def sanitize_file(eml_file: Path, scrubber: Scrubber, seed: int | None = None):
+    """
+    Sanitize a single .eml file in place.
+
+    Args:
+        eml_file: Path to the .eml file
+        scrubber: Scrubber built from the blocked word list
+        seed: Optional seed for reproducible blocked word replacement
+
+    Returns:
+        None on success, or an error message string on failure
+    """
+    try:
+        # Stream the original file through the parser; only its text parts
+        # are held in memory
+        with open(eml_file, "rb") as f:
+            sanitized_content = sanitize_email(
+                f, scrubber, _file_rng(seed, eml_file.name)
+            )
+
+        # Replace the original only once the sanitized copy is fully written
+        _atomic_write_bytes(eml_file, sanitized_content.encode("utf-8"))
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def sanitize_message(
+    message: tuple[str, bytes], scrubber: Scrubber, seed: int | None = None
+):
+    """
+    Sanitize one message read from an archive.
+
+    Args:
+        message: ``(name, raw bytes)`` pair as yielded by a mail source
+        scrubber: Scrubber built from the blocked word list
+        seed: Optional seed for reproducible blocked word replacement
 
-    return sanitized_content
+    Returns:
+        Tuple of (sanitized content or None, error message or None)
+    """
+    name, raw = message
+    try:
+        return sanitize_email(raw, scrubber, _file_rng(seed, name)), None
+    except Exception as e:
+        return None, str(e)
 
 
-def process_eml_files(directory_path: str, blocked_words: list):
+def _ordered_results(function, items: Iterable, jobs: int, *args) -> Iterator:
+    """
+    Yield ``(item, function(item, *args))`` for each item, in input order.
+
+    With more than one job the calls run in a process pool. Only a bounded
+    window of items is in flight at a time, so a generator source is consumed
+    lazily instead of being loaded into memory up front.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield item, function(item, *args)
+        return
+
+    window = jobs * 4
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(function, item, *args)))
+            if len(pending) >= window:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+        while pending:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+
+
+def _report(name: str, error: str | None, errors: list) -> bool:
+    """Print the outcome for one message and record any error."""
+    if error is None:
+        print(f"✓ Successfully sanitized: {name}")
+        return True
+    errors.append((name, error))
+    print(f"✗ Error processing {name}: {error}")
+    return False
+
+
+def process_eml_files(
+    directory_path: str,
+    blocked_words: list,
+    jobs: int = 1,
+    seed: int | None = None,
+    incremental: bool = False,
+):
     """
     Process all .eml files in the specified directory.
 
     Args:
         directory_path: Path to directory containing .eml files
         blocked_words: List of words to replace with animal words
+        jobs: Number of worker processes; 1 processes files serially
+        seed: Optional seed for reproducible blocked word replacement
+        incremental: Skip files whose content matches the manifest from the
+            previous run with the same block list and seed
+
+    Returns:
+        Tuple of (number of files sanitized, list of (file name, error) pairs)
     """
     directory = Path(directory_path)
 
     if not directory.exists():
         print(f"Directory not found: {directory_path}")
-        return
+        return 0, []
 
-    # Find all .eml files
-    eml_files = list(directory.glob("*.eml"))
+    # Find all .eml files, sorted so that progress and errors are reported in a
+    # stable order regardless of the number of jobs
+    eml_files = sorted(directory.glob("*.eml"), key=lambda p: p.name)
 
     if not eml_files:
         print(f"No .eml files found in {directory_path}")
-        return
+        return 0, []
 
     print(f"Found {len(eml_files)} .eml files to process...")
 
-    for eml_file in eml_files:
-        print(f"Processing: {eml_file.name}")
-
-        try:
-            # Read the original file
-            with open(eml_file, "r", encoding="utf-8", errors="ignore") as f:
-                original_content = f.read()
-
-            # Sanitize the content
-            sanitized_content = sanitize_email(original_content, blocked_words)
+    manifest = {}
+    if incremental:
+        fingerprint = block_list_fingerprint(blocked_words, seed)
+        previous = load_manifest(directory, fingerprint)
+        pending = []
+        for eml_file in eml_files:
+            recorded = previous.get(eml_file.name)
+            if recorded is not None and recorded == _file_digest(eml_file):
+                manifest[eml_file.name] = recorded
+            else:
+                pending.append(eml_file)
+        print(f"Skipping {len(manifest)} unchanged files")
+    else:
+        pending = eml_files
 
-            # Write back to the same file
-            with open(eml_file, "w", encoding="utf-8") as f:
-                f.write(sanitized_content)
+    # Compile the scrubber once for the whole run
+    scrubber = Scrubber(blocked_words)
+    succeeded = 0
+    errors = []
+    try:
+        for eml_file, error in _ordered_results(
+            sanitize_file, pending, jobs, scrubber, seed
+        ):
+            if _report(eml_file.name, error, errors):
+                succeeded += 1
+                if incremental:
+                    manifest[eml_file.name] = _file_digest(eml_file)
+    finally:
+        # Record progress even if the run is interrupted part way through
+        if incremental:
+            save_manifest(directory, fingerprint, manifest)
+
+    print(f"Sanitized {succeeded} of {len(pending)} files, {len(errors)} errors")
+    return succeeded, errors
+
+
+def process_messages(
+    messages: Iterable[tuple[str, bytes]],
+    sink,
+    blocked_words: list,
+    jobs: int = 1,
+    seed: int | None = None,
+):
+    """
+    Sanitize a stream of messages and write the results to ``sink``.
 
-            print(f"✓ Successfully sanitized: {eml_file.name}")
+    Args:
+        messages: Iterable of ``(name, raw bytes)`` pairs, e.g. from
+            ``mail_sources.iter_mbox`` or ``mail_sources.iter_maildir``
+        sink: Object with ``write(name, content)`` receiving sanitized bytes
+        blocked_words: List of words to replace with animal words
+        jobs: Number of worker processes; 1 processes messages serially
+        seed: Optional seed for reproducible blocked word replacement
 
-        except Exception as e:
-            print(f"✗ Error processing {eml_file.name}: {str(e)}")
+    Returns:
+        Tuple of (number of messages sanitized, list of (name, error) pairs)
+    """
+    scrubber = Scrubber(blocked_words)
+    total = 0
+    succeeded = 0
+    errors = []
+    for (name, _), (content, error) in _ordered_results(
+        sanitize_message, messages, jobs, scrubber, seed
+    ):
+        total += 1
+        if error is None:
+            sink.write(name, content.encode("utf-8"))
+        succeeded += _report(name, error, errors)
+
+    print(f"Sanitized {succeeded} of {total} messages, {len(errors)} errors")
+    return succeeded, errors
 
 
 def main():
@@ -280,17 +650,63 @@ def main():
     parser = argparse.ArgumentParser(
         description="Sanitize .eml files by replacing emails, links, and blocked words"
     )
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--dir",
-        required=True,
-        help="Path to directory containing .eml files to sanitize",
+        help="Path to directory containing .eml files to sanitize in place",
+    )
+    source.add_argument(
+        "--mbox",
+        help="Path to an mbox file to sanitize (requires --out-mbox or --out-dir)",
+    )
+    source.add_argument(
+        "--maildir",
+        help="Path to a Maildir to sanitize (requires --out-mbox or --out-dir)",
+    )
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument(
+        "--out-mbox",
+        help="Write sanitized messages from --mbox/--maildir to this mbox file",
+    )
+    output.add_argument(
+        "--out-dir",
+        help="Write sanitized messages from --mbox/--maildir as .eml files here",
     )
     parser.add_argument(
         "--block-words",
         help="Comma-separated list of words to replace with random animal words",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes to sanitize files in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for blocked word replacement; makes output reproducible",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            f"With --dir, skip files unchanged since the last run (tracked in "
+            f"{MANIFEST_NAME})"
+        ),
+    )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.dir and (args.out_mbox or args.out_dir):
+        parser.error(
+            "--dir sanitizes files in place; --out-mbox/--out-dir apply to archives"
+        )
+    if not args.dir and not (args.out_mbox or args.out_dir):
+        parser.error("--mbox and --maildir require --out-mbox or --out-dir")
+    if args.incremental and not args.dir:
+        parser.error("--incremental only applies to --dir")
 
     # Parse blocked words from comma-separated string
     blocked_words = []
@@ -298,12 +714,30 @@ def main():
         blocked_words = [word.strip() for word in args.block_words.split(",")]
 
     print("Starting email sanitization process...")
-    print(f"Target directory: {args.dir}")
+    print(f"Source: {args.dir or args.mbox or args.maildir}")
     if blocked_words:
         print(f"Blocked words to replace: {', '.join(blocked_words)}")
+    if args.jobs > 1:
+        print(f"Worker processes: {args.jobs}")
     print("-" * 60)
 
-    process_eml_files(args.dir, blocked_words)
+    if args.dir:
+        process_eml_files(
+            args.dir,
+            blocked_words,
+            jobs=args.jobs,
+            seed=args.seed,
+            incremental=args.incremental,
+        )
+    else:
+        messages = iter_mbox(args.mbox) if args.mbox else iter_maildir(args.maildir)
+        sink = MboxSink(args.out_mbox) if args.out_mbox else DirectorySink(args.out_dir)
+        try:
+            process_messages(
+                messages, sink, blocked_words, jobs=args.jobs, seed=args.seed
+            )
+        finally:
+            sink.close()
 
     print("-" * 60)
     print("Email sanitization process completed!")
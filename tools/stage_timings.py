@@ -0,0 +1,192 @@
+"""
+Per-stage latency percentiles from edge function logs.
+
+inbound-email, reprocess-unprocessed and ingest-worker write one
+``stage_timings`` log line per request (``_shared/timing.ts``), with the
+duration of every span of the request by stage: alias lookup, open tasks,
+model call and so on. This script reads exported function logs and reports,
+for each function, the percentiles of each stage and its share of the total
+request time, so the round trips that dominate stand out.
+
+Logs can be plain text with one line per entry, or the JSON (an array or one
+object per line) exported from the Supabase log explorer, where the line is
+in ``event_message``.
+
+Usage:
+    python -m tools.stage_timings logs.json
+    supabase functions logs inbound-email | python -m tools.stage_timings --out timings.json
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Iterable, Iterator, TextIO
+
+from tools.load_inbound import PERCENTILES, LatencyHistogram
+
+# Mirrors STAGE_TIMINGS_EVENT in _shared/timing.ts
+STAGE_TIMINGS_EVENT = "stage_timings"
+TIMINGS_RE = re.compile(rf"\b{STAGE_TIMINGS_EVENT} (\{{.*\}})\s*$")
+
+MESSAGE_FIELDS = ("event_message", "message", "msg")
+
+
+def _messages(entry) -> Iterator[str]:
+    """Yield the log messages in a parsed JSON log export."""
+    if isinstance(entry, list):
+        for item in entry:
+            yield from _messages(item)
+    elif isinstance(entry, dict):
+        for field in MESSAGE_FIELDS:
+            if isinstance(entry.get(field), str):
+                yield entry[field]
+                return
+
+
+def iter_log_messages(stream: TextIO) -> Iterator[str]:
+    """Yield log messages from a text or JSON log export."""
+    text = stream.read()
+    if text.lstrip().startswith("["):
+        try:
+            yield from _messages(json.loads(text))
+            return
+        except json.JSONDecodeError:
+            pass
+    for line in text.splitlines():
+        if line.lstrip().startswith("{"):
+            try:
+                yield from _messages(json.loads(line))
+                continue
+            except json.JSONDecodeError:
+                pass
+        yield line
+
+
+def parse_timings(messages: Iterable[str]) -> Iterator[dict]:
+    """Yield the timings of each request logged in messages."""
+    for message in messages:
+        for line in message.splitlines():
+            match = TIMINGS_RE.search(line)
+            if not match:
+                continue
+            try:
+                timings = json.loads(match.group(1))
+            except json.JSONDecodeError:
+                continue
+            if isinstance(timings, dict) and isinstance(timings.get("stages"), dict):
+                yield timings
+
+
+def build_report(timings: Iterable[dict]) -> dict:
+    """Aggregate request timings into per-function, per-stage percentiles."""
+    totals = defaultdict(LatencyHistogram)
+    statuses = defaultdict(Counter)
+    stages = defaultdict(lambda: defaultdict(LatencyHistogram))
+    stage_ms = defaultdict(Counter)
+    stage_requests = defaultdict(Counter)
+    total_ms = Counter()
+
+    for entry in timings:
+        fn = entry.get("function", "unknown")
+        totals[fn].record(entry.get("total_ms", 0) / 1000)
+        total_ms[fn] += entry.get("total_ms", 0)
+        statuses[fn][str(entry.get("status"))] += 1
+        for stage, durations in entry["stages"].items():
+            stage_requests[fn][stage] += 1
+            for duration in durations:
+                stages[fn][stage].record(duration / 1000)
+                stage_ms[fn][stage] += duration
+
+    report = {}
+    for fn in sorted(totals):
+        report[fn] = {
+            "requests": totals[fn].count,
+            "status_codes": dict(statuses[fn]),
+            "total": totals[fn].to_dict(),
+            "stages": [
+                {
+                    "stage": stage,
+                    "requests": stage_requests[fn][stage],
+                    "spans": stages[fn][stage].count,
+                    "total_ms": round(ms, 1),
+                    # Background stages can run past the response, so the
+                    # shares may add up to more than 100%
+                    "share": ms / total_ms[fn] if total_ms[fn] else 0,
+                    **stages[fn][stage].to_dict(),
+                }
+                for stage, ms in stage_ms[fn].most_common()
+            ],
+        }
+    return report
+
+
+def _ms(micros: int) -> str:
+    return f"{micros / 1000:.1f}"
+
+
+def print_report(report: dict) -> None:
+    columns = [f"p{percent:g}" for percent in PERCENTILES] + ["max"]
+    for fn, summary in report.items():
+        total = summary["total"]
+        print(
+            f"{fn}: {summary['requests']} requests {summary['status_codes']}, "
+            f"total p50 {_ms(total['percentiles']['p50'])}ms "
+            f"p99 {_ms(total['percentiles']['p99'])}ms"
+        )
+        print(
+            f"  {'stage':20} {'spans':>7} {'share':>6} "
+            + " ".join(f"{c:>9}" for c in columns)
+            + "  (ms)"
+        )
+        for stage in summary["stages"]:
+            values = [stage["percentiles"][c] for c in columns[:-1]] + [stage["max"]]
+            print(
+                f"  {stage['stage'][:20]:20} {stage['spans']:>7} {stage['share']:>6.0%} "
+                + " ".join(f"{_ms(v):>9}" for v in values)
+            )
+        print()
+
+
+def main():
+    """Aggregate stage timings from log files or stdin and print the report."""
+    parser = argparse.ArgumentParser(
+        description="Per-stage latency percentiles from edge function logs"
+    )
+    parser.add_argument(
+        "logs", nargs="*", help="Log files to read (default: standard input)"
+    )
+    parser.add_argument(
+        "--function",
+        action="append",
+        help="Only report this function; repeat for several",
+    )
+    parser.add_argument("--out", help="Write the JSON report with histograms here")
+    args = parser.parse_args()
+
+    def messages() -> Iterator[str]:
+        if not args.logs:
+            yield from iter_log_messages(sys.stdin)
+        for path in args.logs:
+            with open(path, encoding="utf-8") as f:
+                yield from iter_log_messages(f)
+
+    timings = parse_timings(messages())
+    if args.function:
+        timings = (t for t in timings if t.get("function") in args.function)
+    report = build_report(timings)
+    if not report:
+        print("No stage_timings lines found", file=sys.stderr)
+        sys.exit(1)
+
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
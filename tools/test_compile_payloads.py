@@ -0,0 +1,70 @@
+"""
+Tests for compiling an email corpus into an NDJSON payload file.
+"""
+
+import shutil
+from pathlib import Path
+
+from tools.compile_payloads import compile_payloads
+from tools.mail_sources import iter_eml_dir
+from tools.send_to_supabase import (
+    build_payload,
+    iter_compiled,
+    read_email_file,
+    with_alias,
+)
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+
+def test_compiled_payloads_match_build_payload(tmp_path):
+    """Test that compiled payloads plus an alias equal freshly built ones."""
+    output = tmp_path / "payloads.ndjson"
+
+    counts = compile_payloads(iter_eml_dir(EMAIL_DATA_DIR), output)
+
+    eml_files = sorted(EMAIL_DATA_DIR.glob("*.eml"), key=lambda p: p.name)
+    assert counts == (len(eml_files), 0, 0)
+    entries = list(iter_compiled(output))
+    assert [name for name, _ in entries] == [path.name for path in eml_files]
+    for (_, payload), path in zip(entries, eml_files):
+        expected = build_payload(read_email_file(str(path)), "test@example.com")
+        assert with_alias(payload, "test@example.com") == expected
+
+
+def test_compile_payloads_rebuilds_only_changed_sources(tmp_path):
+    """Test that unchanged sources are copied from the previous output."""
+    email_dir = tmp_path / "emails"
+    shutil.copytree(EMAIL_DATA_DIR, email_dir)
+    output = tmp_path / "payloads.ndjson"
+    total = len(list(email_dir.glob("*.eml")))
+    compile_payloads(iter_eml_dir(email_dir), output)
+
+    assert compile_payloads(iter_eml_dir(email_dir), output) == (0, total, 0)
+
+    edited = sorted(email_dir.glob("*.eml"))[0]
+    edited.write_bytes(
+        edited.read_bytes().replace(b"Subject: ", b"Subject: Updated ", 1)
+    )
+    assert compile_payloads(iter_eml_dir(email_dir), output) == (1, total - 1, 0)
+    subjects = {name: payload["Subject"] for name, payload in iter_compiled(output)}
+    assert subjects[edited.name].startswith("Updated ")
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_compile_payloads_skips_corrupt_messages(tmp_path, capsys):
+    """Test that a message that fails to parse is reported and skipped."""
+    good = sorted(EMAIL_DATA_DIR.glob("*.eml"))[:2]
+    # A non-ASCII MIME boundary cannot be parsed
+    corrupt = b'Content-Type: multipart/mixed; boundary="b\xff"\n\n--b\xff\n'
+    messages = [
+        (good[0].name, good[0].read_bytes()),
+        ("corrupt.eml", corrupt),
+        (good[1].name, good[1].read_bytes()),
+    ]
+    output = tmp_path / "payloads.ndjson"
+
+    assert compile_payloads(messages, output) == (2, 0, 1)
+
+    assert [name for name, _ in iter_compiled(output)] == [p.name for p in good]
+    assert "Skipping corrupt.eml" in capsys.readouterr().err
@@ -0,0 +1,116 @@
+"""
+Tests for the local chat-completions stand-in.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+import requests
+
+from tools.fake_openai import FakeOpenAIOptions, FakeOpenAIServer, parse_latency
+from tools.send_to_supabase import build_payload, read_email_file
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+TASK_FIELDS = {
+    "title",
+    "description",
+    "due_date",
+    "parent_action",
+    "parent_requirement_level",
+    "student_action",
+    "student_requirement_level",
+}
+REQUIREMENT_LEVELS = {"NONE", "OPTIONAL", "VOLUNTEER", "MANDATORY"}
+
+
+@contextmanager
+def _serve(**options):
+    server = FakeOpenAIServer(("127.0.0.1", 0), FakeOpenAIOptions(**options))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _request_body():
+    path = sorted(EMAIL_DATA_DIR.glob("*.eml"))[0]
+    email_text = build_payload(read_email_file(str(path)), "")["HtmlBody"]
+    return {
+        "model": "gpt-test",
+        "messages": [
+            {"role": "system", "content": "Extract tasks"},
+            {
+                "role": "user",
+                "content": f'Existing tasks:\n{{"tasks":[]}}\n\nEmail:\n{email_text}',
+            },
+        ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "tasks_list", "schema": {}},
+        },
+    }
+
+
+def _post(url, body):
+    return requests.post(url, json=body, headers={"Authorization": "Bearer k"})
+
+
+def test_fake_openai_returns_schema_valid_tasks_and_usage():
+    """Test the response shape, task fields and token counts."""
+    with _serve(seed=1) as url:
+        resp = _post(url, _request_body())
+
+    assert resp.status_code == 200
+    data = resp.json()
+    content = data["choices"][0]["message"]["content"]
+    tasks = json.loads(content)["tasks"]
+    assert tasks
+    for task in tasks:
+        assert set(task) <= TASK_FIELDS
+        assert 0 < len(task["title"]) < 30
+        assert task["parent_requirement_level"] in REQUIREMENT_LEVELS
+        assert task["student_requirement_level"] in REQUIREMENT_LEVELS
+    usage = data["usage"]
+    assert usage["prompt_tokens"] > 100
+    assert usage["completion_tokens"] >= len(content) // 4
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+def test_fake_openai_is_deterministic_per_seed():
+    """Test that the same seed and request sequence give the same responses."""
+    body = _request_body()
+    with _serve(seed=3) as url:
+        first = [_post(url, body).json()["choices"] for _ in range(2)]
+    with _serve(seed=3) as url:
+        second = [_post(url, body).json()["choices"] for _ in range(2)]
+
+    assert first == second
+
+
+def test_fake_openai_injects_rate_limits_and_latency():
+    """Test 429 injection and the configured latency."""
+    with _serve(rate_limit_rate=1.0) as url:
+        resp = _post(url, _request_body())
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "1"
+    assert resp.json()["error"]["type"] == "rate_limit_exceeded"
+
+    with _serve(latency="constant:100") as url:
+        started = time.perf_counter()
+        assert _post(url, _request_body()).status_code == 200
+    assert time.perf_counter() - started >= 0.1
+
+
+def test_parse_latency_rejects_unknown_specs():
+    """Test latency spec parsing."""
+    assert parse_latency("constant:250")(None) == 0.25
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1,2")
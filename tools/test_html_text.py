@@ -0,0 +1,56 @@
+"""
+Tests for HTML-to-text extraction.
+"""
+
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from tools.html_text import LexborHTMLParser, _html_bodies, html_to_text
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+BACKENDS = [
+    "html.parser",
+    pytest.param(
+        "selectolax",
+        marks=pytest.mark.skipif(
+            LexborHTMLParser is None, reason="selectolax is not installed"
+        ),
+    ),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_html_to_text_blocks_and_whitespace(backend):
+    """Test that blocks become lines, inline text joins and scripts are dropped."""
+    html = (
+        "<html><head><style>p { color: red; }</style></head><body>"
+        "<p>Picture   day is <b>Friday</b>&nbsp;at 9.</p>"
+        "<script>var x = 1;</script><!-- hidden -->"
+        "<table><tr><td>Bring</td><td>a  lunch</td></tr></table>"
+        "Line one<br>Line two</body></html>"
+    )
+
+    assert html_to_text(html, backend) == (
+        "Picture day is Friday at 9.\nBring\na lunch\nLine one\nLine two"
+    )
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_html_to_text_matches_beautifulsoup_on_corpus(backend):
+    """Test parity with the previous BeautifulSoup get_text output.
+
+    Line breaks differ by design (inline elements no longer split lines), so
+    the comparison is on the text with all whitespace removed.
+    """
+    bodies = _html_bodies(EMAIL_DATA_DIR)
+    assert bodies
+
+    for body in bodies:
+        expected = BeautifulSoup(body, "html.parser").get_text(
+            separator="\n", strip=True
+        )
+        actual = html_to_text(body, backend)
+        assert "".join(actual.split()) == "".join(expected.split())
@@ -0,0 +1,101 @@
+"""
+Tests for the open-loop inbound-email load generator.
+"""
+
+import random
+from collections import Counter
+from pathlib import Path
+
+from tools.load_inbound import LatencyHistogram, plan_requests, run_load
+from tools.send_to_supabase import build_payload, make_session, read_email_file
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+
+def _payloads():
+    return [
+        build_payload(read_email_file(str(path)), alias="")
+        for path in sorted(EMAIL_DATA_DIR.glob("*.eml"))
+    ]
+
+
+def test_latency_histogram_percentiles():
+    """Test that percentiles are accurate to the histogram's 1% precision."""
+    histogram = LatencyHistogram()
+    for millis in range(1, 1001):
+        histogram.record(millis / 1000)
+
+    summary = histogram.to_dict()
+    assert summary["count"] == 1000
+    assert summary["min"] == 1000
+    assert summary["max"] == 1_000_000
+    assert abs(summary["percentiles"]["p50"] - 500_000) <= 5_000
+    assert abs(summary["percentiles"]["p99"] - 990_000) <= 9_900
+    assert sum(count for _, count in summary["buckets"]) == 1000
+
+
+def test_plan_requests_mixes_aliases_and_duplicates():
+    """Test the alias weights and duplicate Message-ID proportion."""
+    planned = list(
+        plan_requests(
+            _payloads(),
+            2000,
+            [("a@example.com", 3), ("b@example.com", 1)],
+            0.2,
+            random.Random(1),
+            "test",
+        )
+    )
+
+    kinds = Counter(kind for kind, _ in planned)
+    assert 350 < kinds["duplicate"] < 450
+    unique_ids = [p["MessageID"] for kind, p in planned if kind == "unique"]
+    assert len(unique_ids) == len(set(unique_ids))
+    assert all(
+        p["MessageID"] in set(unique_ids) for kind, p in planned if kind == "duplicate"
+    )
+    aliases = Counter(p["Bcc"] for kind, p in planned if kind == "unique")
+    assert 2.5 < aliases["a@example.com"] / aliases["b@example.com"] < 3.5
+    headers = {h["Name"].lower(): h["Value"] for h in planned[0][1]["Headers"]}
+    assert headers["message-id"] == planned[0][1]["MessageID"]
+
+
+def test_plan_requests_duplicates_recent_requests():
+    """Test that duplicates only re-send requests within the window."""
+    planned = list(
+        plan_requests(
+            _payloads(),
+            500,
+            [("a@example.com", 1)],
+            0.5,
+            random.Random(2),
+            "test",
+            duplicate_window=10,
+        )
+    )
+
+    unique_ids = []
+    for kind, payload in planned:
+        if kind == "unique":
+            unique_ids.append(payload["MessageID"])
+        else:
+            assert payload["MessageID"] in unique_ids[-10:]
+
+
+def test_run_load_reports_status_codes_and_latency(inbound_server):
+    """Test a short open-loop run against the stand-in function."""
+    url, received = inbound_server
+    planned = plan_requests(
+        _payloads(), 40, [("a@example.com", 1)], 0.0, random.Random(1), "test"
+    )
+
+    with make_session("user", "password", concurrency=8) as session:
+        report = run_load(session, url, planned, rate=200, max_in_flight=8)
+
+    assert report["requests"] == len(received) == 40
+    assert sum(report["status_codes"].values()) == 40
+    assert report["status_codes"]["200"] > 0
+    assert report["kinds"] == {"unique": 40}
+    assert report["response_time"]["count"] == 40
+    assert report["response_time"]["max"] >= report["service_time"]["min"]
+    assert report["elapsed_s"] >= 39 / 200
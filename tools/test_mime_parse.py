@@ -0,0 +1,101 @@
+"""
+Tests for the bounded-memory MIME parser.
+"""
+
+import email
+import tracemalloc
+from email.mime.application import MIMEApplication
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from tools.mime_parse import parse_text_file, parse_text_parts
+
+
+def _message_with_attachment(attachment: bytes) -> MIMEMultipart:
+    msg = MIMEMultipart("mixed")
+    msg["From"] = "school@example.com"
+    msg["Subject"] = "Flyer attached"
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText("Picture day is Friday.", "plain"))
+    body.attach(MIMEText("<p>Picture day is <b>Friday</b>.</p>", "html"))
+    msg.attach(body)
+    pdf = MIMEApplication(attachment, "pdf")
+    pdf.add_header("Content-Disposition", "attachment", filename="flyer.pdf")
+    msg.attach(pdf)
+    return msg
+
+
+def test_parse_text_parts_keeps_text_and_drops_attachment_bodies():
+    """Test that text parts survive and attachments keep only their headers."""
+    raw = _message_with_attachment(b"%PDF-1.4" * 1000).as_bytes()
+
+    msg = parse_text_parts(raw)
+
+    assert msg["Subject"] == "Flyer attached"
+    parts = [part for part in msg.walk() if not part.is_multipart()]
+    assert [part.get_content_type() for part in parts] == [
+        "text/plain",
+        "text/html",
+        "application/pdf",
+    ]
+    assert parts[0].get_payload(decode=True) == b"Picture day is Friday."
+    assert b"<b>Friday</b>" in parts[1].get_payload(decode=True)
+    assert parts[2].get_filename() == "flyer.pdf"
+    assert parts[2].get_payload() == ""
+
+
+def test_parse_text_parts_matches_stdlib_for_text():
+    """Test that text payloads match email.message_from_bytes, CRLF included."""
+    raw = _message_with_attachment(b"data").as_bytes().replace(b"\n", b"\r\n")
+
+    expected = email.message_from_bytes(raw.replace(b"\r\n", b"\n"))
+    actual = parse_text_parts(raw)
+
+    def text_payloads(msg):
+        return [
+            part.get_payload(decode=True)
+            for part in msg.walk()
+            if part.get_content_type() in ("text/plain", "text/html")
+        ]
+
+    assert text_payloads(actual) == text_payloads(expected)
+
+
+def test_parse_text_parts_reads_forwarded_messages():
+    """Test that text inside an attached message/rfc822 part is kept."""
+    inner = MIMEMultipart("mixed")
+    inner["Subject"] = "Original"
+    inner.attach(MIMEText("Bring a water bottle.", "plain"))
+    inner.attach(MIMEApplication(b"\x89PNG" * 100, "png"))
+    outer = MIMEMultipart("mixed")
+    outer["Subject"] = "Fwd: Original"
+    outer.attach(MIMEText("See below.", "plain"))
+    outer.attach(MIMEMessage(inner))
+
+    msg = parse_text_parts(outer.as_bytes())
+
+    texts = [
+        part.get_payload(decode=True)
+        for part in msg.walk()
+        if part.get_content_type() == "text/plain"
+    ]
+    assert texts == [b"See below.", b"Bring a water bottle."]
+    forwarded = [p for p in msg.walk() if p.get_content_type() == "message/rfc822"]
+    assert forwarded[0].get_payload(0)["Subject"] == "Original"
+
+
+def test_parse_text_file_memory_does_not_track_attachment_size(tmp_path):
+    """Test that a large attachment is streamed past instead of buffered."""
+    eml_file = tmp_path / "flyer.eml"
+    eml_file.write_bytes(_message_with_attachment(b"\0" * (8 * 1024 * 1024)).as_bytes())
+
+    tracemalloc.start()
+    try:
+        msg = parse_text_file(eml_file)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert msg.get_payload(1).get_payload() == ""
+    assert peak < 1024 * 1024
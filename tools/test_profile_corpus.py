@@ -0,0 +1,98 @@
+"""
+Tests for the corpus token-and-cost profiler.
+"""
+
+from pathlib import Path
+
+from tools.mail_sources import iter_eml_dir
+from tools.profile_corpus import (
+    DEFAULT_CONFIG,
+    TableTokenizer,
+    build_report,
+    choose_email_text,
+    load_task_schema,
+    open_tasks_context,
+    profile_messages,
+)
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+
+def test_load_task_schema_reads_the_typescript_literal():
+    """Test that TASK_SCHEMA is converted to the JSON sent to the API."""
+    schema = load_task_schema()
+    assert schema["name"] == "tasks_list"
+    item = schema["schema"]["properties"]["tasks"]["items"]
+    assert item["additionalProperties"] is False
+    assert "title" in item["properties"]
+    assert "PAY" in item["properties"]["parent_action"]["enum"]
+    assert "Examples: 'Permission form'" in item["properties"]["title"]["description"]
+
+
+def test_choose_email_text_mirrors_the_30_percent_rule():
+    """Test the same text/HTML choice as chooseEmailText."""
+    html = "<p>" + "x" * 93 + "</p>"  # 100 characters
+    assert choose_email_text({"TextBody": "y" * 30, "HtmlBody": html}) == (
+        "text",
+        "y" * 30,
+    )
+    assert choose_email_text({"TextBody": "y" * 29, "HtmlBody": html})[0] == "html"
+    assert choose_email_text({"TextBody": None, "HtmlBody": None}) == ("empty", "")
+
+
+def test_table_tokenizer_counts_words_numbers_and_punctuation():
+    """Test the table's counts on pieces with known sizes."""
+    tokenizer = TableTokenizer()
+    assert tokenizer.count("Picture day is Friday") == 4
+    assert tokenizer.count("2025") == 2
+    assert tokenizer.count("extraordinarily") == 3
+    assert tokenizer.count("") == 0
+    assert tokenizer.count(" word" * 100) == 100
+
+
+def test_open_tasks_context_respects_the_token_budget():
+    """Test that the assumed open tasks are trimmed like selectTasksForPrompt."""
+    assert len(open_tasks_context(5, 2000)) == 5
+    assert 0 < len(open_tasks_context(500, 2000)) < 500
+
+
+def test_build_report_groups_domains_and_flags_outliers():
+    """Test per-domain distributions, costs and outlier detection."""
+    profiles = [
+        {"name": f"n{i}", "domain": "school.org", "body": "html", "email_tokens": 100}
+        for i in range(20)
+    ]
+    profiles.append(
+        {"name": "big", "domain": "school.org", "body": "html", "email_tokens": 5000}
+    )
+    profiles.append(
+        {"name": "pta", "domain": "pta.org", "body": "text", "email_tokens": 50}
+    )
+    profiles.append({"name": "bad", "error": "boom"})
+
+    report = build_report(profiles, 1000, DEFAULT_CONFIG, output_tokens=100)
+
+    assert report["emails"] == 22
+    assert report["bodies"] == {"html": 21, "text": 1}
+    assert [e["name"] for e in report["errors"]] == ["bad"]
+    assert report["domains"][0]["domain"] == "school.org"
+    assert report["domains"][0]["p50"] == 1100
+    assert [o["name"] for o in report["outliers"]] == ["big"]
+    expected_nano = (
+        report["input_tokens_total"] * 400 + 22 * 100 * 1600
+    )  # seeded per-token costs
+    assert abs(report["cost_usd"] - expected_nano / 1e9) < 1e-9
+
+
+def test_profile_messages_is_the_same_with_worker_processes():
+    """Test that a process pool returns the same profiles in input order."""
+    messages = list(iter_eml_dir(EMAIL_DATA_DIR))
+    serial = list(profile_messages(messages, "gpt-4.1-mini", jobs=1))
+    parallel = list(profile_messages(messages, "gpt-4.1-mini", jobs=2, batch_size=3))
+    assert serial == parallel
+    assert len(serial) == len(messages)
+    assert all(p["email_tokens"] > 0 for p in serial if p["body"] != "empty")
+    compact = list(profile_messages(messages, "gpt-4.1-mini", compact=True))
+    assert sum(p["email_tokens"] for p in compact) < sum(
+        p["email_tokens"] for p in serial
+    )
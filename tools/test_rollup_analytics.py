@@ -0,0 +1,145 @@
+"""
+Tests for the incremental analytics rollup.
+"""
+
+from datetime import date
+
+import pytest
+
+from tools.rollup_analytics import day_ranges, run_rollup
+
+
+class FakeCursor:
+    """Answers the rollup's queries from an in-memory events table."""
+
+    def __init__(self, db):
+        self.db = db
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        db = self.db
+        if db.aborted:
+            raise RuntimeError("current transaction is aborted")
+        if "pg_try_advisory_lock" in sql:
+            self._result = [(not db.locked,)]
+        elif "pg_inherits" in sql:
+            self._result = [(name,) for name in sorted(db.partitions)]
+        elif "from analytics.rollup_watermarks" in sql:
+            name = params[0]
+            found = name in db.watermarks
+            self._result = [(db.watermarks[name],)] if found else []
+        elif "coalesce(" in sql:
+            events = self._events(sql, params["after"])
+            settling = [i for i, _, young in events if young]
+            ids = [i for i, _, _ in events]
+            upto = min(settling) - 1 if settling else max(ids, default=None)
+            self._result = [(upto,)]
+        elif "distinct occurred_date" in sql:
+            events = self._events(sql, params["after"])
+            days = {d for i, d, _ in events if i <= params["upto"]}
+            self._result = [(d,) for d in sorted(days)]
+        elif "pg_advisory_unlock" in sql:
+            db.unlocks += 1
+        elif "recompute_user_daily_metrics" in sql:
+            if db.fail_recompute:
+                db.aborted = True
+                raise RuntimeError("recompute failed")
+            db.recomputed.append(params)
+        elif "insert into analytics.rollup_watermarks" in sql:
+            db.watermarks[params[0]] = params[1]
+
+    def _events(self, sql, after):
+        name = next(p for p in self.db.partitions if f'"{p}"' in sql)
+        return [e for e in self.db.partitions[name] if e[0] > after]
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConnection:
+    def __init__(self, partitions):
+        # partition name -> [(id, occurred_date, still settling)]
+        self.partitions = partitions
+        self.watermarks = {}
+        self.recomputed = []
+        self.locked = False
+        self.unlocks = 0
+        self.fail_recompute = False
+        self.aborted = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.aborted = False
+
+
+def test_day_ranges_merges_consecutive_days():
+    """Test that consecutive days are recomputed as one range."""
+    days = [date(2025, 9, 3), date(2025, 9, 1), date(2025, 9, 2), date(2025, 9, 5)]
+    assert day_ranges(days) == [
+        (date(2025, 9, 1), date(2025, 9, 3)),
+        (date(2025, 9, 5), date(2025, 9, 5)),
+    ]
+    assert day_ranges([]) == []
+
+
+def test_run_rollup_only_recomputes_days_with_new_events():
+    """Test watermarks, late-arriving events and settling events."""
+    sep1, sep2, sep3 = date(2025, 9, 1), date(2025, 9, 2), date(2025, 9, 3)
+    conn = FakeConnection(
+        {
+            "events_202509": [(1, sep1, False), (2, sep2, False)],
+            "events_default": [],
+        }
+    )
+
+    assert run_rollup(conn) == {"events_202509": [sep1, sep2], "events_default": []}
+    assert conn.recomputed == [(sep1, sep2)]
+    assert conn.watermarks == {"events_202509": 2}
+
+    # Nothing new: no recompute
+    conn.recomputed.clear()
+    assert run_rollup(conn) == {"events_202509": [], "events_default": []}
+    assert conn.recomputed == []
+
+    # A late event for Sep 1 and a new one for Sep 3 that is still settling
+    conn.partitions["events_202509"] += [(3, sep1, False), (4, sep3, True)]
+    assert run_rollup(conn)["events_202509"] == [sep1]
+    assert conn.recomputed == [(sep1, sep1)]
+    assert conn.watermarks["events_202509"] == 3
+
+    # Once settled, only Sep 3 is recomputed
+    conn.partitions["events_202509"][3] = (4, sep3, False)
+    conn.recomputed.clear()
+    assert run_rollup(conn)["events_202509"] == [sep3]
+    assert conn.recomputed == [(sep3, sep3)]
+
+
+def test_run_rollup_skips_when_another_run_holds_the_lock():
+    """Test that concurrent runs do not both roll up."""
+    conn = FakeConnection({"events_default": [(1, date(2025, 9, 1), False)]})
+    conn.locked = True
+    assert run_rollup(conn) is None
+    assert conn.recomputed == []
+
+
+def test_run_rollup_unlocks_and_reraises_after_a_failure():
+    """Test that a failed recompute is reported and the lock released."""
+    conn = FakeConnection({"events_default": [(1, date(2025, 9, 1), False)]})
+    conn.fail_recompute = True
+    with pytest.raises(RuntimeError, match="recompute failed"):
+        run_rollup(conn)
+    assert conn.unlocks == 1
@@ -5,14 +5,25 @@ Tests for the sanitize_emails.py functionality.
 
 import base64
 import email
+import random
+import re
+import shutil
+from pathlib import Path
 
+from tools.mail_sources import MboxSink, iter_eml_dir, iter_mbox
 from tools.sanitize_emails import (
+    MANIFEST_NAME,
+    Scrubber,
+    process_eml_files,
+    process_messages,
     replace_blocked_words,
     replace_email_addresses,
     replace_http_links,
     sanitize_email,
 )
 
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
 
 def test_replace_email_addresses():
     """Test that email addresses are properly replaced."""
@@ -189,6 +200,115 @@ Your password is secret123. Please keep this confidential.
     assert "admin@example.com" not in result
 
 
+def test_scrubber_replaces_everything_in_one_pass():
+    """Test that the fused scrubber replaces emails, links and blocked words."""
+    scrubber = Scrubber(["secret", "secrets", "Top Secret"])
+    text = (
+        "Mail admin@test.org about the SECRETS at https://example.com/a?b=c, "
+        "keep it top secret; secretive is fine."
+    )
+    result = scrubber.scrub(text)
+
+    assert "someone@somewhere.com" in result
+    assert "https://a_link" in result
+    assert "admin@test.org" not in result
+    assert "example.com" not in result
+    assert "secrets" not in result.lower()
+    assert "top secret" not in result.lower()
+    assert "secretive is fine." in result
+
+
+def test_scrubber_is_deterministic_with_seeded_rng():
+    """Test that a seeded generator gives the same replacements each time."""
+    scrubber = Scrubber(["alpha", "beta"])
+    text = "alpha beta Alpha BETA"
+    first = scrubber.scrub(text, random.Random(3))
+    second = scrubber.scrub(text, random.Random(3))
+
+    assert first == second
+    # Each blocked word maps to a single animal within one call
+    words = first.split()
+    assert words[0] == words[2]
+    assert words[1] == words[3]
+
+
+def test_process_eml_files_parallel_matches_serial(tmp_path):
+    """Test that --jobs output is byte-identical to the serial path for a seed."""
+    serial_dir = tmp_path / "serial"
+    parallel_dir = tmp_path / "parallel"
+    shutil.copytree(EMAIL_DATA_DIR, serial_dir)
+    shutil.copytree(EMAIL_DATA_DIR, parallel_dir)
+    blocked_words = ["school", "parents", "students"]
+
+    serial = process_eml_files(str(serial_dir), blocked_words, jobs=1, seed=7)
+    parallel = process_eml_files(str(parallel_dir), blocked_words, jobs=4, seed=7)
+
+    assert serial == parallel
+    assert serial[0] == len(list(EMAIL_DATA_DIR.glob("*.eml")))
+    for serial_file in sorted(serial_dir.glob("*.eml")):
+        parallel_file = parallel_dir / serial_file.name
+        assert serial_file.read_bytes() == parallel_file.read_bytes()
+
+
+def test_process_eml_files_incremental_skips_unchanged(tmp_path):
+    """Test that --incremental only reprocesses changed files or settings."""
+    email_dir = tmp_path / "emails"
+    shutil.copytree(EMAIL_DATA_DIR, email_dir)
+    total = len(list(email_dir.glob("*.eml")))
+
+    first = process_eml_files(str(email_dir), ["school"], seed=1, incremental=True)
+    assert first == (total, [])
+    assert (email_dir / MANIFEST_NAME).exists()
+    assert not list(email_dir.glob("*.tmp"))
+
+    # Nothing changed, so nothing is reprocessed
+    assert process_eml_files(str(email_dir), ["school"], seed=1, incremental=True) == (
+        0,
+        [],
+    )
+
+    # Only the edited file is reprocessed
+    edited = sorted(email_dir.glob("*.eml"))[0]
+    edited.write_text(edited.read_text() + "\nMore text from the school.\n")
+    assert process_eml_files(str(email_dir), ["school"], seed=1, incremental=True) == (
+        1,
+        [],
+    )
+    assert "from the school" not in edited.read_text()
+
+    # Changing the block list invalidates the whole manifest
+    assert process_eml_files(
+        str(email_dir), ["school", "parents"], seed=1, incremental=True
+    ) == (total, [])
+
+
+def test_process_messages_streams_mbox_to_mbox(tmp_path):
+    """Test that an mbox archive is sanitized message by message into a new mbox."""
+    source_path = tmp_path / "source.mbox"
+    output_path = tmp_path / "sanitized.mbox"
+    source = MboxSink(source_path)
+    for name, raw in iter_eml_dir(EMAIL_DATA_DIR):
+        source.write(name, raw)
+    source.close()
+
+    sink = MboxSink(output_path)
+    succeeded, errors = process_messages(
+        iter_mbox(source_path), sink, ["school"], jobs=2, seed=7
+    )
+    sink.close()
+
+    originals = list(iter_mbox(source_path))
+    sanitized = list(iter_mbox(output_path))
+    assert errors == []
+    assert succeeded == len(originals) == len(sanitized)
+    for (_, original), (_, result) in zip(originals, sanitized):
+        original_msg = email.message_from_bytes(original)
+        result_msg = email.message_from_bytes(result)
+        assert result_msg["Subject"] is not None
+        assert result_msg["Date"] == original_msg["Date"]
+        assert re.search(r"\bschool\b", result.decode("utf-8"), re.I) is None
+
+
 if __name__ == "__main__":
     # Run tests without pytest
     test_replace_email_addresses()
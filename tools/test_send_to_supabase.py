@@ -0,0 +1,97 @@
+"""
+Tests for send_to_supabase batch submission against a local HTTP server.
+
+The ``inbound_server`` fixture is defined in conftest.py.
+"""
+
+import argparse
+from pathlib import Path
+
+from tools.send_to_supabase import (
+    _iter_payloads,
+    build_payload,
+    make_session,
+    read_email_file,
+    submit_by_alias,
+    submit_payloads,
+)
+
+EMAIL_DATA_DIR = Path(__file__).parent.parent / "test_integration" / "email_data"
+
+
+def _payloads():
+    for path in sorted(EMAIL_DATA_DIR.glob("*.eml"), key=lambda p: p.name):
+        yield path.name, build_payload(read_email_file(str(path)), "test@example.com")
+
+
+def test_submit_payloads_ordered_reports_failures(inbound_server, capsys):
+    """Test that --ordered submits in input order and collects non-2xx replies."""
+    url, received = inbound_server
+    with make_session("user", "password", concurrency=4) as session:
+        total, failures = submit_payloads(
+            session, url, _payloads(), ordered=True, quiet=True
+        )
+
+    expected = [payload["Subject"] for _, payload in _payloads()]
+    assert total == len(expected)
+    assert [body["Subject"] for body, _ in received] == expected
+    assert all(auth and auth.startswith("Basic ") for _, auth in received)
+    assert [name for name, _, _ in failures] == ["2025-08-05 Welcome.eml"]
+    assert failures[0][1] == 500
+    assert "✗ 500 2025-08-05 Welcome.eml" in capsys.readouterr().out
+
+
+def test_submit_payloads_concurrently(inbound_server):
+    """Test that concurrent submission sends every message exactly once."""
+    url, received = inbound_server
+    with make_session("user", "password", concurrency=4) as session:
+        total, failures = submit_payloads(
+            session, url, _payloads(), concurrency=4, quiet=True
+        )
+
+    assert total == len(received) == len(list(EMAIL_DATA_DIR.glob("*.eml")))
+    assert sorted(body["Subject"] for body, _ in received) == sorted(
+        payload["Subject"] for _, payload in _payloads()
+    )
+    assert len(failures) == 1
+
+
+def test_submit_by_alias_keeps_per_alias_order(inbound_server):
+    """Test that each alias gets its payloads in order, with per-file timing."""
+    url, received = inbound_server
+    payloads = list(_payloads())
+    by_alias = {"a@example.com": payloads[:5], "b@example.com": payloads[5:]}
+
+    with make_session("user", "password", concurrency=2) as session:
+        results = submit_by_alias(session, url, by_alias)
+
+    assert [(r.alias, r.name) for r in results] == [
+        (alias, name) for alias, items in by_alias.items() for name, _ in items
+    ]
+    assert all(r.elapsed > 0 for r in results)
+    assert [r.name for r in results if not r.ok] == ["2025-08-05 Welcome.eml"]
+    for alias, items in by_alias.items():
+        sent = [body["Subject"] for body, _ in received if body["Bcc"] == alias]
+        assert sent == [payload["Subject"] for _, payload in items]
+
+
+def test_iter_payloads_skips_unreadable_files(tmp_path, capsys):
+    """Test that a file that cannot be read is reported and skipped."""
+    good = sorted(EMAIL_DATA_DIR.glob("*.eml"))[:2]
+    missing = tmp_path / "missing.eml"
+    args = argparse.Namespace(
+        payloads=None,
+        mbox=None,
+        maildir=None,
+        dir=None,
+        glob=None,
+        file=[str(good[0]), str(missing), str(good[1])],
+        alias="test@example.com",
+    )
+    errors = []
+
+    names = [name for name, _ in _iter_payloads(args, errors)]
+
+    assert names == [str(good[0]), str(good[1])]
+    assert [name for name, _ in errors] == [str(missing)]
+    assert f"Skipping {missing}" in capsys.readouterr().err
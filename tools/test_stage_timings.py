@@ -0,0 +1,53 @@
+"""
+Tests for the stage timings aggregator.
+"""
+
+import io
+import json
+
+from tools.stage_timings import build_report, iter_log_messages, parse_timings
+
+
+def _line(fn, total, stages, status=200):
+    timings = {"function": fn, "status": status, "total_ms": total, "stages": stages}
+    return f"[{fn}] stage_timings {json.dumps(timings)}"
+
+
+def test_parse_timings_reads_text_and_json_exports():
+    """Test plain log lines, JSON lines and a JSON array export."""
+    line = _line("inbound-email", 12.5, {"auth": [0.2]})
+    text = io.StringIO(f"[inbound-email] Alias: a@b\n{line}\nnot json {{\n")
+    ndjson = io.StringIO(json.dumps({"event_message": line, "timestamp": 1}) + "\n")
+    array = io.StringIO(json.dumps([{"event_message": line}, {"other": 1}]))
+
+    for stream in (text, ndjson, array):
+        timings = list(parse_timings(iter_log_messages(stream)))
+        assert len(timings) == 1
+        assert timings[0]["stages"] == {"auth": [0.2]}
+
+
+def test_build_report_ranks_stages_by_time():
+    """Test per-stage percentiles, span counts and shares of request time."""
+    timings = list(
+        parse_timings(
+            [
+                _line("inbound-email", 100, {"auth": [1], "model": [90]}),
+                _line("inbound-email", 200, {"auth": [1], "model": [190]}, 500),
+                _line("reprocess-unprocessed", 50, {"model": [20, 25]}),
+            ]
+        )
+    )
+
+    report = build_report(timings)
+
+    inbound = report["inbound-email"]
+    assert inbound["requests"] == 2
+    assert inbound["status_codes"] == {"200": 1, "500": 1}
+    assert [s["stage"] for s in inbound["stages"]] == ["model", "auth"]
+    model = inbound["stages"][0]
+    assert model["spans"] == 2
+    assert model["share"] == 280 / 300
+    assert abs(model["percentiles"]["p50"] - 90_000) <= 900
+    assert abs(model["max"] - 190_000) <= 1900
+    reprocess = report["reprocess-unprocessed"]["stages"][0]
+    assert (reprocess["requests"], reprocess["spans"]) == (1, 2)